@@ -0,0 +1,43 @@
+"""CrazySLAM
+
+SLAM algorithm implemented on a Crazyflie.
+
+The main classes are available from the package and loaded on first access,
+so that importing crazyslam doesn't import the optional backends (cflib,
+pynput, matplotlib, scipy, scikit-image):
+    from crazyslam import SLAM
+"""
+
+
+import importlib
+
+
+# Public name -> module that defines it
+_LAZY_ATTRIBUTES = {
+    "SLAM": "crazyslam.slam",
+    "Localizer": "crazyslam.localizer",
+    "MapParams": "crazyslam.mapping",
+    "init_params_dict": "crazyslam.mapping",
+    "save_session": "crazyslam.persistence",
+    "load_session": "crazyslam.persistence",
+    "LatencyScheduler": "crazyslam.scheduler",
+    "TileExporter": "crazyslam.export",
+    "LiveViewer": "crazyslam.viewer",
+    "MapServer": "crazyslam.server",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(
+            "module 'crazyslam' has no attribute '{}'".format(name)
+        )
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,148 @@
+"""Beams module
+
+This module implements the policies used to reduce the work done at each
+step of the SLAM algorithm: selection of a subset of the beams of a scan,
+and decimation of the map updates when the vehicle barely moved.
+"""
+
+
+import numpy as np
+from crazyslam.mapping import target_cell, discretize
+
+
+def select_uniform_beams(n_angles, n_beams):
+    """Select beams evenly spread over the scan
+
+    Args:
+        n_angles: Number of beams in the scan
+        n_beams: Number of beams to select
+
+    Returns:
+        Indices of the selected beams
+    """
+    return np.unique(np.linspace(
+        0,
+        n_angles-1,
+        min(n_beams, n_angles),
+        dtype="int32",
+    ))
+
+
+def get_occupancy_entropy(log_odds):
+    """Entropy (in nats) of the occupancy of cells given their log odds"""
+    p = 1 / (1 + np.exp(-log_odds))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = -p*np.log(p) - (1-p)*np.log(1-p)
+    return np.nan_to_num(entropy)
+
+
+def select_informative_beams(grid_map, params, state, ranges, angles, n_beams):
+    """Select the beams that bring the most information to the map
+
+    The information gain of a beam is the entropy of the cell it ends in:
+    beams ending in unknown cells are preferred to beams ending in cells
+    that are already known to be free or occupied. To keep the beams spread
+    over the scan, the scan is split into n_beams sectors of consecutive
+    beams and the best beam of each sector is selected.
+
+    Args:
+        grid_map: Occupancy grid map
+        params: Grid map parameters dictionary or MapParams
+        state: State estimate (x, y, yaw)
+        ranges: Set of range inputs from the sensor
+        angles: Scan angles
+        n_beams: Number of beams to select
+
+    Returns:
+        Indices of the selected beams
+    """
+    n_angles = len(ranges)
+    if n_beams >= n_angles:
+        return np.arange(n_angles)
+    targets = discretize(
+        target_cell(state, ranges, angles).reshape((2, -1)),
+        params,
+    )
+    gain = get_occupancy_entropy(grid_map[targets[0], targets[1]])
+    sectors = (np.arange(n_angles) * n_beams) // n_angles
+    # sort by sector then gain, and keep the last beam of each sector
+    order = np.lexsort((gain, sectors))
+    last = np.ones(n_angles, dtype=bool)
+    last[:-1] = sectors[order][1:] != sectors[order][:-1]
+    return np.sort(order[last])
+
+
+class BeamBudget():
+    """
+    Number of beams that can be processed within a latency budget.
+
+    The cost of a beam is estimated from the measured latency of the
+    previous steps (exponential moving average).
+
+    Attributes:
+        target_latency: Latency budget of a step in seconds
+        min_beams: Minimum number of beams
+        max_beams: Maximum number of beams
+        smoothing: Weight of the last measurement in the moving average
+        beam_cost: Estimated cost of a beam in seconds (None until the first
+            measurement)
+        n_beams: Number of beams to use at the next step
+    """
+
+    def __init__(self, target_latency, min_beams, max_beams, smoothing=0.2):
+        """Initialize the budget with the maximum number of beams"""
+        self.target_latency = target_latency
+        self.min_beams = min_beams
+        self.max_beams = max_beams
+        self.smoothing = smoothing
+        self.beam_cost = None
+        self.n_beams = max_beams
+
+    def update(self, latency, n_beams):
+        """
+        Update the number of beams given the latency of the last step
+
+        Args:
+            latency: Measured latency of the last step in seconds
+            n_beams: Number of beams used at the last step
+
+        Returns:
+            Number of beams to use at the next step
+        """
+        cost = latency / max(n_beams, 1)
+        if self.beam_cost is None:
+            self.beam_cost = cost
+        else:
+            self.beam_cost += self.smoothing * (cost - self.beam_cost)
+        self.n_beams = int(np.clip(
+            self.target_latency // max(self.beam_cost, 1e-12),
+            self.min_beams,
+            self.max_beams,
+        ))
+        return self.n_beams
+
+
+def has_moved(state, reference_state, min_translation, min_rotation):
+    """Check if the vehicle moved enough since a reference state
+
+    Used to decimate the map updates: integrating scans taken from the same
+    pose brings little new information.
+
+    Args:
+        state: Current state (x, y, yaw)
+        reference_state: State at the last map update (None if no update
+            happened yet)
+        min_translation: Minimum translation in meters
+        min_rotation: Minimum rotation in radians
+
+    Returns:
+        True if the translation or the rotation reached its threshold
+    """
+    if reference_state is None:
+        return True
+    translation = np.hypot(
+        state[0] - reference_state[0],
+        state[1] - reference_state[1],
+    )
+    rotation = np.abs(np.angle(np.exp(1j * (state[2] - reference_state[2]))))
+    return translation >= min_translation or rotation >= min_rotation
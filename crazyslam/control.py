@@ -1,23 +1,45 @@
+"""Control module
+
+This module implements the keyboard control of the Crazyflie. Key events
+are pushed to a queue by the keyboard listener, and a controller consumes
+them on its own thread, so the control loop never blocks the SLAM loop (and
+the other way around). pynput is only imported when the listener is
+started.
+"""
+
+
 import os
-from pynput import keyboard
+import time
+import queue
+import threading
 
 
-def get_key_capture():
-    return keyCapture
+# Key name -> command
+KEYMAP = {
+    "z": "forward",
+    "q": "left",
+    "s": "backward",
+    "d": "right",
+    "a": "yaw_left",
+    "e": "yaw_right",
+    "down": "land",
+    "enter": "abort",
+}
 
 
-def on_release(key):
-    """Triggered by key release event. Save released key to global variable"""
-    global keyCapture
-    keyCapture = key
-    if key == keyboard.Key.esc:
-        return False
+def get_key_name(key):
+    """Name of a pynput key: its character, or the name of a special key"""
+    char = getattr(key, "char", None)
+    if char is not None:
+        return char
+    return getattr(key, "name", None)
 
 
-def key_controller(mc, current_velocity_x, current_velocity_y):
-    """Manage the keyboard control commands
+class KeyController():
+    """
+    Keyboard controller of a Crazyflie.
 
-    Keymap:
+    Keymap (see KEYMAP):
         z:      Forward
         q:      Left
         s:      Backward
@@ -25,56 +47,209 @@ def key_controller(mc, current_velocity_x, current_velocity_y):
         a:      Yaw left
         e:      Yaw right
         DOWN:   Land (Crazyflie lands softly)
-        ENTER:  Abort (Shut down motors)
+        ENTER:  Abort (the motors should be shut down by the caller)
 
-    Each command increments the speed in the proper axis/direction by VELOCITY
-    and then starts a linear motion with the updated velocity values on both
-    x and y axis.
-    Yaw commands however are blocking: at each press, the Crazyflie yaw for
-    YAW_DEG degrees.
+    Each translation command increments the speed in the proper
+    axis/direction by velocity. Yaw commands don't block: the vehicle turns
+    at yaw_rate while it keeps moving, until it turned by yaw_deg degrees
+    (each press extends the turn).
 
-    Args:
+    Attributes:
         mc: MotionCommander object
-        current_velocity_x: Current velocity on the x axis
-        current_velocity_y: CUrrent velocity on the y axis
-
-    Returns:
-        bool: True if ABORT command received
-        bool: True if LAND command received
-        float: Velocity along the x direction
-        float: Velocity along the y direction
+        velocity: Velocity increment of a command (meters/second)
+        yaw_deg: Angle of a yaw command (degrees)
+        yaw_rate: Yaw rate during a yaw command (degrees/second)
+        period: Maximum time between two iterations of the control loop
+        keymap: Key name -> command dictionary
+        events: Queue of the key names waiting to be handled
+        velocity_x, velocity_y: Current velocity setpoints
+        rate_yaw: Current yaw rate setpoint (positive to the right)
+        yaw_deadline: Time at which the current turn ends (None if the
+            vehicle isn't turning)
+        landed, aborted: Set when the LAND/ABORT command is received
     """
-    # Init constants
-    global keyCapture
-    VELOCITY = float(os.environ["VELOCITY"])
-    YAW_DEG = float(os.environ["YAW_DEG"])
-    RATE = float(os.environ["RATE"])
-
-    # ABORT
-    if keyCapture == keyboard.Key.enter:
-        return True, False, None, None
-    # OK LANDO, BOX BOX BOX
-    elif keyCapture == keyboard.Key.down:
-        mc.stop()
-        return False, True, 0, 0
-    # Control commands
-    elif keyCapture.char == 'z':
-        current_velocity_x += VELOCITY
-    elif keyCapture.char == 'q':
-        current_velocity_y += VELOCITY
-    elif keyCapture.char == 's':
-        current_velocity_x -= VELOCITY
-    elif keyCapture.char == 'd':
-        current_velocity_y -= VELOCITY
-    elif keyCapture.char == 'a':
-        mc.turn_left(angle_degrees=YAW_DEG, rate=RATE)
-    elif keyCapture.char == 'e':
-        mc.turn_right(angle_degrees=YAW_DEG, rate=RATE)
-    # Start motion
-    mc.start_linear_motion(
-        current_velocity_x,
-        current_velocity_y,
-        0
-    )
-    keyCapture = None
-    return False, False, current_velocity_x, current_velocity_y
+
+    def __init__(
+        self,
+        mc,
+        velocity=0.1,
+        yaw_deg=10.,
+        yaw_rate=360. / 5,
+        period=0.1,
+        keymap=None,
+        clock=time.monotonic,
+    ):
+        """Initialize a stopped controller"""
+        self.mc = mc
+        self.velocity = velocity
+        self.yaw_deg = yaw_deg
+        self.yaw_rate = yaw_rate
+        self.period = period
+        self.keymap = KEYMAP if keymap is None else keymap
+        self.clock = clock
+        self.events = queue.Queue()
+        self.velocity_x = 0.
+        self.velocity_y = 0.
+        self.rate_yaw = 0.
+        self.yaw_deadline = None
+        self.landed = threading.Event()
+        self.aborted = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.listener = None
+
+    @classmethod
+    def from_env(cls, mc, environ=None, **kwargs):
+        """
+        Create a controller configured by environment variables
+
+        VELOCITY (meters/second), YAW_DEG (degrees) and RATE
+        (degrees/second) are read once here.
+
+        Args:
+            mc: MotionCommander object
+            environ: Mapping to read the variables from (os.environ by
+                default)
+            kwargs: Other arguments of the controller
+        """
+        environ = os.environ if environ is None else environ
+        return cls(
+            mc,
+            velocity=float(environ["VELOCITY"]),
+            yaw_deg=float(environ["YAW_DEG"]),
+            yaw_rate=float(environ["RATE"]),
+            **kwargs,
+        )
+
+    @property
+    def done(self):
+        """True once the vehicle landed or the flight was aborted"""
+        return self.landed.is_set() or self.aborted.is_set()
+
+    def on_release(self, key):
+        """Triggered by key release event (pynput). Queue the key name"""
+        name = get_key_name(key)
+        if name == "esc":
+            return False
+        if name is not None:
+            self.events.put(name)
+
+    def handle(self, name, now):
+        """
+        Apply a key press to the setpoints
+
+        Args:
+            name: Key name
+            now: Current time (see clock)
+
+        Returns:
+            True if the setpoints changed
+        """
+        command = self.keymap.get(name)
+        if command == "abort":
+            self.aborted.set()
+        elif command == "land":
+            self.velocity_x = self.velocity_y = self.rate_yaw = 0.
+            self.yaw_deadline = None
+            self.mc.stop()
+            self.landed.set()
+        elif command == "forward":
+            self.velocity_x += self.velocity
+        elif command == "left":
+            self.velocity_y += self.velocity
+        elif command == "backward":
+            self.velocity_x -= self.velocity
+        elif command == "right":
+            self.velocity_y -= self.velocity
+        elif command in ("yaw_left", "yaw_right"):
+            rate = -self.yaw_rate if command == "yaw_left" else self.yaw_rate
+            duration = self.yaw_deg / self.yaw_rate
+            if self.yaw_deadline is None or rate != self.rate_yaw:
+                self.yaw_deadline = now + duration
+            else:
+                self.yaw_deadline += duration
+            self.rate_yaw = rate
+        else:
+            return False
+        return command not in ("abort", "land")
+
+    def step(self, timeout=0):
+        """
+        One iteration of the control loop
+
+        Handles the queued key presses (waiting up to timeout seconds for
+        the first one), ends the current turn if its deadline passed and
+        sends the new setpoints if they changed.
+
+        Args:
+            timeout: Maximum time to wait for a key press (seconds)
+        """
+        changed = False
+        try:
+            name = self.events.get(timeout=timeout) if timeout > 0 \
+                else self.events.get_nowait()
+            while True:
+                changed |= self.handle(name, self.clock())
+                if self.done:
+                    return
+                name = self.events.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.yaw_deadline is not None and self.clock() >= self.yaw_deadline:
+            self.rate_yaw = 0.
+            self.yaw_deadline = None
+            changed = True
+        if changed:
+            self.mc.start_linear_motion(
+                self.velocity_x,
+                self.velocity_y,
+                0,
+                rate_yaw=self.rate_yaw,
+            )
+
+    def run(self):
+        """Control loop, until landing, abort or stop"""
+        while not self.stop_event.is_set() and not self.done:
+            timeout = self.period
+            if self.yaw_deadline is not None:
+                timeout = min(timeout, max(
+                    self.yaw_deadline - self.clock(), 1e-3))
+            self.step(timeout)
+
+    def start(self, listen=True):
+        """
+        Start the control thread
+
+        Args:
+            listen: If True, also start a pynput keyboard listener feeding
+                the controller
+        """
+        if listen:
+            from pynput import keyboard
+            self.listener = keyboard.Listener(on_release=self.on_release)
+            self.listener.start()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the control thread and the keyboard listener"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def wait(self, timeout=None):
+        """
+        Wait for the end of the control loop (landing or abort)
+
+        Returns:
+            True if the flight was aborted
+        """
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.aborted.is_set()
@@ -0,0 +1,245 @@
+"""Export module
+
+This module converts the occupancy grid map (log odds) into images that can
+be used outside of the SLAM algorithm: ROS-style PGM + YAML maps, and PNG
+tiles at multiple zoom levels that are only rendered again for the regions
+of the map that changed.
+"""
+
+
+import os
+import zlib
+import struct
+import numpy as np
+from crazyslam.mapping import get_map_params
+
+
+# Pixel values of the ternary images (ROS map_server convention)
+OCCUPIED_PIXEL = 0
+FREE_PIXEL = 254
+UNKNOWN_PIXEL = 205
+
+
+def log_odds_to_probability(log_odds):
+    """Convert log odds into occupancy probabilities"""
+    return 1 / (1 + np.exp(-log_odds))
+
+
+def probability_to_log_odds(probability):
+    """Convert occupancy probabilities into log odds"""
+    return np.log(probability / (1 - probability))
+
+
+def to_ternary(log_odds, free_threshold=0.196, occupied_threshold=0.65):
+    """Convert log odds into a ternary (occupied/free/unknown) image
+
+    The thresholds are converted into log odds once, so the map itself never
+    goes through the exponential.
+
+    Args:
+        log_odds: Occupancy grid map, or part of it
+        free_threshold: Cells with a lower probability are free
+        occupied_threshold: Cells with a higher probability are occupied
+
+    Returns:
+        uint8 image (see OCCUPIED_PIXEL, FREE_PIXEL and UNKNOWN_PIXEL)
+    """
+    image = np.full(log_odds.shape, UNKNOWN_PIXEL, dtype=np.uint8)
+    image[log_odds > probability_to_log_odds(occupied_threshold)] = \
+        OCCUPIED_PIXEL
+    image[log_odds < probability_to_log_odds(free_threshold)] = FREE_PIXEL
+    return image
+
+
+def write_pgm(path, image):
+    """Write a uint8 image as a binary PGM file"""
+    with open(path, "wb") as file:
+        file.write("P5\n{} {}\n255\n".format(
+            image.shape[1],
+            image.shape[0],
+        ).encode())
+        file.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+
+
+def write_png(path, image, compression=6):
+    """Write a uint8 image as a grayscale PNG file"""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data \
+            + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+
+    height, width = image.shape
+    # each row starts with the filter type (0: none)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = image
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(
+            b"IHDR",
+            struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0),
+        ))
+        file.write(chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)))
+        file.write(chunk(b"IEND", b""))
+
+
+def export_ros_map(
+    grid, params, path,
+    free_threshold=0.196, occupied_threshold=0.65
+):
+    """Export the map in the ROS map_server format (PGM + YAML)
+
+    The image is written with the rows of the grid map, i.e. the ROS x axis
+    is the y axis of the map and the ROS y axis is the opposite of its x
+    axis.
+
+    Args:
+        grid: Occupancy grid map
+        params: Grid map parameters dictionary or MapParams
+        path: Path of the files, without extension
+        free_threshold: Cells with a lower probability are free
+        occupied_threshold: Cells with a higher probability are occupied
+    """
+    params = get_map_params(params)
+    write_pgm(
+        path + ".pgm",
+        to_ternary(grid, free_threshold, occupied_threshold),
+    )
+    # position of the lower left pixel in the ROS frame
+    (x_min, x_max), (y_min, _) = params.bounds
+    with open(path + ".yaml", "w") as file:
+        file.write(
+            "image: {}\n"
+            "resolution: {}\n"
+            "origin: [{}, {}, 0.0]\n"
+            "negate: 0\n"
+            "occupied_thresh: {}\n"
+            "free_thresh: {}\n".format(
+                os.path.basename(path) + ".pgm",
+                params.inverse_resolution,
+                y_min,
+                -x_max,
+                occupied_threshold,
+                free_threshold,
+            )
+        )
+
+
+def downsample(log_odds, factor):
+    """Downsample a map by taking the max log odd of each block
+
+    The max keeps the obstacles visible at low zoom levels.
+
+    Args:
+        log_odds: Occupancy grid map, or part of it
+        factor: Size of the blocks
+
+    Returns:
+        Downsampled map
+    """
+    if factor == 1:
+        return log_odds
+    n_x = -(-log_odds.shape[0] // factor)
+    n_y = -(-log_odds.shape[1] // factor)
+    padded = np.full((n_x * factor, n_y * factor), -np.inf)
+    padded[:log_odds.shape[0], :log_odds.shape[1]] = log_odds
+    return padded.reshape((n_x, factor, n_y, factor)).max(axis=(1, 3))
+
+
+class TileExporter():
+    """
+    Exports the map as PNG tiles at multiple zoom levels.
+
+    Tiles are written to out_dir/<level>/<row>/<column>.png. Level 0 is the
+    full resolution, and each level halves the resolution of the previous
+    one. Only the tiles that intersect the dirty regions of the map are
+    rendered again.
+
+    Attributes:
+        out_dir: Directory where the tiles are written
+        tile_size: Size of a tile in pixels
+        n_levels: Number of zoom levels
+        free_threshold: Cells with a lower probability are free
+        occupied_threshold: Cells with a higher probability are occupied
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        tile_size=256,
+        n_levels=3,
+        free_threshold=0.196,
+        occupied_threshold=0.65,
+    ):
+        """Initialize the exporter"""
+        self.out_dir = out_dir
+        self.tile_size = tile_size
+        self.n_levels = n_levels
+        self.free_threshold = free_threshold
+        self.occupied_threshold = occupied_threshold
+
+    def get_tile_path(self, level, row, column):
+        """Path of a tile"""
+        return os.path.join(
+            self.out_dir,
+            str(level),
+            str(row),
+            "{}.png".format(column),
+        )
+
+    def export_tile(self, grid, level, row, column):
+        """
+        Render and write a single tile
+
+        Args:
+            grid: Occupancy grid map
+            level: Zoom level
+            row, column: Index of the tile at this level
+
+        Returns:
+            Path of the tile
+        """
+        span = self.tile_size * 2**level  # number of map cells in a tile
+        block = grid[row*span:(row+1)*span, column*span:(column+1)*span]
+        image = np.full(
+            (self.tile_size, self.tile_size),
+            UNKNOWN_PIXEL,
+            dtype=np.uint8,
+        )
+        tile = to_ternary(
+            downsample(block, 2**level),
+            self.free_threshold,
+            self.occupied_threshold,
+        )
+        image[:tile.shape[0], :tile.shape[1]] = tile
+        path = self.get_tile_path(level, row, column)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_png(path, image)
+        return path
+
+    def export(self, grid, dirty_regions=None):
+        """
+        Write the tiles that intersect the dirty regions
+
+        Args:
+            grid: Occupancy grid map
+            dirty_regions: List of (x_min, x_max, y_min, y_max) regions (see
+                SLAM.pop_dirty_regions). If None, all the tiles are written
+
+        Returns:
+            List of the paths of the written tiles
+        """
+        if dirty_regions is None:
+            dirty_regions = [(0, grid.shape[0], 0, grid.shape[1])]
+        tiles = set()
+        for x_min, x_max, y_min, y_max in dirty_regions:
+            for level in range(self.n_levels):
+                span = self.tile_size * 2**level
+                for row in range(x_min // span, (x_max - 1) // span + 1):
+                    for column in range(
+                        y_min // span,
+                        (y_max - 1) // span + 1,
+                    ):
+                        tiles.add((level, row, column))
+        return [
+            self.export_tile(grid, level, row, column)
+            for level, row, column in sorted(tiles)
+        ]
@@ -6,13 +6,15 @@ Crazyflie using a particle filter
 
 
 import numpy as np
-from crazyslam.mapping import target_cell, discretize
+from crazyslam.mapping import target_cell, discretize, get_packed_occupancy, \
+    cell_to_position
+from crazyslam.rng import get_rng
 
 
-def init_random_particles(n):
-    """Initializes a set of n random particles"""
+def init_random_particles(n, rng=None):
+    """Initializes a set of n random particles (see crazyslam.rng for rng)"""
     random_states = np.zeros((3, n))
-    random_states[2, :] = np.random.uniform(
+    random_states[2, :] = get_rng(rng).uniform(
         low=-5,
         high=2,
         size=n
@@ -27,18 +29,139 @@ def init_random_particles(n):
     return random_particles
 
 
-def add_random_noise(states, system_noise_variance):
+def index_free_space(grid_map):
+    """Index the free cells of a grid map
+
+    Args:
+        grid_map: Occupancy grid map
+
+    Returns:
+        Flat indices of the cells with a negative log odd
+    """
+    return np.flatnonzero(grid_map < 0)
+
+
+def init_uniform_particles(n, free_cells, map_shape, map_params, rng=None):
+    """Initializes a set of n particles uniformly distributed in free space
+
+    Positions are drawn uniformly among the free cells, then uniformly inside
+    each cell. Yaws are drawn uniformly in [-pi, pi).
+
+    Args:
+        n: Number of particles
+        free_cells: Flat indices of the free cells (see index_free_space)
+        map_shape: Shape of the grid map
+        map_params: Grid map parameters dictionary
+        rng: Random generator (see crazyslam.rng)
+
+    Returns:
+        Set of particles with uniform weights
+    """
+    assert len(free_cells) > 0, "No free cell to draw particles from"
+    rng = get_rng(rng)
+    cells = np.unravel_index(
+        rng.choice(free_cells, size=n),
+        map_shape,
+    )
+    particles = np.empty((4, n))
+    particles[:2, :] = cell_to_position(
+        np.stack(cells), map_params, rng.uniform(size=(2, n))
+    )
+    particles[2, :] = rng.uniform(low=-np.pi, high=np.pi, size=n)
+    particles[3, :] = 1 / n
+    return particles
+
+
+def get_average_log_likelihood(scores):
+    """Log of the average likelihood of the particles given their scores
+
+    Scores are log weights (see normalize_weights), so the average is
+    computed with a shifted log-sum-exp to avoid exploding exp values.
+    """
+    max_score = scores.max()
+    return max_score + np.log(np.mean(np.exp(scores - max_score)))
+
+
+def update_likelihood_averages(
+    averages, log_likelihood,
+    alpha_slow, alpha_fast
+):
+    """Updates the short and long term averages of the log likelihood
+
+    Args:
+        averages: (slow, fast) averages, or None at the first iteration
+        log_likelihood: Average log likelihood at the current iteration
+        alpha_slow: Smoothing factor of the long term average
+        alpha_fast: Smoothing factor of the short term average
+
+    Returns:
+        Updated (slow, fast) averages
+    """
+    if averages is None:
+        return log_likelihood, log_likelihood
+    slow, fast = averages
+    slow += alpha_slow * (log_likelihood - slow)
+    fast += alpha_fast * (log_likelihood - fast)
+    return slow, fast
+
+
+def get_injection_probability(averages):
+    """Probability of replacing a particle with a random one (augmented MCL)
+
+    Particles are injected when the short term average of the likelihood
+    drops below the long term average. Averages are tracked in the log
+    domain, so the ratio fast/slow becomes exp(fast - slow).
+    """
+    slow, fast = averages
+    return max(0., 1. - np.exp(fast - slow))
+
+
+def inject_random_particles(
+    particles, probability,
+    free_cells, map_shape, map_params,
+    rng=None,
+):
+    """Replaces each particle with a random one with a given probability
+
+    Args:
+        particles: Set of state estimates and their corresponding weight
+        probability: Probability of replacing a particle
+        free_cells: Flat indices of the free cells (see index_free_space)
+        map_shape: Shape of the grid map
+        map_params: Grid map parameters dictionary
+        rng: Random generator (see crazyslam.rng)
+
+    Returns:
+        Set of particles
+    """
+    rng = get_rng(rng)
+    n = particles.shape[1]
+    replaced = np.flatnonzero(rng.uniform(size=n) < probability)
+    if len(replaced) > 0:
+        particles[:, replaced] = init_uniform_particles(
+            len(replaced),
+            free_cells,
+            map_shape,
+            map_params,
+            rng,
+        )
+        particles[3, :] = 1 / n
+    return particles
+
+
+def add_random_noise(states, system_noise_variance, rng=None):
     """Adds random noise to the particles given the system noise variance
 
     Args:
         states: States of the particles after motion model update
         system_noise_variance:
+        rng: Random generator (see crazyslam.rng)
 
     Returns:
         States of the particles
     """
     assert states.shape[0] == 3, "State vector error : Wrong shape"
-    states += np.random.multivariate_normal(
+    states += get_rng(rng).multivariate_normal(
         mean=np.zeros(3),
         cov=system_noise_variance,
         size=states.shape[1]
@@ -55,38 +178,44 @@ def normalize_weights(weights):
     return normalized_weights
 
 
-def get_correlation_score(grid_map, target_cells, correlation_matrix):
-    """Computes the correlation score of a single particle
+def get_correlation_score(
+    grid_map, target_cells, correlation_matrix,
+    occupancy=None, outside=None
+):
+    """Computes the correlation score of the particles
 
     Args:
         grid_map: Occupancy grid map
         target_cells: 2D or 3D vector (2 x n_cells x n_particles)
             of index coordinates
         correlation_matrix: Matrix with the scores hits/misses
+        occupancy: Optional packed bitmask of grid_map (see
+            mapping.pack_occupancy). If given, the occupancy of the cells
+            is read from it instead of the log odds (1 bit per cell instead
+            of 8 bytes)
+        outside: Optional boolean mask (n_cells x n_particles) of the
+            cells that were outside the map before being clipped to its
+            border. They are counted as misses
 
     Returns:
-        Colleration score for a single particle
-    """
-    if target_cells.ndim == 3:
-        n_particles = target_cells.shape[2]
-        n_cells = target_cells.shape[1]
-        target_maps = np.vstack(
-            [grid_map[target_cells[0, :, i], target_cells[1, :, i]] > 0
-             for i in range(n_particles)]  # TODO: delete for loop
-        )
-        hits = np.sum(target_maps, axis=1)
-        misses = n_cells * np.ones_like(hits) - hits
-    elif target_cells.ndim == 2:
-        target_map = grid_map[target_cells[0, :], target_cells[1, :]] > 0
-        hits = np.sum(target_map)
-        misses = target_map.size - hits
+        Colleration score of each particle (or of the single particle)
+    """
+    if occupancy is None:
+        occupied = grid_map[target_cells[0], target_cells[1]] > 0
+    else:
+        occupied = get_packed_occupancy(occupancy, target_cells)
+    if outside is not None:
+        occupied &= ~outside
+    hits = np.sum(occupied, axis=0)
+    misses = occupied.shape[0] - hits
     return hits*correlation_matrix[1, 1] + misses*correlation_matrix[0, 1]
 
 
 def update_particle_weights(
     particles, correlation_matrix,
     grid_map, map_params,
-    ranges, angles
+    ranges, angles,
+    occupancy=None,
 ):
     """Updates the particle weights
 
@@ -97,18 +226,24 @@ def update_particle_weights(
         map_params: Grid map parameters dictionary
         ranges: Set on range inputs from sensor
         angles: Scan angles
+        occupancy: Optional packed bitmask of grid_map (see
+            get_correlation_score)
 
     Returns:
         Set of particles with updated weights
     """
-    # Find target cells
+    # Find target cells (target_cell squeezes a single beam or particle)
     target_cells = target_cell(particles[:3, :], ranges, angles)
-    target_cells = discretize(target_cells, map_params)
+    target_cells = discretize(
+        target_cells.reshape((2, len(angles), particles.shape[1])),
+        map_params,
+    )
     # Compute correlation scores
     particles[-1, :] = get_correlation_score(
         grid_map,
         target_cells,
         correlation_matrix,
+        occupancy,
     )
     # Normalize all weights
     particles[-1, :] = normalize_weights(particles[-1, :])
@@ -127,14 +262,146 @@ def get_best_particle(particles):
     return particles[:, np.argmax(particles[-1, :])]
 
 
+def get_best_state(particles):
+    """State (x, y, yaw) of the best particle (see get_best_particle)"""
+    return get_best_particle(particles)[:-1]
+
+
+def get_weighted_moments(particles):
+    """Weighted mean and covariance of the particles, in one pass
+
+    The yaw is averaged on the circle (atan2 of the weighted sines and
+    cosines). The states are projected on (x, y, cos(yaw), sin(yaw)), so a
+    single product gives all the first and second moments, and the yaw
+    deviations are measured as sin(yaw - mean yaw) (close to the angle
+    difference when the particles are concentrated).
+
+    Args:
+        particles: Set of state estimates and their corresponding weight
+
+    Returns:
+        Mean state (x, y, yaw)
+        3 x 3 covariance matrix
+    """
+    weights = particles[3, :] / particles[3, :].sum()
+    # positions relative to a particle, to keep the precision of the
+    # second moments far from the origin
+    reference = particles[:2, :1]
+    features = np.stack((
+        particles[0, :] - reference[0],
+        particles[1, :] - reference[1],
+        np.cos(particles[2, :]),
+        np.sin(particles[2, :]),
+    ))
+    weighted = features * weights
+    first = weighted.sum(axis=1)
+    second = weighted @ features.T
+
+    yaw = np.arctan2(first[3], first[2])
+    projection = np.array([
+        [1, 0, 0, 0],
+        [0, 1, 0, 0],
+        [0, 0, -np.sin(yaw), np.cos(yaw)],
+    ])
+    covariance = projection @ (second - np.outer(first, first)) \
+        @ projection.T
+    mean = np.array([
+        first[0] + reference[0, 0],
+        first[1] + reference[1, 0],
+        yaw,
+    ])
+    return mean, covariance
+
+
+def get_weighted_mean(particles):
+    """Weighted mean state of the particles (see get_weighted_moments)"""
+    return get_weighted_moments(particles)[0]
+
+
+def get_top_modes(particles, k=3, cell_size=0.2, n_yaw_bins=8):
+    """Find the k most likely hypotheses of the particle set
+
+    Particles are hashed into bins of cell_size meters and 2*pi/n_yaw_bins
+    radians, then the weights and weighted states of each bin are summed
+    (one sort and one reduction over the particles).
+
+    Args:
+        particles: Set of state estimates and their corresponding weight
+        k: Maximum number of hypotheses
+        cell_size: Size of the bins along x and y in meters
+        n_yaw_bins: Number of bins along the yaw
+
+    Returns:
+        4 x k' array (k' <= k) of hypotheses, sorted by decreasing weight:
+        weighted mean state of the bin (circular yaw) and total weight
+    """
+    weights = particles[3, :] / particles[3, :].sum()
+    cos, sin = np.cos(particles[2, :]), np.sin(particles[2, :])
+    bins = np.floor(particles[:2, :] / cell_size).astype(np.int64)
+    bins -= bins.min(axis=1, keepdims=True)
+    yaw_bins = np.floor(
+        (np.arctan2(sin, cos) + np.pi) * n_yaw_bins / (2*np.pi)
+    ).astype(np.int64) % n_yaw_bins
+    keys = (bins[0] * (bins[1].max() + 1) + bins[1]) * n_yaw_bins + yaw_bins
+
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    weighted = np.stack((
+        particles[0, order],
+        particles[1, order],
+        cos[order],
+        sin[order],
+        np.ones(len(order), dtype=particles.dtype),
+    )) * weights[order]
+    sums = np.add.reduceat(weighted, starts, axis=1)
+
+    top = np.argsort(-sums[4], kind="stable")[:k]
+    sums = sums[:, top]
+    return np.stack((
+        sums[0] / sums[4],
+        sums[1] / sums[4],
+        np.arctan2(sums[3], sums[2]),
+        sums[4],
+    ))
+
+
+def get_best_mode(particles):
+    """Mean state of the most likely hypothesis (see get_top_modes)"""
+    return get_top_modes(particles, k=1)[:3, 0]
+
+
+ESTIMATORS = {
+    "best": get_best_state,
+    "mean": get_weighted_mean,
+    "mode": get_best_mode,
+}
+
+
+def get_estimator(estimator):
+    """Return a state estimator given its name (see ESTIMATORS) or itself
+
+    An estimator is a function returning a state (x, y, yaw) given a set of
+    weighted particles.
+    """
+    if callable(estimator):
+        return estimator
+    assert estimator in ESTIMATORS, \
+        "Unknown estimator: {}".format(estimator)
+    return ESTIMATORS[estimator]
+
+
 def compute_effective_n_particles(weights):
     """Compute effective number of particles given their weights"""
     return (weights.sum()**2) / (weights**2).sum()
 
 
-def resample(particles):
-    """Resamples particles given their weights/probability"""
-    idx = np.random.choice(
+def resample(particles, rng=None):
+    """Resamples particles given their weights/probability
+
+    rng is the random generator (see crazyslam.rng).
+    """
+    idx = get_rng(rng).choice(
         a=np.arange(0, particles.shape[1], 1),
         size=particles.shape[1],
         replace=True,
@@ -143,12 +410,40 @@ def resample(particles):
     return particles[:, idx]
 
 
+def resize_particles(particles, n, rng=None):
+    """Draws a new set of n particles given their weights/probability
+
+    Used to change the number of particles of the filter. The weights of the
+    drawn particles are normalized again.
+
+    Args:
+        particles: Set of state estimates and their corresponding weight
+        n: Number of particles in the new set
+        rng: Random generator (see crazyslam.rng)
+
+    Returns:
+        New set of n particles
+    """
+    idx = get_rng(rng).choice(
+        a=np.arange(0, particles.shape[1], 1),
+        size=n,
+        replace=True,
+        p=particles[3, :] / particles[3, :].sum()
+    )
+    particles = particles[:, idx]
+    particles[3, :] /= particles[3, :].sum()
+    return particles
+
+
 def get_state_estimate(
     particles,
     system_noise_variance, correlation_matrix,
     grid_map, map_params,
     ranges, angles,
-    resample_threshold
+    resample_threshold,
+    estimator=None,
+    occupancy=None,
+    rng=None,
 ):
     """Computes a state estimate using a particle filter
 
@@ -161,6 +456,11 @@ def get_state_estimate(
         ranges: Set on range inputs from sensor
         angles: Scan angles
         resample_threshold: Threshold for resampling
+        estimator: Function computing the state estimate from the weighted
+            particles (see ESTIMATORS). Best particle by default
+        occupancy: Optional packed bitmask of grid_map (see
+            get_correlation_score)
+        rng: Random generator (see crazyslam.rng)
 
     Returns:
         State vector representing the new state estimate.
@@ -170,7 +470,8 @@ def get_state_estimate(
     # Propagate the particles
     particles[:-1, :] = add_random_noise(
         particles[:-1, :],
-        system_noise_variance
+        system_noise_variance,
+        rng,
     )
     # Weight update
     particles = update_particle_weights(
@@ -180,11 +481,15 @@ def get_state_estimate(
         map_params,
         ranges,
         angles,
+        occupancy,
     )
-    # Choose the best particle to update the pose
-    best_state_estimate = get_best_particle(particles)
+    # Choose the best particle (or use the estimator) to update the pose
+    if estimator is None:
+        state_estimate = get_best_particle(particles)[:-1]
+    else:
+        state_estimate = estimator(particles)
     # Resample if the effective number of particles is smaller than a threshold
     if compute_effective_n_particles(particles[-1, :]) < resample_threshold:
-        particles = resample(particles)
+        particles = resample(particles, rng)
     # Return new pose and particles
-    return best_state_estimate[:-1], particles
+    return state_estimate, particles
@@ -0,0 +1,330 @@
+"""Localizer module
+
+This module implements a localization-only agent that runs the particle
+filter against a fixed, prebuilt map. Since the map never changes, every
+lookup structure is computed once when the localizer is created and the
+map update step is skipped.
+"""
+
+
+import numpy as np
+from crazyslam.mapping import target_cell, discretize, pack_occupancy, \
+    build_map_pyramid, compute_likelihood_field, get_map_params, is_outside
+from crazyslam.localization import add_random_noise, normalize_weights, \
+    get_best_particle, compute_effective_n_particles, resample, \
+    index_free_space, init_uniform_particles, \
+    update_likelihood_averages, get_injection_probability, \
+    inject_random_particles, get_correlation_score
+from crazyslam.motion import get_motion_model
+from crazyslam.rng import get_rng
+
+
+class Localizer():
+    """
+    Localization agent on a fixed map.
+
+    Attributes:
+        params: Grid map parameters (MapParams)
+        angles: Scan angles
+        n_particles: Number of particles for the Particle Filter
+        system_noise_variance: Variance for noise generation
+        correlation_matrix: Matrix for computing the correlation scores
+        resampling_threshold: Threshold for resampling
+        current_state: Current state (i.e. particle with the highest score)
+        particles: Set of state estimates and their corresponding weight
+        motion_model: Function used to propagate the particles (see
+            crazyslam.motion)
+        motion_noise: Standard deviation of the motion model noise
+        rng: Random generator of the filter (see crazyslam.rng)
+        occupancy: Packed bitmask of the occupied cells of the map
+        likelihood_field: Log likelihood field of the map (None if the
+            correlation score is used)
+        pyramid: Multi-resolution occupancy maps, finest first (used by
+            relocalize for a coarse scoring of the candidates)
+        free_cells: Flat indices of the free cells of the map
+        alpha_slow, alpha_fast: Smoothing factors of the likelihood averages
+            used for random particle injection (None to disable injection)
+        likelihood_averages: Long and short term averages of the log
+            likelihood
+    """
+
+    def __init__(
+        self,
+        grid_map,
+        params,
+        angles,
+        particles,
+        system_noise_variance,
+        correlation_matrix,
+        likelihood_sigma=None,
+        n_levels=4,
+        alpha_slow=None,
+        alpha_fast=None,
+        motion_model="global",
+        motion_noise=None,
+        rng=None,
+    ):
+        """
+        Initialize a localizer and precompute the map lookups.
+
+        If likelihood_sigma is None, particles are scored with the
+        correlation score (hits/misses on the occupancy bitmask). Otherwise
+        they are scored with a likelihood field of standard deviation
+        likelihood_sigma (in meters).
+
+        If alpha_slow and alpha_fast are set, random particles are injected
+        in free space when the short term average of the likelihood drops
+        below its long term average (augmented MCL), so that a lost vehicle
+        can recover. alpha_fast should be larger than alpha_slow.
+
+        n_levels is the number of levels of the map pyramid, including the
+        full resolution map.
+
+        rng is a numpy Generator or a seed (see crazyslam.rng). The global
+        numpy random state is used if it is None.
+        """
+        self.params = get_map_params(params)
+        self.angles = np.asarray(angles).reshape(-1)
+        self.particles = particles
+        self.n_particles = particles.shape[1]
+        self.system_noise_variance = system_noise_variance
+        self.correlation_matrix = correlation_matrix
+        self.resampling_threshold = (self.n_particles * 10) // 100
+        self.current_state = get_best_particle(particles)[:-1].copy()
+        self.motion_model = get_motion_model(motion_model)
+        self.motion_noise = motion_noise
+        self.rng = None if rng is None else get_rng(rng)
+
+        # Precomputed lookups
+        self.occupancy = pack_occupancy(grid_map)
+        self.pyramid = build_map_pyramid(grid_map > 0, n_levels)
+        self.free_cells = index_free_space(grid_map)
+        self.map_shape = grid_map.shape
+        self.likelihood_field = None
+        if likelihood_sigma is not None:
+            self.likelihood_field = compute_likelihood_field(
+                grid_map,
+                params,
+                likelihood_sigma,
+            )
+
+        # Random particle injection
+        self.alpha_slow = alpha_slow
+        self.alpha_fast = alpha_fast
+        self.likelihood_averages = None
+
+    def relocalize(self, ranges=None, hits=None, oversampling=10):
+        """
+        Spread all the particles uniformly in the free space of the map
+
+        Used for global localization, when the initial state is unknown or
+        when the vehicle is lost. If a scan is given, oversampling times more
+        candidates are drawn and scored against the coarsest level of the
+        pyramid, and only the n_particles best ones are kept. The full
+        resolution scoring of update_state then refines them.
+
+        Args:
+            ranges: Optional range inputs used to select the candidates
+            hits: Optional boolean mask of the beams that hit an obstacle
+            oversampling: Number of candidates per particle
+        """
+        if ranges is None:
+            oversampling = 1
+        particles = init_uniform_particles(
+            oversampling * self.n_particles,
+            self.free_cells,
+            self.map_shape,
+            self.params,
+            self.rng,
+        )
+        if ranges is not None:
+            angles = self.angles
+            if hits is not None:
+                ranges, angles = ranges[hits], angles[hits]
+            scores = self.score_coarse(particles[:3, :], ranges, angles)
+            best = np.argpartition(-scores, self.n_particles - 1)
+            particles = particles[:, best[:self.n_particles]]
+            particles[3, :] = 1 / self.n_particles
+        self.particles = particles
+        self.likelihood_averages = None
+
+    def score_coarse(self, states, ranges, angles, level=-1):
+        """
+        Compute the correlation score of a set of states on a coarse level
+        of the map pyramid
+
+        A coarse cell is occupied if any of the cells it covers is occupied,
+        so the score is tolerant to errors of a few cells.
+
+        Args:
+            states: States to score (3 x n)
+            ranges: Set on range inputs from sensor
+            angles: Scan angles
+            level: Level of the pyramid (the coarsest by default)
+
+        Returns:
+            Score of each state
+        """
+        shift = level % len(self.pyramid)
+        target_cells = target_cell(states, ranges, angles)
+        target_cells = discretize(
+            target_cells.reshape((2, len(angles), -1)),
+            self.params,
+        )
+        return get_correlation_score(
+            self.pyramid[level],
+            target_cells >> shift,
+            self.correlation_matrix,
+        )
+
+    def score(self, target_cells, outside=None):
+        """
+        Compute the score of each particle
+
+        Args:
+            target_cells: 3D vector (2 x n_cells x n_particles) of index
+                coordinates
+            outside: Optional boolean mask (n_cells x n_particles) of the
+                cells outside the map, scored as misses
+
+        Returns:
+            Score of each particle
+        """
+        if self.likelihood_field is not None:
+            log_likelihoods = self.likelihood_field[
+                target_cells[0],
+                target_cells[1],
+            ]
+            if outside is not None:
+                log_likelihoods[outside] = self.likelihood_field.min()
+            return log_likelihoods.sum(axis=0)
+        return get_correlation_score(
+            None,
+            target_cells,
+            self.correlation_matrix,
+            self.occupancy,
+            outside,
+        )
+
+    def get_log_likelihood(self, target_cells, outside, weights):
+        """
+        Log of the average likelihood of a beam
+
+        The raw scores depend on the units of the correlation matrix and on
+        the number of beams, and a single lost beam changes them a lot. The
+        likelihood of a beam is instead the fraction of the beams that end
+        in an occupied cell, averaged with the weights of the particles.
+        It stays close to 1 while tracking and drops when no particle
+        explains the scan anymore.
+
+        Args:
+            target_cells: 3D vector (2 x n_cells x n_particles) of index
+                coordinates
+            outside: Boolean mask of the cells outside the map
+            weights: Normalized weights of the particles
+
+        Returns:
+            Log likelihood, None if no beam was scored
+        """
+        n_beams = target_cells.shape[1]
+        if n_beams == 0:
+            return None
+        hits = self.pyramid[0][target_cells[0], target_cells[1]] & ~outside
+        hit_rate = np.dot(hits.sum(axis=0), weights) / n_beams
+        return np.log(max(hit_rate, 1e-3))
+
+    def update_state(self, ranges, motion_update, hits=None):
+        """
+        Update state estimate. One iteration of the particle filter
+
+        Args:
+            ranges: Set on range inputs from sensor
+            motion_update: Input of the motion model
+            hits: Optional boolean mask of the beams that hit an obstacle
+                (see crazyslam.preprocessing). Only those are scored
+
+        Returns:
+            Updated state estimate
+        """
+        # motion model update
+        self.motion_model(
+            self.particles[:3, :],
+            motion_update,
+            self.motion_noise,
+            self.rng,
+        )
+        self.particles[:3, :] = add_random_noise(
+            self.particles[:3, :],
+            self.system_noise_variance,
+            self.rng,
+        )
+
+        # weight update
+        angles = self.angles
+        if hits is not None:
+            ranges, angles = ranges[hits], angles[hits]
+        target_cells = target_cell(
+            self.particles[:3, :],
+            ranges,
+            angles,
+        ).reshape((2, len(angles), self.n_particles))
+        # beams ending outside the map are clipped to its border, which is
+        # usually a wall: they would all look like hits
+        outside = is_outside(target_cells, self.params)
+        target_cells = discretize(target_cells, self.params)
+        scores = self.score(target_cells, outside)
+        self.particles[-1, :] = normalize_weights(scores)
+        log_likelihood = None
+        if self.alpha_slow is not None and self.alpha_fast is not None:
+            log_likelihood = self.get_log_likelihood(
+                target_cells,
+                outside,
+                self.particles[-1, :],
+            )
+
+        # state update
+        self.current_state = get_best_particle(self.particles)[:-1].copy()
+        if compute_effective_n_particles(self.particles[-1, :]) \
+                < self.resampling_threshold:
+            self.particles = resample(self.particles, self.rng)
+
+        # random particle injection
+        if log_likelihood is not None:
+            self.likelihood_averages = update_likelihood_averages(
+                self.likelihood_averages,
+                log_likelihood,
+                self.alpha_slow,
+                self.alpha_fast,
+            )
+            self.particles = inject_random_particles(
+                self.particles,
+                get_injection_probability(self.likelihood_averages),
+                self.free_cells,
+                self.map_shape,
+                self.params,
+                self.rng,
+            )
+        return self.current_state
+
+    def step(self, ranges_batch, motion_batch, hits_batch=None):
+        """
+        Run the particle filter on a batch of consecutive scans
+
+        Args:
+            ranges_batch: Range inputs (n_angles x n_steps)
+            motion_batch: Inputs of the motion model (3 x n_steps)
+            hits_batch: Optional boolean mask of the beams that hit an
+                obstacle (n_angles x n_steps)
+
+        Returns:
+            State estimates (3 x n_steps)
+        """
+        n_steps = ranges_batch.shape[1]
+        states = np.zeros((3, n_steps))
+        for t in range(n_steps):
+            states[:, t] = self.update_state(
+                ranges_batch[:, t],
+                motion_batch[:, t],
+                None if hits_batch is None else hits_batch[:, t],
+            )
+        return states
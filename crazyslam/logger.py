@@ -1,15 +1,17 @@
-"""Logging module
+"""Logger module
 
 This module logs variables that are coming from the Crazyflie (range data and a
 state estimate (x, y and yaw)) and that are needed for the slam algorithm. Also
 writes all the logged data to disk for post flight analysis
 
+The module is not named logging to avoid shadowing the standard library, and
+cflib is only imported when the logging is started.
+
 PROBLEM: File name have to be hardcoded in callback function
 """
 
 import os
 import time
-from cflib.crazyflie.log import LogConfig
 
 
 def init_log_conf(scf, callback, data_dir):
@@ -20,6 +22,7 @@ def init_log_conf(scf, callback, data_dir):
         callback: Function called when new data is received
         data_dir: Directory where the log file will be saved
     """
+    from cflib.crazyflie.log import LogConfig
     log_conf = LogConfig(name='MainLog', period_in_ms=100)
 
     # Logged variables
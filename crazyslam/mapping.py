@@ -6,17 +6,33 @@ map using ultrasound sensors range inputs.
 
 
 import numpy as np
-from skimage.draw import line as bresenham
 from math import floor
 
 
+# Log odds update rules
+LOG_ODD_MAX = 100
+LOG_ODD_MIN = -50
+LOG_ODD_OCCU = 1
+LOG_ODD_FREE = 0.3
+
+# Mask of the bit of each column within a packed byte (see pack_occupancy)
+BIT_MASKS = np.array([128 >> i for i in range(8)], dtype=np.uint8)
+
+
+def get_n_cells(size, resolution):
+    """Number of cells needed to cover size meters at a given resolution"""
+    # round first so that float errors don't add an extra cell
+    return int(np.ceil(round(size * resolution, 9)))
+
+
 def init_params_dict(size, resolution, origin=None):
     """Initialize the parameters dictionary given a map size and resolution
 
     If origin is None, sets it to be in the middle of the map
 
     Args:
-        size: Size of the square map in meters
+        size: Size of the square map in meters, or (size_x, size_y) for a
+            rectangular map
         resolution: Number of cells to subdivide 1 meter into
         origin: Cell that represents the origin
 
@@ -32,29 +48,156 @@ def init_params_dict(size, resolution, origin=None):
         "origin": origin,
     }
     if params["origin"] is None:  # if origin is not set
+        size_x, size_y = np.broadcast_to(params["size"], 2)
         params["origin"] = (
-            floor(params["resolution"]*params["size"] / 2),
-            floor(params["resolution"]*params["size"] / 2),
+            floor(get_n_cells(size_x, params["resolution"]) / 2),
+            floor(get_n_cells(size_y, params["resolution"]) / 2),
         )
     return params
 
 
-def create_empty_map(params):
+class MapParams():
+    """
+    Grid map parameters, with the map geometry precomputed once.
+
+    Immutable replacement of the parameters dictionary. It can still be read
+    like the dictionary (params["resolution"], params["size"] and
+    params["origin"]), so it is accepted everywhere the dictionary is.
+
+    Attributes:
+        resolution: Number of cells to subdivide 1 meter into
+        size: Size of the map in meters (scalar or (size_x, size_y))
+        origin: Cell that represents the origin
+        shape: Number of cells along each axis
+        inverse_resolution: Size of a cell in meters
+        origin_offset: Origin as an int32 array of shape (2,)
+        max_index: Last valid index along each axis, int32 array of shape (2,)
+        bounds: ((x_min, x_max), (y_min, y_max)) GLOBAL coordinates covered
+            by the map
+    """
+
+    __slots__ = (
+        "resolution",
+        "size",
+        "origin",
+        "shape",
+        "inverse_resolution",
+        "origin_offset",
+        "max_index",
+        "bounds",
+    )
+
+    def __init__(self, size, resolution, origin=None):
+        """Initialize the parameters, see init_params_dict
+
+        Raises:
+            ValueError: If the size or the resolution is not positive, or if
+                the origin is not a cell of the map
+        """
+        if resolution <= 0:
+            raise ValueError("The resolution must be positive")
+        if np.any(np.asarray(size) <= 0):
+            raise ValueError("The size must be positive")
+        params = init_params_dict(size, resolution, origin)
+        size = params["size"]
+        if np.ndim(size) != 0:
+            size = tuple(size)
+        shape = tuple(
+            get_n_cells(s, resolution) for s in np.broadcast_to(size, 2)
+        )
+        origin_offset = np.array(params["origin"], dtype=np.int32)
+        if origin_offset.shape != (2,) or (origin_offset < 0).any() \
+                or (origin_offset >= shape).any():
+            raise ValueError(
+                "The origin {} is outside the map of shape {}".format(
+                    params["origin"], shape
+                )
+            )
+        max_index = np.array(shape, dtype=np.int32) - 1
+        set_attribute = super().__setattr__
+        set_attribute("resolution", resolution)
+        set_attribute("size", size)
+        set_attribute("origin", tuple(int(i) for i in params["origin"]))
+        set_attribute("shape", shape)
+        set_attribute("inverse_resolution", 1 / resolution)
+        set_attribute("origin_offset", origin_offset)
+        set_attribute("max_index", max_index)
+        set_attribute("bounds", tuple(
+            (-o / resolution, (n - o) / resolution)
+            for o, n in zip(origin_offset, shape)
+        ))
+        origin_offset.flags.writeable = False
+        max_index.flags.writeable = False
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MapParams is immutable")
+
+    def __reduce__(self):
+        # rebuild from the arguments, __setattr__ forbids restoring the slots
+        return MapParams, self.to_tuple()
+
+    def __getitem__(self, key):
+        if key not in ("resolution", "size", "origin"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            other = get_map_params(other)
+        if not isinstance(other, MapParams):
+            return NotImplemented
+        return self.to_tuple() == other.to_tuple()
+
+    def __hash__(self):
+        return hash(self.to_tuple())
+
+    def __repr__(self):
+        return "MapParams(size={}, resolution={}, origin={})".format(
+            *self.to_tuple()
+        )
+
+    def to_tuple(self):
+        """Return (size, resolution, origin)"""
+        return self.size, self.resolution, self.origin
+
+    def to_dict(self):
+        """Return the equivalent parameters dictionary"""
+        return {
+            "resolution": self.resolution,
+            "size": self.size,
+            "origin": self.origin,
+        }
+
+
+def get_map_params(params):
+    """Return params as a MapParams object
+
+    Args:
+        params: Parameters dictionary or MapParams
+
+    Returns:
+        MapParams (params itself if it already is one)
+    """
+    if isinstance(params, MapParams):
+        return params
+    return MapParams(params["size"], params["resolution"], params["origin"])
+
+
+def create_empty_map(params, dtype=np.float64):
     """Return an empty map of size params.size
 
-    Map is a square matrix of n = params.size * params.resolution
+    Map is a matrix of n_x * n_y cells, with n = size * resolution along each
+    axis.
     The x-axis is pointing downward and the y-axis towards the right
 
     Args:
-        params: Dict of parameters
+        params: Dict of parameters or MapParams
+        dtype: Floating point type of the log odds
 
     Returns:
-        Square numpy array
+        numpy array
     """
-    return np.zeros((
-        params["size"]*params["resolution"],
-        params["size"]*params["resolution"],
-    ))
+    return np.zeros(get_map_params(params).shape, dtype=dtype)
 
 
 def discretize(position, params):
@@ -64,24 +207,179 @@ def discretize(position, params):
     indexes on the grid map.
     The (0, 0) coordinates are put in the middle of the map.
 
+    Pass a MapParams object in loops to avoid rebuilding the map geometry
+    at each call.
 
     Args:
-        position: Vector ((x, y), n) or tuple (x, y)  of GLOBAL coordinates
-        params: Dict of parameters
+        position: Vector ((x, y), ...) or tuple (x, y)  of GLOBAL coordinates
+        params: Dict of parameters or MapParams
 
     Returns:
-        2D vector ((x, y), n) of INDEX coordinates
+        Vector ((x, y), ...) of INDEX coordinates
 
     """
     assert position.shape[0] == 2, \
         "Error: Position vector shape should be (2, n)"
-    idx = np.stack((
-        ((position[0]) * params["resolution"]).astype("int")
-        + params["origin"][0],
-        ((position[1]) * params["resolution"]).astype("int")
-        + params["origin"][1],
-    )).astype(np.int16)
-    return np.clip(idx, a_max=params["resolution"]*params["size"]-1, a_min=0)
+    params = get_map_params(params)
+    shape = (2,) + (1,) * (position.ndim - 1)
+    idx = (position * params.resolution).astype(np.int32)
+    idx += params.origin_offset.reshape(shape)
+    np.clip(idx, 0, params.max_index.reshape(shape), out=idx)
+    return idx.astype(np.int16)
+
+
+def is_outside(position, params):
+    """Find the positions that discretize clips to the border of the map
+
+    Args:
+        position: Vector ((x, y), ...) of GLOBAL coordinates
+        params: Dict of parameters or MapParams
+
+    Returns:
+        Boolean array of shape position.shape[1:]
+    """
+    params = get_map_params(params)
+    shape = (2,) + (1,) * (position.ndim - 1)
+    idx = (position * params.resolution).astype(np.int32) \
+        + params.origin_offset.reshape(shape)
+    return ((idx < 0) | (idx > params.max_index.reshape(shape))).any(axis=0)
+
+
+def cell_to_position(cells, params, fraction=0.5):
+    """GLOBAL coordinates of a point of each cell, inverse of discretize
+
+    discretize truncates towards zero: cells below the origin cover
+    (offset - 1, offset], the origin cell (-1, 1) and the others
+    [offset, offset + 1), in cells from the origin.
+
+    Args:
+        cells: Vector ((x, y), ...) of INDEX coordinates
+        params: Dict of parameters or MapParams
+        fraction: Position of the point in the cell along each axis, from 0
+            (side of the origin) to 1. 0.5 gives the center of the cell,
+            uniform draws in [0, 1) give uniform points in the cell
+
+    Returns:
+        Vector ((x, y), ...) of GLOBAL coordinates
+    """
+    params = get_map_params(params)
+    shape = (2,) + (1,) * (np.ndim(cells) - 1)
+    offsets = cells - params.origin_offset.reshape(shape)
+    return np.where(
+        offsets == 0,
+        2*fraction - 1,
+        offsets + np.sign(offsets)*fraction,
+    ) / params.resolution
+
+
+def pack_occupancy(grid):
+    """Pack the occupied cells of a grid map into a bitmask
+
+    Each row of the map is packed into bytes, so a (n, m) map becomes a
+    (n, ceil(m / 8)) array of uint8.
+
+    Args:
+        grid: Occupancy grid map
+
+    Returns:
+        Packed bitmask of the cells with a positive log odd
+    """
+    return np.packbits(grid > 0, axis=1)
+
+
+def update_packed_occupancy(packed, grid, regions):
+    """Pack again the regions of a grid map that were modified
+
+    The regions are extended to whole bytes along the y axis, so the rest of
+    the bitmask is left untouched.
+
+    Args:
+        packed: Packed bitmask of the grid map (see pack_occupancy), updated
+            in place
+        grid: Occupancy grid map
+        regions: List of (x_min, x_max, y_min, y_max) regions of INDEX
+            coordinates (see update_grid_map)
+
+    Returns:
+        Updated bitmask
+    """
+    for x_min, x_max, y_min, y_max in regions:
+        y_min, y_max = y_min & ~7, min(-(-y_max // 8) * 8, grid.shape[1])
+        packed[x_min:x_max, y_min >> 3:-(-y_max // 8)] = np.packbits(
+            grid[x_min:x_max, y_min:y_max] > 0,
+            axis=1,
+        )
+    return packed
+
+
+def get_packed_occupancy(packed, cells):
+    """Read the occupancy of a set of cells from a packed bitmask
+
+    Args:
+        packed: Packed bitmask (see pack_occupancy)
+        cells: INDEX coordinates, array of shape (2, ...)
+
+    Returns:
+        Boolean array of shape cells.shape[1:], True for occupied cells
+    """
+    x = cells[0].astype(np.intp)
+    y = cells[1].astype(np.intp)
+    byte = packed.reshape(-1).take(x * packed.shape[1] + (y >> 3))
+    return (byte & BIT_MASKS.take(y & 7)) != 0
+
+
+def build_map_pyramid(occupancy, n_levels):
+    """Build a multi-resolution pyramid of an occupancy map
+
+    Each level halves the resolution of the previous one. A coarse cell is
+    occupied if any of the fine cells it covers is occupied.
+
+    Args:
+        occupancy: Boolean occupancy map (full resolution)
+        n_levels: Number of levels, including the full resolution map
+
+    Returns:
+        List of boolean maps, from the finest to the coarsest
+    """
+    pyramid = [occupancy]
+    for _ in range(n_levels - 1):
+        level = pyramid[-1]
+        # pad to even dimensions before pooling 2x2 blocks
+        level = np.pad(
+            level,
+            ((0, level.shape[0] % 2), (0, level.shape[1] % 2)),
+            mode="constant",
+        )
+        pyramid.append(
+            level.reshape(
+                (level.shape[0] // 2, 2, level.shape[1] // 2, 2)
+            ).any(axis=(1, 3))
+        )
+    return pyramid
+
+
+def compute_likelihood_field(grid, params, sigma, p_hit=0.9, p_rand=0.1):
+    """Compute the log likelihood field of a grid map
+
+    The likelihood of a range measurement ending in a cell decreases with
+    the distance from that cell to the closest occupied cell:
+        p = p_hit * exp(-d^2 / (2 * sigma^2)) + p_rand
+
+    Args:
+        grid: Occupancy grid map
+        params: Parameters dictionary
+        sigma: Standard deviation of the measurement noise in meters
+        p_hit: Weight of the gaussian around obstacles
+        p_rand: Weight of random measurements
+
+    Returns:
+        Log likelihood of a measurement ending in each cell
+    """
+    from scipy.ndimage import distance_transform_edt  # optional, slow import
+    distance = distance_transform_edt(grid <= 0) / params["resolution"]
+    return np.log(
+        p_hit * np.exp(-distance**2 / (2 * sigma**2)) + p_rand
+    ).astype(np.float32)
 
 
 def target_cell(states, sensor_range, sensor_bearing):
@@ -89,10 +387,14 @@ def target_cell(states, sensor_range, sensor_bearing):
 
     NOTE: target point could be out of range (not in the map)
 
+    The coordinates are computed with the precision of the states (float32
+    states give float32 coordinates, whatever the type of the ranges).
+
     Args:
         states (3 x n_particles): One or multiple states of the vehicle
             in the GLOBAL frame
-        sensor_range: Observed ranges
+        sensor_range: Observed ranges, either shared by all the states or
+            one column per state (n_cells x n_particles)
         sensor_bearing: Sensor headings
 
     Returns:
@@ -104,7 +406,11 @@ def target_cell(states, sensor_range, sensor_bearing):
     elif states.ndim == 1:
         n_particles = 1
     n_target_cells = len(sensor_bearing)
-    sensor_range = sensor_range.reshape((-1, 1))
+    dtype = np.result_type(states, np.float32)
+    sensor_range = np.asarray(sensor_range, dtype=dtype)
+    sensor_bearing = np.asarray(sensor_bearing, dtype=dtype)
+    if sensor_range.ndim < 2:
+        sensor_range = sensor_range.reshape((-1, 1))
     sensor_bearing = sensor_bearing.reshape((-1, 1))
     states = states.reshape((3, -1))
     x = (sensor_range * np.cos(states[2, :]+sensor_bearing)) + states[0, :]
@@ -121,7 +427,8 @@ def target_cell(states, sensor_range, sensor_bearing):
 def bresenham_line(start, end):
     """Find the cells that should be selected to form a straight line
 
-    Use scikit-image implementation of the Bresenham line algorithm
+    Use scikit-image implementation of the Bresenham line algorithm (see
+    bresenham_lines for the vectorized version used by the map updates)
 
     Args:
         start: (x, y) INDEX coordinates of the starting point
@@ -130,6 +437,7 @@ def bresenham_line(start, end):
     Returns:
         List of (x, y) INDEX coordinates that form the straight lines
     """
+    from skimage.draw import line as bresenham  # optional, slow import
     path = list()
     for target in end.T:  # TODO: delete for loop
         tmp = bresenham(start[0], start[1], target[0], target[1])
@@ -137,35 +445,214 @@ def bresenham_line(start, end):
     return path
 
 
-def update_grid_map(grid, ranges, angles, state, params):
+def bresenham_lines(starts, ends):
+    """Find the cells that form straight lines, for many lines at once
+
+    Vectorized version of the Bresenham line algorithm, giving the same
+    cells as the scikit-image implementation. Along the major axis of a
+    line, the i-th cell is i steps away from the start, and along the minor
+    axis it is floor((2 * d_minor * i + d_major) / (2 * d_major)) steps away.
+
+    Args:
+        starts: ((x, y), n) INDEX coordinates of the starting points
+        ends: ((x, y), n) INDEX coordinates of the ending points
+
+    Returns:
+        ((x, y), n_cells) INDEX coordinates of the cells in between the
+            starting and ending points (both excluded)
+        Index of the line each cell belongs to
+    """
+    starts = starts.astype(np.int64)
+    delta = ends.astype(np.int64) - starts
+    steps = np.where(delta > 0, 1, -1)
+    delta = np.abs(delta)
+    steep = delta[0] > delta[1]
+    major = np.where(steep, delta[0], delta[1])
+    minor = np.where(steep, delta[1], delta[0])
+
+    # one entry per cell, start and end points excluded
+    n_cells = np.maximum(major - 1, 0)
+    line_idx = np.repeat(np.arange(len(major)), n_cells)
+    i = np.arange(n_cells.sum()) + 1 \
+        - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+    major = major[line_idx]
+    minor_steps = (2*minor[line_idx]*i + major) // (2*major)
+    steep = steep[line_idx]
+    cells = starts[:, line_idx] + steps[:, line_idx] * np.stack((
+        np.where(steep, i, minor_steps),
+        np.where(steep, minor_steps, i),
+    ))
+    return cells, line_idx
+
+
+def get_dirty_region(position, targets):
+    """Bounding box of the cells touched by a scan
+
+    Every cell updated by a scan lies on a straight line between the vehicle
+    position and one of the targets, so the bounding box of those points
+    covers all the modified cells.
+
+    Args:
+        position: (x, y) INDEX coordinates of the vehicle, or ((x, y), n)
+            for several scans
+        targets: ((x, y), n) INDEX coordinates of the targets
+
+    Returns:
+        Tuple (x_min, x_max, y_min, y_max) of INDEX coordinates, with exclusive
+        upper bounds so that grid[x_min:x_max, y_min:y_max] is the region
+    """
+    points = np.concatenate(
+        (position.reshape((2, -1)), targets.reshape((2, -1))),
+        axis=1,
+    )
+    x_min, y_min = points.min(axis=1)
+    x_max, y_max = points.max(axis=1)
+    return int(x_min), int(x_max) + 1, int(y_min), int(y_max) + 1
+
+
+def merge_dirty_regions(regions):
+    """Merge a list of dirty regions into a single bounding box
+
+    Args:
+        regions: List of (x_min, x_max, y_min, y_max) regions
+
+    Returns:
+        Bounding box (x_min, x_max, y_min, y_max) of all the regions, or None
+        if the list is empty
+    """
+    if len(regions) == 0:
+        return None
+    regions = np.array(regions)
+    return (
+        int(regions[:, 0].min()),
+        int(regions[:, 1].max()),
+        int(regions[:, 2].min()),
+        int(regions[:, 3].max()),
+    )
+
+
+def get_unique_cells(keys, area):
+    """Remove the duplicated cells of each scan
+
+    Args:
+        keys: Flat cell indices, offset by scan_index * area
+        area: Number of cells in the region
+
+    Returns:
+        Flat cell indices (without the scan offset), unique within each scan
+    """
+    keys = np.sort(keys)
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = keys[1:] != keys[:-1]
+    return keys[unique] % area
+
+
+def update_grid_map(
+    grid, ranges, angles, state, params,
+    dirty_regions=None, hits=None
+):
     """Update the grid map given a new set on sensor data
 
+    The grid is updated in place. Only the region touched by the scan is
+    clipped, the rest of the map is left untouched.
+
     Args:
         grid: Grid map to be updated
         ranges: Set of range inputs from the sensor
         angles: Angles at which the range points are captured
         state: State estimate (x, y, yaw)
-        params: Parameters dictionary
+        params: Parameters dictionary or MapParams
+        dirty_regions: Optional list. If given, the (x_min, x_max, y_min,
+            y_max) bounding box of the modified cells is appended to it
+        hits: Optional boolean mask of the beams that hit an obstacle (see
+            preprocessing.preprocess_ranges). The other beams only mark
+            free space, including their last cell. All beams hit if None
 
     Returns:
         Updated occupancy grid map
     """
-    LOG_ODD_MAX = 100
-    LOG_ODD_MIN = -50
-    LOG_ODD_OCCU = 1
-    LOG_ODD_FREE = 0.3
+    return update_grid_map_batch(
+        grid,
+        np.reshape(ranges, (-1, 1)),
+        angles,
+        np.reshape(state, (3, 1)),
+        params,
+        dirty_regions,
+        None if hits is None else np.reshape(hits, (-1, 1)),
+    )
+
+
+def update_grid_map_batch(
+    grid, ranges, angles, states, params,
+    dirty_regions=None, hits=None
+):
+    """Update the grid map given several scans at once
+
+    All the rays are cast together and the log odds updates are accumulated
+    before being added to the grid. Within a scan, a cell is updated at most
+    once per rule (free/occupied), like a single call to update_grid_map.
+    The log odds are clipped once at the end, so the result is the same as
+    sequential calls to update_grid_map unless a cell reaches the clipping
+    bounds in the middle of the batch.
 
-    # compute the measured position
-    targets = target_cell(state, ranges, angles)
-    targets = discretize(targets, params)
+    Args:
+        grid: Grid map to be updated (in place)
+        ranges: Range inputs (n_angles x n_scans)
+        angles: Angles at which the range points are captured
+        states: State estimates (3 x n_scans)
+        params: Parameters dictionary or MapParams
+        dirty_regions: Optional list. If given, the bounding box of the
+            modified cells is appended to it
+        hits: Optional boolean mask (n_angles x n_scans) of the beams that
+            hit an obstacle. All beams hit if None
 
-    # find the affected cells
-    position = discretize(state[:2], params)
-    cells = bresenham_line(position.reshape(2), targets)
+    Returns:
+        Updated occupancy grid map
+    """
+    params = get_map_params(params)
+    n_angles, n_scans = ranges.shape
 
-    # update log odds
-    grid[position[0], position[1]] -= LOG_ODD_FREE
-    grid[tuple(np.array(cells).T)] -= LOG_ODD_FREE
-    grid[targets[0], targets[1]] += LOG_ODD_OCCU
+    # compute the measured positions
+    targets = target_cell(states, ranges, angles)
+    targets = discretize(targets.reshape((2, n_angles, n_scans)), params)
+    positions = discretize(states[:2, :], params)
 
-    return np.clip(grid, a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN)
+    # find the affected cells
+    starts = np.repeat(positions, n_angles, axis=1)
+    ends = targets.transpose((0, 2, 1)).reshape((2, -1))
+    cells, line_idx = bresenham_lines(starts, ends)
+
+    # flat cell indices inside the modified region, one block per scan so
+    # that duplicates can be removed within each scan
+    x_min, x_max, y_min, y_max = get_dirty_region(positions, ends)
+    width = y_max - y_min
+    area = (x_max - x_min) * width
+
+    def to_keys(cells, scan_idx):
+        return (cells[0].astype(np.int64) - x_min) * width \
+            + (cells[1] - y_min) + scan_idx * area
+
+    end_keys = to_keys(ends, np.repeat(np.arange(n_scans), n_angles))
+    if hits is None:
+        occupied, missed = end_keys, end_keys[:0]
+    else:
+        hits = np.asarray(hits, dtype=bool).T.reshape(-1)
+        occupied, missed = end_keys[hits], end_keys[~hits]
+    free = get_unique_cells(np.concatenate((
+        to_keys(positions, np.arange(n_scans)),
+        to_keys(cells, line_idx // n_angles),
+        missed,
+    )), area)
+    occupied = get_unique_cells(occupied, area)
+
+    # accumulate the log odds updates and clip the modified region only
+    region = grid[x_min:x_max, y_min:y_max]
+    region += (
+        LOG_ODD_OCCU * np.bincount(occupied, minlength=area)
+        - LOG_ODD_FREE * np.bincount(free, minlength=area)
+    ).reshape(region.shape)
+    np.clip(region, a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN, out=region)
+    if dirty_regions is not None:
+        dirty_regions.append((x_min, x_max, y_min, y_max))
+
+    return grid
@@ -0,0 +1,183 @@
+"""Motion module
+
+This module implements the motion models used to propagate the particles.
+Every model has the same signature and updates the states in place:
+    model(states, motion_update, noise_std, rng)
+where rng is the random generator of the noise (see crazyslam.rng).
+
+The body frame of the vehicle follows the scan angles convention (see
+mapping.target_cell): the x axis points along the 0 angle and the y axis
+along the pi/2 angle.
+"""
+
+
+import numpy as np
+from crazyslam.rng import get_rng
+
+
+def body_to_global(states, body_delta):
+    """Rotate displacements from the body frame to the GLOBAL frame
+
+    Args:
+        states (3 x n_particles): States of the particles
+        body_delta (2 x n_particles): Displacements in the body frame of
+            each particle
+
+    Returns:
+        2 x n_particles displacements in the GLOBAL frame
+    """
+    cos, sin = np.cos(states[2, :]), np.sin(states[2, :])
+    return np.stack((
+        cos*body_delta[0] - sin*body_delta[1],
+        -sin*body_delta[0] - cos*body_delta[1],
+    ))
+
+
+def frame_to_frame(states, offset):
+    """Express states given in a frame into a parent frame
+
+    The frame is located at offset = (x, y, yaw) in the parent frame. Yaws
+    follow the scan angles convention (see mapping.target_cell), so they are
+    added, and a rotation by yaw maps (cos(a), -sin(a)) to
+    (cos(a + yaw), -sin(a + yaw)).
+
+    Args:
+        states (3 x n): States (x, y, yaw) in the frame
+        offset: Pose (x, y, yaw) of the frame in the parent frame
+
+    Returns:
+        3 x n states in the parent frame
+    """
+    states = np.reshape(states, (3, -1))
+    x, y, yaw = offset
+    cos, sin = np.cos(yaw), np.sin(yaw)
+    return np.stack((
+        x + cos*states[0] + sin*states[1],
+        y - sin*states[0] + cos*states[1],
+        states[2] + yaw,
+    ))
+
+
+def get_relative_pose(states, reference_states):
+    """Express states in the frame of reference states (see frame_to_frame)
+
+    Inverse of frame_to_frame: frame_to_frame(relative, reference) gives
+    states back.
+
+    Args:
+        states (3 x n): States (x, y, yaw) in the parent frame
+        reference_states (3 x n): Poses of the frames in the parent frame
+
+    Returns:
+        3 x n states in the frames, with yaws wrapped to [-pi, pi)
+    """
+    states = np.reshape(states, (3, -1))
+    reference_states = np.reshape(reference_states, (3, -1))
+    dx = states[0] - reference_states[0]
+    dy = states[1] - reference_states[1]
+    cos, sin = np.cos(reference_states[2]), np.sin(reference_states[2])
+    return np.stack((
+        cos*dx - sin*dy,
+        sin*dx + cos*dy,
+        wrap_angles(states[2] - reference_states[2]),
+    ))
+
+
+def wrap_angles(angles):
+    """Wrap angles to [-pi, pi)"""
+    return (angles + np.pi) % (2*np.pi) - np.pi
+
+
+def sample_noise(noise_std, n, rng=None):
+    """Draw n samples of zero mean gaussian noise (3 x n)"""
+    if noise_std is None:
+        return np.zeros((3, n))
+    return get_rng(rng).normal(size=(3, n)) * np.reshape(noise_std, (3, 1))
+
+
+def global_delta_model(states, motion_update, noise_std=None, rng=None):
+    """Apply the same GLOBAL frame displacement to all the particles
+
+    Args:
+        states (3 x n_particles): States of the particles, updated in place
+        motion_update: (dx, dy, dyaw) in the GLOBAL frame
+        noise_std: Standard deviation of the noise on (dx, dy, dyaw)
+        rng: Random generator of the noise
+
+    Returns:
+        Updated states
+    """
+    states += np.reshape(motion_update, (3, 1))
+    if noise_std is not None:
+        states += sample_noise(noise_std, states.shape[1], rng)
+    return states
+
+
+def odometry_model(states, motion_update, noise_std=None, rng=None):
+    """Apply a body frame displacement (odometry) to each particle
+
+    The noise is drawn in the body frame of each particle before the
+    displacement is rotated into the GLOBAL frame.
+
+    Args:
+        states (3 x n_particles): States of the particles, updated in place
+        motion_update: (dx, dy, dyaw) in the body frame
+        noise_std: Standard deviation of the noise on (dx, dy, dyaw)
+        rng: Random generator of the noise
+
+    Returns:
+        Updated states
+    """
+    delta = np.reshape(motion_update, (3, 1)) \
+        + sample_noise(noise_std, states.shape[1], rng)
+    states[:2, :] += body_to_global(states, delta[:2, :])
+    states[2, :] += delta[2, :]
+    return states
+
+
+def velocity_model(states, motion_update, noise_std=None, rng=None):
+    """Move each particle along an arc given its linear and angular speeds
+
+    Args:
+        states (3 x n_particles): States of the particles, updated in place
+        motion_update: (v, w, dt) linear speed along the body x axis, angular
+            speed and duration of the motion
+        noise_std: Standard deviation of the noise on v, w and on the final
+            yaw
+        rng: Random generator of the noise
+
+    Returns:
+        Updated states
+    """
+    velocity, angular_velocity, dt = motion_update
+    noise = sample_noise(noise_std, states.shape[1], rng)
+    velocity = velocity + noise[0, :]
+    angular_velocity = angular_velocity + noise[1, :]
+    dyaw = angular_velocity * dt
+
+    # arc length over chord, with the straight line limit when w -> 0
+    straight = np.abs(angular_velocity) < 1e-9
+    safe_w = np.where(straight, 1, angular_velocity)
+    body_delta = np.stack((
+        np.where(straight, velocity*dt, velocity/safe_w * np.sin(dyaw)),
+        np.where(straight, 0, velocity/safe_w * (1 - np.cos(dyaw))),
+    ))
+    states[:2, :] += body_to_global(states, body_delta)
+    states[2, :] += dyaw + noise[2, :]*dt
+    return states
+
+
+MOTION_MODELS = {
+    "global": global_delta_model,
+    "odometry": odometry_model,
+    "velocity": velocity_model,
+}
+
+
+def get_motion_model(motion_model):
+    """Return a motion model given its name (see MOTION_MODELS) or itself"""
+    if callable(motion_model):
+        return motion_model
+    assert motion_model in MOTION_MODELS, \
+        "Unknown motion model: {}".format(motion_model)
+    return MOTION_MODELS[motion_model]
@@ -0,0 +1,139 @@
+"""Persistence module
+
+This module saves a SLAM agent (map, parameters, particles and random state)
+to disk and loads it back, so that a flight can be warm-started from a map
+built during a previous session.
+
+A session is stored as a directory:
+    meta.json: Map parameters, filter settings and random state
+    map.npy: Occupancy grid map (raw array, memory-mappable)
+    particles.npy: Set of particles (raw array)
+"""
+
+
+import os
+import json
+import numpy as np
+from crazyslam.slam import SLAM
+from crazyslam.mapping import MapParams
+from crazyslam.motion import MOTION_MODELS
+from crazyslam.localization import ESTIMATORS
+from crazyslam.rng import get_rng_state, set_rng_state
+
+
+META_FILE = "meta.json"
+MAP_FILE = "map.npy"
+PARTICLES_FILE = "particles.npy"
+
+
+def save_session(slam_agent, session_dir):
+    """Save a SLAM agent to disk
+
+    Args:
+        slam_agent: SLAM agent to be saved
+        session_dir: Directory where the session is written (created if it
+            doesn't exist)
+    """
+    if not os.path.isdir(session_dir):
+        os.makedirs(session_dir)
+
+    motion_model = None
+    for name, model in MOTION_MODELS.items():
+        if model is slam_agent.motion_model:
+            motion_model = name
+    estimator = None
+    for name, function in ESTIMATORS.items():
+        if function is slam_agent.estimator:
+            estimator = name
+    motion_noise = slam_agent.motion_noise
+    if motion_noise is not None:
+        motion_noise = np.asarray(motion_noise).tolist()
+    meta = {
+        "params": slam_agent.params.to_dict(),
+        "n_particles": slam_agent.n_particles,
+        "current_state": np.asarray(slam_agent.current_state).tolist(),
+        "system_noise_variance":
+            np.asarray(slam_agent.system_noise_variance).tolist(),
+        "correlation_matrix":
+            np.asarray(slam_agent.correlation_matrix).tolist(),
+        "resampling_threshold": slam_agent.resampling_threshold,
+        "motion_model": motion_model,
+        "motion_noise": motion_noise,
+        "min_translation": slam_agent.min_translation,
+        "min_rotation": slam_agent.min_rotation,
+        "estimator": estimator,
+        "dtype": slam_agent.dtype.name,
+        "packed_scoring": slam_agent.packed_scoring,
+        "rng_state": get_rng_state(slam_agent.rng),
+    }
+    with open(os.path.join(session_dir, META_FILE), "w") as file:
+        json.dump(meta, file)
+    np.save(os.path.join(session_dir, MAP_FILE), slam_agent.map)
+    np.save(os.path.join(session_dir, PARTICLES_FILE), slam_agent.particles)
+
+
+def load_session(
+    session_dir,
+    lazy=True,
+    restore_rng=False,
+    motion_model=None,
+    estimator=None,
+):
+    """Load a SLAM agent from disk
+
+    With lazy loading, the map is memory-mapped in copy-on-write mode: pages
+    are only read from disk when they are accessed, and updates made during
+    the flight are never written back to the saved session.
+
+    Args:
+        session_dir: Directory of a session written by save_session
+        lazy: If True, memory-map the map instead of reading it
+        restore_rng: If True, restore the state of the random generator to
+            resume the session exactly. If the agent used the global numpy
+            random state, this overwrites np.random for the whole process
+        motion_model: Motion model of the agent. Required if the saved
+            agent used a custom motion model (not in MOTION_MODELS)
+        estimator: State estimator of the agent. Required if the saved
+            agent used a custom estimator (not in ESTIMATORS)
+
+    Returns:
+        SLAM agent
+    """
+    with open(os.path.join(session_dir, META_FILE), "r") as file:
+        meta = json.load(file)
+
+    # custom functions are saved as None, they can't be guessed
+    motion_model = motion_model or meta.get("motion_model", "global")
+    if motion_model is None:
+        raise ValueError(
+            "The session used a custom motion model, pass it to load_session")
+    estimator = estimator or meta.get("estimator", "best")
+    if estimator is None:
+        raise ValueError(
+            "The session used a custom estimator, pass it to load_session")
+
+    params = MapParams(**meta["params"])
+    slam_agent = SLAM(
+        params=params,
+        n_particles=meta["n_particles"],
+        current_state=np.array(meta["current_state"]),
+        system_noise_variance=np.array(meta["system_noise_variance"]),
+        correlation_matrix=np.array(meta["correlation_matrix"]),
+        motion_model=motion_model,
+        motion_noise=meta["motion_noise"],
+        min_translation=meta["min_translation"],
+        min_rotation=meta["min_rotation"],
+        estimator=estimator,
+        dtype=meta.get("dtype", "float64"),
+        packed_scoring=meta.get("packed_scoring", False),
+    )
+    slam_agent.resampling_threshold = meta["resampling_threshold"]
+    slam_agent.map = np.load(
+        os.path.join(session_dir, MAP_FILE),
+        mmap_mode="c" if lazy else None,
+    )
+    slam_agent.particles = np.load(os.path.join(session_dir, PARTICLES_FILE))
+
+    if restore_rng:
+        slam_agent.rng = set_rng_state(meta["rng_state"])
+    return slam_agent
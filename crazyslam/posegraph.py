@@ -0,0 +1,331 @@
+"""Pose graph module
+
+This module smooths the trajectory estimated by the SLAM algorithm after
+the flight (or over a sliding window during the flight). The states are the
+nodes of a graph, linked by constraints:
+    - relative constraints between two states, e.g. odometry deltas or loop
+      closures, expressed in the frame of the first state (see
+      motion.get_relative_pose)
+    - prior constraints on a single state, e.g. the state estimates of the
+      particle filter, i.e. the result of scan matching against the map
+The states that best satisfy all the constraints are found with a sparse
+Gauss-Newton least squares solver (scipy.sparse, imported on first use),
+and the map can then be rendered again from the optimized trajectory.
+"""
+
+
+import numpy as np
+from crazyslam.mapping import create_empty_map, update_grid_map_batch
+from crazyslam.motion import get_relative_pose, wrap_angles
+
+
+def get_information(std, n):
+    """Diagonal information (inverse variance) of n constraints (3 x n)
+
+    std is a scalar, a (x, y, yaw) tuple or an array of 3 x n values.
+    """
+    information = 1 / np.square(np.asarray(std, dtype=float))
+    if information.ndim == 1:
+        information = information.reshape((3, 1))
+    return np.broadcast_to(information, (3, n)).copy()
+
+
+class PoseGraph():
+    """
+    Graph of states linked by relative and prior constraints.
+
+    Constraints are added by blocks (one array per call), and only
+    concatenated when the graph is optimized.
+
+    Attributes:
+        states: States of the nodes (3 x n_nodes)
+        relative: Relative constraints (i, j, measurement, information),
+            with arrays of n_constraints indices, and 3 x n_constraints
+            measurements and diagonal information
+        priors: Prior constraints (i, measurement, information)
+    """
+
+    def __init__(self, states=None):
+        """Initialize the graph, optionally with a first set of states"""
+        self.states = np.zeros((3, 0))
+        self.relative_blocks = list()
+        self.prior_blocks = list()
+        if states is not None:
+            self.add_states(states)
+
+    @property
+    def n_nodes(self):
+        """Number of states in the graph"""
+        return self.states.shape[1]
+
+    def add_states(self, states):
+        """
+        Add nodes to the graph
+
+        Args:
+            states: Initial estimate of the states (3 x n or (x, y, yaw))
+
+        Returns:
+            Indices of the new nodes
+        """
+        states = np.reshape(states, (3, -1)).astype(float)
+        first = self.n_nodes
+        self.states = np.concatenate((self.states, states), axis=1)
+        return np.arange(first, self.n_nodes)
+
+    def add_relative(self, i, j, measurements, std):
+        """
+        Add constraints on the states j expressed in the frames of the
+        states i
+
+        Args:
+            i, j: Node indices (scalars or arrays of n_constraints indices)
+            measurements: Measured relative states (3 x n_constraints)
+            std: Standard deviation of the measurements on (x, y, yaw)
+        """
+        i, j = np.atleast_1d(i), np.atleast_1d(j)
+        self.relative_blocks.append((
+            i,
+            j,
+            np.reshape(measurements, (3, -1)),
+            get_information(std, len(i)),
+        ))
+
+    def add_prior(self, i, measurements, std):
+        """
+        Add constraints on the states i expressed in the GLOBAL frame
+
+        Args:
+            i: Node indices (scalar or array of n_constraints indices)
+            measurements: Measured states (3 x n_constraints)
+            std: Standard deviation of the measurements on (x, y, yaw)
+        """
+        i = np.atleast_1d(i)
+        self.prior_blocks.append((
+            i,
+            np.reshape(measurements, (3, -1)),
+            get_information(std, len(i)),
+        ))
+
+    def add_odometry(self, odometry_states, std, first=0):
+        """
+        Add relative constraints between consecutive nodes given a
+        dead-reckoning trajectory
+
+        Args:
+            odometry_states: States integrated from the motion updates only
+                (3 x n)
+            std: Standard deviation of the odometry on (dx, dy, dyaw)
+            first: Index of the node of the first odometry state
+        """
+        odometry_states = np.reshape(odometry_states, (3, -1))
+        i = np.arange(first, first + odometry_states.shape[1] - 1)
+        self.add_relative(
+            i,
+            i + 1,
+            get_relative_pose(odometry_states[:, 1:], odometry_states[:, :-1]),
+            std,
+        )
+
+    @property
+    def relative(self):
+        """Relative constraints (i, j, measurements, information)"""
+        if len(self.relative_blocks) > 1:
+            self.relative_blocks = [tuple(
+                np.concatenate(arrays, axis=-1)
+                for arrays in zip(*self.relative_blocks)
+            )]
+        if len(self.relative_blocks) == 0:
+            return (
+                np.zeros(0, dtype=int),
+                np.zeros(0, dtype=int),
+                np.zeros((3, 0)),
+                np.zeros((3, 0)),
+            )
+        return self.relative_blocks[0]
+
+    @property
+    def priors(self):
+        """Prior constraints (i, measurements, information)"""
+        if len(self.prior_blocks) > 1:
+            self.prior_blocks = [tuple(
+                np.concatenate(arrays, axis=-1)
+                for arrays in zip(*self.prior_blocks)
+            )]
+        if len(self.prior_blocks) == 0:
+            return np.zeros(0, dtype=int), np.zeros((3, 0)), np.zeros((3, 0))
+        return self.prior_blocks[0]
+
+    def linearize(self, columns):
+        """
+        Residuals and jacobian of the constraints on the free nodes
+
+        Args:
+            columns: Index of each node in the free nodes, -1 if the node is
+                fixed
+
+        Returns:
+            Residuals, information (both n_residuals,) and the jacobian as
+            (rows, columns, values) arrays, all empty if no constraint
+            involves a free node
+        """
+        states = self.states
+        residuals, information, entries = list(), list(), list()
+        n_rows = 0
+
+        i, j, measurements, info = self.relative
+        used = (columns[i] >= 0) | (columns[j] >= 0)
+        i, j, measurements, info = i[used], j[used], \
+            measurements[:, used], info[:, used]
+        if len(i) > 0:
+            # relative state r = A(yaw_i) (p_j - p_i), yaw_j - yaw_i
+            error = get_relative_pose(states[:, j], states[:, i]) \
+                - measurements
+            error[2] = wrap_angles(error[2])
+            residuals.append(error.T.reshape(-1))
+            information.append(info.T.reshape(-1))
+            cos, sin = np.cos(states[2, i]), np.sin(states[2, i])
+            dx, dy = states[0, j] - states[0, i], states[1, j] - states[1, i]
+            rows = 3*np.arange(len(i))
+            ones = np.ones(len(i))
+            entries += [
+                # d r / d p_j = A, d r / d p_i = -A
+                (rows, j, 0, cos), (rows, j, 1, -sin),
+                (rows + 1, j, 0, sin), (rows + 1, j, 1, cos),
+                (rows, i, 0, -cos), (rows, i, 1, sin),
+                (rows + 1, i, 0, -sin), (rows + 1, i, 1, -cos),
+                # d r / d yaw_i
+                (rows, i, 2, -sin*dx - cos*dy),
+                (rows + 1, i, 2, cos*dx - sin*dy),
+                (rows + 2, j, 2, ones), (rows + 2, i, 2, -ones),
+            ]
+            n_rows += 3*len(i)
+
+        i, measurements, info = self.priors
+        used = columns[i] >= 0
+        i, measurements, info = i[used], measurements[:, used], info[:, used]
+        if len(i) > 0:
+            error = states[:, i] - measurements
+            error[2] = wrap_angles(error[2])
+            residuals.append(error.T.reshape(-1))
+            information.append(info.T.reshape(-1))
+            rows = n_rows + 3*np.arange(len(i))
+            ones = np.ones(len(i))
+            entries += [(rows + k, i, k, ones) for k in range(3)]
+
+        if len(entries) == 0:
+            empty = np.zeros(0)
+            return empty, empty, (empty.astype(int), empty.astype(int), empty)
+        rows, cols, values = (np.concatenate(arrays) for arrays in zip(*(
+            (row, 3*columns[node] + k, value)
+            for row, node, k, value in entries
+        )))
+        free = cols >= 0  # fixed nodes have negative columns
+        return (
+            np.concatenate(residuals),
+            np.concatenate(information),
+            (rows[free], cols[free], values[free]),
+        )
+
+    def optimize(self, n_iterations=10, tolerance=1e-4, window=None):
+        """
+        Optimize the states with Gauss-Newton iterations
+
+        Args:
+            n_iterations: Maximum number of iterations
+            tolerance: Stop when no state moves by more than tolerance
+            window: If given, only the last window states are optimized and
+                the others are fixed (online smoothing)
+
+        Returns:
+            Weighted sum of the squared residuals before the last iteration,
+            0 if no constraint involves a free state (nothing to optimize)
+        """
+        from scipy import sparse
+        from scipy.sparse.linalg import spsolve
+
+        first = 0 if window is None else max(0, self.n_nodes - window)
+        n_free = self.n_nodes - first
+        columns = np.full(self.n_nodes, -1)
+        columns[first:] = np.arange(n_free)
+        if first == 0 and not (columns[self.priors[0]] >= 0).any():
+            # without any prior, fix the first state to remove the gauge
+            # freedom of the graph
+            columns[0] = -1
+            columns[1:] -= 1
+            first, n_free = 1, n_free - 1
+
+        cost = 0.
+        for _ in range(n_iterations):
+            residuals, information, (rows, cols, values) = \
+                self.linearize(columns)
+            if len(residuals) == 0:
+                break
+            cost = np.sum(information * residuals**2)
+            jacobian = sparse.csr_matrix(
+                (values, (rows, cols)),
+                shape=(len(residuals), 3*n_free),
+            )
+            weighted = jacobian.T.multiply(information)
+            delta = spsolve(
+                (weighted @ jacobian).tocsc(),
+                -weighted @ residuals,
+            ).reshape((-1, 3)).T
+            self.states[:, columns >= 0] += delta
+            if np.abs(delta).max() < tolerance:
+                break
+        return cost
+
+
+def smooth_trajectory(
+    odometry_states, slam_states,
+    odometry_std=(0.02, 0.02, 0.02), slam_std=(0.1, 0.1, 0.1),
+    n_iterations=10
+):
+    """Smooth the state estimates of the SLAM algorithm with the odometry
+
+    Args:
+        odometry_states: States integrated from the motion updates only
+            (3 x n_steps)
+        slam_states: State estimates of the SLAM algorithm (3 x n_steps)
+        odometry_std: Standard deviation of the odometry on (dx, dy, dyaw)
+        slam_std: Standard deviation of the state estimates
+        n_iterations: Maximum number of Gauss-Newton iterations
+
+    Returns:
+        Smoothed states (3 x n_steps)
+    """
+    graph = PoseGraph(slam_states)
+    graph.add_odometry(odometry_states, odometry_std)
+    graph.add_prior(np.arange(graph.n_nodes), slam_states, slam_std)
+    graph.optimize(n_iterations)
+    return graph.states
+
+
+def render_map(states, ranges, angles, params, hits=None, batch_size=500):
+    """Build a map from scratch given a trajectory
+
+    Args:
+        states: States of the vehicle (3 x n_steps)
+        ranges: Range inputs (n_angles x n_steps)
+        angles: Scan angles
+        params: Grid map parameters dictionary or MapParams
+        hits: Optional boolean mask (n_angles x n_steps) of the beams that
+            hit an obstacle
+        batch_size: Number of scans integrated at once (see
+            mapping.update_grid_map_batch)
+
+    Returns:
+        Occupancy grid map
+    """
+    grid = create_empty_map(params)
+    for i in range(0, states.shape[1], batch_size):
+        update_grid_map_batch(
+            grid,
+            ranges[:, i:i+batch_size],
+            angles,
+            states[:, i:i+batch_size],
+            params,
+            hits=None if hits is None else hits[:, i:i+batch_size],
+        )
+    return grid
@@ -0,0 +1,65 @@
+"""Preprocessing module
+
+This module prepares the range inputs coming from the logger before they are
+used by the SLAM algorithm: unit conversion, removal of the invalid
+measurements and detection of the beams that didn't hit anything.
+"""
+
+
+import numpy as np
+
+
+# Horizontal Multi-ranger sensors, in the order of the scan angles below
+MULTIRANGER_VARIABLES = (
+    "range.front",
+    "range.left",
+    "range.back",
+    "range.right",
+)
+# Scan angles of the horizontal sensors (body frame, see crazyslam.motion)
+MULTIRANGER_ANGLES = np.array([0, np.pi / 2, np.pi, -np.pi / 2])
+
+
+def get_multiranger_ranges(data):
+    """Extract the horizontal ranges from a log data point
+
+    Args:
+        data: Dictionary of logged variables (see logger.init_log_conf)
+
+    Returns:
+        Raw ranges (uint16 millimeters), in the MULTIRANGER_ANGLES order
+    """
+    return np.array(
+        [data[variable] for variable in MULTIRANGER_VARIABLES],
+        dtype=np.uint16,
+    )
+
+
+def preprocess_ranges(
+    raw_ranges, angles,
+    min_range=0.02, max_range=4.0, scale=1e-3
+):
+    """Convert and filter a scan
+
+    Beams shorter than min_range are invalid and removed. Beams that reach
+    max_range (including the out of range values returned by the sensor)
+    didn't hit anything: they are kept as free space rays of length
+    max_range, without occupied target.
+
+    Args:
+        raw_ranges: Range inputs from the sensor
+        angles: Scan angles
+        min_range: Minimum valid range in meters
+        max_range: Maximum range of the sensor in meters
+        scale: Factor converting the raw ranges into meters
+
+    Returns:
+        Ranges in meters of the valid beams
+        Scan angles of the valid beams
+        Boolean mask of the valid beams that hit an obstacle
+    """
+    ranges = np.asarray(raw_ranges, dtype=float).reshape(-1) * scale
+    valid = np.isfinite(ranges) & (ranges >= min_range)
+    ranges = np.minimum(ranges[valid], max_range)
+    hits = ranges < max_range
+    return ranges, angles[valid], hits
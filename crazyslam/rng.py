@@ -0,0 +1,102 @@
+"""Random number generation module
+
+Every stochastic function of the package takes an optional rng argument:
+    - None: the global numpy random state (np.random.seed), as before
+    - a numpy Generator, used as is
+    - a seed (int or SeedSequence), turned into a new Generator
+
+Generators are not shared between threads: use spawn_rngs to give each
+worker (filter, scoring shard, simulation) its own independent stream.
+
+Objects that store their generator keep None rather than np.random, which
+can't be pickled along with them.
+"""
+
+
+import numpy as np
+
+
+def get_rng(rng=None):
+    """Return the random generator to use given an rng argument
+
+    Args:
+        rng: None (or np.random), numpy Generator or seed
+
+    Returns:
+        numpy Generator, or the np.random module (global legacy state) if
+        rng is None. Both provide uniform, normal, choice and
+        multivariate_normal with the same signatures
+    """
+    if rng is None:
+        return np.random
+    if rng is np.random or isinstance(rng, np.random.Generator):
+        return rng
+    return np.random.default_rng(rng)
+
+
+def spawn_rngs(seed, n):
+    """Create n independent random generators
+
+    The streams are spawned from a single SeedSequence, so they don't
+    overlap and the same seed always gives the same streams. A Generator
+    is turned into a SeedSequence with one of its draws (Generator.spawn
+    needs numpy 1.25).
+
+    Args:
+        seed: int, SeedSequence or Generator to spawn from
+        n: Number of generators
+
+    Returns:
+        List of n numpy Generators
+    """
+    if isinstance(seed, np.random.Generator):
+        seed = np.random.SeedSequence(seed.integers(2**63))
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seed.spawn(n)]
+
+
+def get_rng_state(rng=None):
+    """Return the state of a random generator as a JSON serializable dict
+
+    Args:
+        rng: numpy Generator, or None for the global legacy state
+    """
+    if rng is None or rng is np.random:
+        state = np.random.get_state()
+        return {
+            "algorithm": state[0],
+            "keys": state[1].tolist(),
+            "pos": state[2],
+            "has_gauss": state[3],
+            "cached_gaussian": state[4],
+        }
+    return rng.bit_generator.state
+
+
+def set_rng_state(state, rng=None):
+    """Restore a state returned by get_rng_state
+
+    Args:
+        state: State dictionary
+        rng: Generator to restore. If None, restores the global legacy state
+            (legacy states) or creates a new Generator (Generator states)
+
+    Returns:
+        The restored generator (None for the global legacy state)
+    """
+    if "algorithm" in state:
+        np.random.set_state((
+            state["algorithm"],
+            np.array(state["keys"], dtype=np.uint32),
+            state["pos"],
+            state["has_gauss"],
+            state["cached_gaussian"],
+        ))
+        return None
+    if rng is None:
+        rng = np.random.Generator(
+            getattr(np.random, state["bit_generator"])()
+        )
+    rng.bit_generator.state = state
+    return rng
@@ -0,0 +1,212 @@
+"""Scheduler module
+
+This module keeps the SLAM loop within a latency deadline (the logging
+period, 100 ms by default). The latency of each step is measured and the
+work done at each step is reduced when the deadline is at risk:
+    1. Fewer beams per scan (see crazyslam.beams.BeamBudget)
+    2. Fewer map updates
+    3. Fewer particles
+The settings are restored in the reverse order when there is headroom.
+"""
+
+
+import time
+from crazyslam.beams import select_uniform_beams, BeamBudget
+
+
+class LatencyScheduler():
+    """
+    Runs a SLAM agent within a latency deadline.
+
+    Attributes:
+        slam_agent: SLAM agent
+        deadline: Maximum latency of a step in seconds
+        target_load: Fraction of the deadline the average latency should use
+        restore_load: Below this fraction of the deadline, the settings are
+            restored
+        smoothing: Weight of the last measurement in the average latency
+        min_beams, max_beams: Bounds of the number of beams per scan
+        beam_budget: Adapts the number of beams to the latency target
+        max_map_period: Maximum number of steps between two map updates
+        min_particles, max_particles: Bounds of the number of particles
+        n_beams: Current number of beams per scan (capped to the size of
+            the last scan)
+        map_period: Current number of steps between two map updates
+        latency: Average latency in seconds (exponential moving average)
+        n_steps: Number of steps
+        n_misses: Number of steps that missed the deadline
+        max_latency: Maximum latency of a step in seconds
+        total_latency: Sum of the latencies in seconds
+    """
+
+    def __init__(
+        self,
+        slam_agent,
+        deadline=0.1,
+        min_beams=4,
+        max_beams=1000,
+        max_map_period=10,
+        min_particles=100,
+        max_particles=None,
+        target_load=0.8,
+        restore_load=0.5,
+        smoothing=0.2,
+    ):
+        """
+        Initialize the scheduler with the current settings of the SLAM
+        agent. max_particles defaults to its current number of particles.
+        """
+        self.slam_agent = slam_agent
+        self.deadline = deadline
+        self.target_load = target_load
+        self.restore_load = restore_load
+        self.smoothing = smoothing
+        self.min_beams = min_beams
+        self.max_beams = max_beams
+        self.max_map_period = max_map_period
+        self.min_particles = min_particles
+        self.max_particles = max_particles or slam_agent.n_particles
+        self.beam_budget = BeamBudget(
+            target_load * deadline,
+            min_beams,
+            max_beams,
+            smoothing,
+        )
+        self.map_period = 1
+        self.latency = None
+
+        # metrics
+        self.n_steps = 0
+        self.n_misses = 0
+        self.max_latency = 0.
+        self.total_latency = 0.
+
+    def step(self, ranges, angles, motion_update, hits=None):
+        """
+        Run one iteration of the SLAM algorithm and adapt the settings
+
+        Args:
+            ranges: Set on range inputs from sensor
+            angles: Scan angles
+            motion_update: Input of the motion model
+            hits: Optional boolean mask of the beams that hit an obstacle
+
+        Returns:
+            Updated state estimate
+        """
+        # beams beyond the size of the scan would not reduce the latency
+        self.beam_budget.max_beams = min(self.max_beams, len(ranges))
+        n_beams = self.n_beams
+        idx = select_uniform_beams(len(ranges), n_beams)
+        start = time.perf_counter()
+        state = self.slam_agent.update_state(
+            ranges[idx],
+            angles[idx],
+            motion_update,
+            None if hits is None else hits[idx],
+            update_map=self.n_steps % self.map_period == 0,
+        )
+        self.record(time.perf_counter() - start, n_beams)
+        return state
+
+    @property
+    def n_beams(self):
+        """Current number of beams per scan"""
+        return min(self.beam_budget.n_beams, self.beam_budget.max_beams)
+
+    def record(self, latency, n_beams=None):
+        """
+        Update the metrics and the settings given the latency of a step
+
+        Args:
+            latency: Latency of the step in seconds
+            n_beams: Number of beams used at the step (n_beams by default)
+        """
+        self.n_steps += 1
+        self.n_misses += latency > self.deadline
+        self.max_latency = max(self.max_latency, latency)
+        self.total_latency += latency
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+        if n_beams is None:
+            n_beams = self.n_beams
+        load = self.latency / self.deadline
+        if load > self.target_load:
+            self.degrade(load / self.target_load, latency, n_beams)
+        elif load < self.restore_load:
+            self.restore(latency, n_beams)
+
+    def degrade(self, ratio, latency, n_beams):
+        """
+        Reduce the work done at each step
+
+        Args:
+            ratio: Ratio between the average latency and the target latency
+            latency: Latency of the last step in seconds
+            n_beams: Number of beams used at the last step
+        """
+        slam_agent = self.slam_agent
+        if self.n_beams > self.min_beams:
+            budget = self.beam_budget
+            budget.n_beams = min(budget.update(latency, n_beams), n_beams)
+        elif self.map_period < self.max_map_period:
+            self.map_period += 1
+        elif slam_agent.n_particles > self.min_particles:
+            slam_agent.set_n_particles(max(
+                self.min_particles,
+                int(slam_agent.n_particles / ratio),
+            ))
+        # the average latency is measured again with the new settings
+        self.latency = None
+
+    def restore(self, latency, n_beams):
+        """
+        Increase the work done at each step, in the reverse order
+
+        Args:
+            latency: Latency of the last step in seconds
+            n_beams: Number of beams used at the last step
+        """
+        slam_agent = self.slam_agent
+        if slam_agent.n_particles < self.max_particles:
+            slam_agent.set_n_particles(min(
+                self.max_particles,
+                max(slam_agent.n_particles + 1,
+                    int(slam_agent.n_particles * 1.1)),
+            ))
+        elif self.map_period > 1:
+            self.map_period -= 1
+        elif self.n_beams < self.beam_budget.max_beams:
+            budget = self.beam_budget
+            budget.n_beams = max(budget.update(latency, n_beams), n_beams)
+        else:
+            return
+        self.latency = None
+
+    def get_metrics(self):
+        """
+        Return the metrics of the scheduler
+
+        Returns:
+            Dictionary:
+                "n_steps": Number of steps
+                "n_misses": Number of steps that missed the deadline
+                "miss_rate": Fraction of the steps that missed the deadline
+                "mean_latency": Mean latency in seconds
+                "max_latency": Maximum latency in seconds
+                "n_beams", "map_period", "n_particles": Current settings
+        """
+        n_steps = max(self.n_steps, 1)
+        return {
+            "n_steps": self.n_steps,
+            "n_misses": self.n_misses,
+            "miss_rate": self.n_misses / n_steps,
+            "mean_latency": self.total_latency / n_steps,
+            "max_latency": self.max_latency,
+            "n_beams": self.n_beams,
+            "map_period": self.map_period,
+            "n_particles": self.slam_agent.n_particles,
+        }
@@ -0,0 +1,253 @@
+"""Server module
+
+This module implements a map server shared by several SLAM agents (one per
+vehicle). Each agent submits its scans with its state estimate, expressed in
+its own GLOBAL frame. The server moves the scans into the server frame with
+the pose offset of the agent, merges them into a single occupancy grid map,
+and publishes read-only snapshots of the merged map that the agents use for
+particle scoring (see SLAM.scoring_map).
+
+The server runs in the same process as the agents. There is no global lock:
+    - each agent appends its scans to its own queue
+    - a single thread merges the queues at a time (the other merge calls
+      return immediately)
+    - snapshots are immutable arrays, published by swapping a reference,
+      so reading one never waits for a merge
+
+Typical loop of an agent:
+    state = slam_agent.update_state(ranges, angles, motion_update, hits)
+    server.submit(agent_id, ranges, angles, state, hits)
+    server.merge()
+    slam_agent.scoring_map = server.get_snapshot(agent_id)
+"""
+
+
+import threading
+from collections import deque
+import numpy as np
+from crazyslam.mapping import get_map_params, create_empty_map, \
+    discretize, is_outside, cell_to_position, update_grid_map_batch
+from crazyslam.motion import frame_to_frame
+
+
+def get_cell_positions(params):
+    """GLOBAL coordinates of the center of every cell of a map
+
+    Args:
+        params: Grid map parameters dictionary or MapParams
+
+    Returns:
+        2 x n_x x n_y array of (x, y) coordinates
+    """
+    params = get_map_params(params)
+    return cell_to_position(np.indices(params.shape), params)
+
+
+class MapServer():
+    """
+    Occupancy grid map shared by several SLAM agents.
+
+    Attributes:
+        params: Grid map parameters of the merged map (MapParams)
+        map: Merged occupancy grid map, only modified by merge
+        offsets: Pose (x, y, yaw) of the frame of each agent in the server
+            frame
+        queues: Scans submitted by each agent and not merged yet
+        version: Number of merges that modified the map
+        track_dirty_regions: If True, log the regions modified by the merges
+            (see pop_dirty_regions)
+        dirty_regions: Log of the regions of the merged map modified since
+            the last call to pop_dirty_regions
+    """
+
+    def __init__(self, params, track_dirty_regions=False):
+        """
+        Initialize an empty merged map
+
+        The modified regions of the merged map are only logged if
+        track_dirty_regions is True, so that the log doesn't grow when
+        nothing pops it.
+        """
+        self.params = get_map_params(params)
+        self.map = create_empty_map(self.params)
+        self.offsets = dict()
+        self.queues = dict()
+        self.version = 0
+        self.track_dirty_regions = track_dirty_regions
+        self.dirty_regions = list()
+
+        # one merge at a time, readers only see published snapshots
+        self.merge_lock = threading.Lock()
+        self.snapshot = self.publish()
+        self.agent_params = dict()
+        self.gather_indices = dict()
+        self.agent_snapshots = dict()
+
+    def register(self, agent_id, offset=(0, 0, 0), params=None):
+        """
+        Add an agent to the server
+
+        The gather indices of the agent map (cell of the merged map under
+        each cell of the agent map) are computed once here, so that agent
+        snapshots only cost an indexing operation.
+
+        Args:
+            agent_id: Hashable identifier of the agent
+            offset: Pose (x, y, yaw) of the GLOBAL frame of the agent in the
+                server frame, e.g. the take off position of the vehicle
+            params: Grid map parameters of the agent map (defaults to the
+                parameters of the merged map)
+        """
+        params = self.params if params is None else get_map_params(params)
+        positions = get_cell_positions(params)
+        positions = np.concatenate((
+            positions,
+            np.zeros((1,) + params.shape),
+        )).reshape((3, -1))
+        positions = frame_to_frame(positions, offset)[:2]
+        idx = discretize(positions, self.params).astype(np.int64)
+        indices = idx[0]*self.params.shape[1] + idx[1]
+        # cells outside of the merged map read an unknown cell (log odd 0)
+        indices[is_outside(positions, self.params)] = self.map.size
+
+        self.offsets[agent_id] = tuple(float(o) for o in offset)
+        self.agent_params[agent_id] = params
+        self.gather_indices[agent_id] = indices.reshape(params.shape)
+        self.queues[agent_id] = deque()
+
+    def unregister(self, agent_id):
+        """Remove an agent from the server, dropping its pending scans"""
+        for registry in (
+            self.offsets,
+            self.agent_params,
+            self.gather_indices,
+            self.queues,
+            self.agent_snapshots,
+        ):
+            registry.pop(agent_id, None)
+
+    def submit(self, agent_id, ranges, angles, state, hits=None):
+        """
+        Queue a scan of an agent, to be merged by the next call to merge
+
+        Only appends to the queue of the agent, so agents running on
+        different threads never wait for each other or for a merge.
+
+        Args:
+            agent_id: Identifier of the agent (see register)
+            ranges: Set of range inputs from the sensor
+            angles: Scan angles
+            state: State estimate (x, y, yaw) in the GLOBAL frame of the
+                agent
+            hits: Optional boolean mask of the beams that hit an obstacle
+        """
+        self.queues[agent_id].append((
+            np.array(ranges, dtype=float),
+            np.array(angles, dtype=float),
+            frame_to_frame(state, self.offsets[agent_id])[:, 0],
+            None if hits is None else np.array(hits, dtype=bool),
+        ))
+
+    def merge(self, blocking=False):
+        """
+        Integrate the queued scans of all the agents into the merged map
+
+        Consecutive scans sharing the same angles are integrated together
+        (see mapping.update_grid_map_batch).
+
+        Args:
+            blocking: If False and another merge is running, return
+                immediately: the running merge already takes care of the
+                queued scans, or the next one will
+
+        Returns:
+            Number of merged scans (None if another merge was running)
+        """
+        if not self.merge_lock.acquire(blocking):
+            return None
+        try:
+            scans = list()
+            for queue in list(self.queues.values()):
+                # only the scans queued so far, writers keep appending
+                for _ in range(len(queue)):
+                    scans.append(queue.popleft())
+            if len(scans) == 0:
+                return 0
+
+            regions = list()
+            for batch in self.group_scans(scans):
+                ranges, angles, states, hits = zip(*batch)
+                update_grid_map_batch(
+                    self.map,
+                    np.stack(ranges, axis=1),
+                    angles[0],
+                    np.stack(states, axis=1),
+                    self.params,
+                    regions,
+                    None if hits[0] is None else np.stack(hits, axis=1),
+                )
+            if self.track_dirty_regions:
+                self.dirty_regions.extend(regions)
+            self.version += 1
+            self.snapshot = self.publish()
+            return len(scans)
+        finally:
+            self.merge_lock.release()
+
+    @staticmethod
+    def group_scans(scans):
+        """Split scans into batches of consecutive scans with the same
+        angles and the same use of hits"""
+        batches = list()
+        for scan in scans:
+            if len(batches) > 0:
+                last = batches[-1][-1]
+                if (scan[3] is None) == (last[3] is None) \
+                        and np.array_equal(scan[1], last[1]):
+                    batches[-1].append(scan)
+                    continue
+            batches.append([scan])
+        return batches
+
+    def publish(self):
+        """Return a read-only copy of the merged map"""
+        snapshot = self.map.copy()
+        snapshot.flags.writeable = False
+        return snapshot
+
+    def get_snapshot(self, agent_id=None):
+        """
+        Return the last published snapshot of the merged map
+
+        Args:
+            agent_id: If given, the snapshot is resampled on the map of the
+                agent, in its GLOBAL frame. Cells outside of the merged map
+                are unknown
+
+        Returns:
+            Read-only occupancy grid map
+        """
+        snapshot = self.snapshot
+        if agent_id is None:
+            return snapshot
+        cached = self.agent_snapshots.get(agent_id)
+        if cached is not None and cached[0] is snapshot:
+            return cached[1]
+        agent_map = np.append(snapshot.reshape(-1), 0.)[
+            self.gather_indices[agent_id]
+        ]
+        agent_map.flags.writeable = False
+        self.agent_snapshots[agent_id] = (snapshot, agent_map)
+        return agent_map
+
+    def pop_dirty_regions(self):
+        """
+        Return the regions of the merged map modified since the last call
+        and clear the log. Only logged if track_dirty_regions is True.
+
+        Returns:
+            List of (x_min, x_max, y_min, y_max) regions of INDEX coordinates
+        """
+        regions = self.dirty_regions
+        self.dirty_regions = list()
+        return regions
@@ -0,0 +1,247 @@
+"""Simulation module
+
+This module generates synthetic flights to test the SLAM algorithm and the
+logging pipeline without the Crazyflie or recorded data:
+    - a synthetic occupancy map (walls and random obstacles)
+    - scripted trajectories sampled at the logging rate
+    - the range measurements, ray cast against the map for all the states
+      and beams at once, with noise and dropouts
+    - the same measurements as the Multi-ranger deck reports them (uint16
+      millimeters) and as a stream of log data points (see
+      crazyslam.logger)
+"""
+
+
+import numpy as np
+from crazyslam.mapping import get_map_params, discretize
+from crazyslam.preprocessing import MULTIRANGER_VARIABLES
+from crazyslam.rng import get_rng
+
+
+# Raw range reported for the beams that didn't hit anything (millimeters)
+OUT_OF_RANGE = 32767
+
+
+def create_synthetic_map(
+    params, n_obstacles=10,
+    obstacle_size=(0.2, 1.0), wall_thickness=0.1, rng=None
+):
+    """Create an occupancy map with walls along its borders and random
+    rectangular obstacles
+
+    Args:
+        params: Grid map parameters dictionary or MapParams
+        n_obstacles: Number of obstacles
+        obstacle_size: Minimum and maximum size of the sides of an obstacle
+            in meters
+        wall_thickness: Thickness of the walls in meters
+        rng: Random generator of the obstacles (see crazyslam.rng)
+
+    Returns:
+        Boolean occupancy map (True if the cell is occupied)
+    """
+    params = get_map_params(params)
+    rng = get_rng(rng)
+    occupancy = np.zeros(params.shape, dtype=bool)
+    wall = max(1, int(wall_thickness * params.resolution))
+    occupancy[:wall, :] = occupancy[-wall:, :] = True
+    occupancy[:, :wall] = occupancy[:, -wall:] = True
+
+    sizes = rng.uniform(
+        obstacle_size[0],
+        obstacle_size[1],
+        size=(2, n_obstacles),
+    ) * params.resolution
+    sizes = np.maximum(sizes.astype(int), 1)
+    corners = (rng.uniform(size=(2, n_obstacles))
+               * (np.reshape(params.shape, (2, 1)) - sizes)).astype(int)
+    for (x, y), (n_x, n_y) in zip(corners.T, sizes.T):
+        occupancy[x:x+n_x, y:y+n_y] = True
+    return occupancy
+
+
+def waypoint_trajectory(waypoints, speed, rate, n_laps=1):
+    """Fly through waypoints at constant speed, facing the direction of
+    motion
+
+    Args:
+        waypoints: (x, y) GLOBAL coordinates of the waypoints (2 x n)
+        speed: Speed in meters/second
+        rate: Number of states per second
+        n_laps: Number of times the waypoints are visited (the trajectory
+            goes back to the first waypoint between two laps)
+
+    Returns:
+        States (3 x n_steps) and timestamps in seconds (n_steps,)
+    """
+    waypoints = np.asarray(waypoints, dtype=float).reshape((2, -1))
+    if n_laps > 1:
+        waypoints = np.concatenate((
+            np.tile(waypoints, n_laps),
+            waypoints[:, :1],
+        ), axis=1)
+    deltas = np.diff(waypoints, axis=1)
+    lengths = np.hypot(deltas[0], deltas[1])
+    distances = np.concatenate(([0], np.cumsum(lengths)))
+    timestamps = np.arange(0, distances[-1] / speed, 1 / rate)
+    travelled = timestamps * speed
+
+    # yaw of each segment, see mapping.target_cell for the convention
+    segment = np.clip(
+        np.searchsorted(distances, travelled, side="right") - 1,
+        0,
+        len(lengths) - 1,
+    )
+    states = np.stack((
+        np.interp(travelled, distances, waypoints[0]),
+        np.interp(travelled, distances, waypoints[1]),
+        np.arctan2(-deltas[1], deltas[0])[segment],
+    ))
+    return states, timestamps
+
+
+def cast_rays(
+    occupancy, params, states, angles, max_range, max_samples=2 ** 20
+):
+    """Measure the distance to the closest obstacle along each beam
+
+    The beams are sampled every quarter of a cell up to max_range. The
+    borders of the map stop the beams as well.
+
+    Args:
+        occupancy: Boolean occupancy map
+        params: Grid map parameters dictionary or MapParams
+        states: States of the vehicle (3 x n_steps)
+        angles: Scan angles (n_angles,)
+        max_range: Maximum range of the sensor in meters
+        max_samples: Number of beam samples computed at once (bounds the
+            memory). The states are ray cast in batches of
+            max_samples // (n_angles * n_samples_per_beam), at least one
+
+    Returns:
+        Ranges (n_angles x n_steps) in meters, max_range if nothing was hit
+        Boolean mask (n_angles x n_steps) of the beams that hit an obstacle
+    """
+    params = get_map_params(params)
+    states = np.reshape(states, (3, -1))
+    angles = np.reshape(angles, (-1, 1))
+    steps = np.arange(1, int(np.ceil(4 * max_range * params.resolution)) + 1) \
+        * (0.25 * params.inverse_resolution)
+    steps = steps[steps <= max_range]
+    batch_size = max(1, max_samples // (len(angles) * len(steps)))
+    flat = occupancy.reshape(-1)
+    (x_min, x_max), (y_min, y_max) = params.bounds
+
+    ranges = np.full((len(angles), states.shape[1]), float(max_range))
+    hits = np.zeros(ranges.shape, dtype=bool)
+    for i in range(0, states.shape[1], batch_size):
+        batch = states[:, i:i+batch_size]
+        yaws = batch[2] + angles  # n_angles x n_batch
+        # sample positions: n_steps x n_angles x n_batch
+        x = batch[0] + steps.reshape((-1, 1, 1)) * np.cos(yaws)
+        y = batch[1] - steps.reshape((-1, 1, 1)) * np.sin(yaws)
+        outside = (x < x_min) | (x >= x_max) | (y < y_min) | (y >= y_max)
+        idx = discretize(np.stack((x, y)), params).astype(np.int64)
+        blocked = flat[idx[0] * params.shape[1] + idx[1]] | outside
+        first = np.argmax(blocked, axis=0)
+        hit = blocked.any(axis=0)
+        ranges[:, i:i+batch_size] = np.where(hit, steps[first], max_range)
+        hits[:, i:i+batch_size] = hit
+    return ranges, hits
+
+
+def simulate_flight(
+    occupancy, params, states, angles,
+    max_range=4.0, range_std=0., dropout=0., motion_std=None, rng=None
+):
+    """Simulate the measurements of a flight
+
+    Args:
+        occupancy: Boolean occupancy map
+        params: Grid map parameters dictionary or MapParams
+        states: Ground truth states (3 x n_steps)
+        angles: Scan angles
+        max_range: Maximum range of the sensor in meters
+        range_std: Standard deviation of the range noise in meters
+        dropout: Probability that a beam reports nothing
+        motion_std: Standard deviation of the noise on the motion updates
+            (dx, dy, dyaw)
+        rng: Random generator of the noise (see crazyslam.rng)
+
+    Returns:
+        Ranges (n_angles x n_steps) in meters
+        Boolean mask (n_angles x n_steps) of the beams that hit an obstacle
+        Motion updates (3 x n_steps): noisy GLOBAL frame displacements, the
+            first one from the origin to the first state
+    """
+    rng = get_rng(rng)
+    ranges, hits = cast_rays(occupancy, params, states, angles, max_range)
+    if range_std > 0:
+        ranges = np.where(
+            hits,
+            np.clip(
+                ranges + rng.normal(scale=range_std, size=ranges.shape),
+                0,
+                max_range,
+            ),
+            ranges,
+        )
+    if dropout > 0:
+        lost = rng.uniform(size=ranges.shape) < dropout
+        ranges[lost] = max_range
+        hits &= ~lost
+
+    motion_updates = np.diff(states, axis=1, prepend=np.zeros((3, 1)))
+    if motion_std is not None:
+        motion_updates = motion_updates + rng.normal(
+            size=motion_updates.shape) * np.reshape(motion_std, (3, 1))
+    return ranges, hits, motion_updates
+
+
+def to_raw_ranges(ranges, hits):
+    """Convert ranges to the Multi-ranger format
+
+    Args:
+        ranges: Ranges in meters
+        hits: Boolean mask of the beams that hit an obstacle
+
+    Returns:
+        uint16 ranges in millimeters, OUT_OF_RANGE if nothing was hit
+    """
+    raw = np.clip(np.round(ranges * 1e3), 0, OUT_OF_RANGE - 1)
+    return np.where(hits, raw, OUT_OF_RANGE).astype(np.uint16)
+
+
+def generate_log_stream(
+    states, raw_ranges, rate,
+    height=0.3, ceiling=2.5
+):
+    """Replay a flight as the data points of the logger
+
+    Yields the same variables as crazyslam.logger.init_log_conf, to feed a
+    logging callback (or preprocessing.get_multiranger_ranges).
+
+    Args:
+        states: States of the vehicle (3 x n_steps)
+        raw_ranges: Raw horizontal ranges (4 x n_steps) in the order of
+            preprocessing.MULTIRANGER_VARIABLES (see to_raw_ranges)
+        rate: Number of data points per second
+        height: Flight height in meters (down range)
+        ceiling: Height of the ceiling in meters (up range is ceiling -
+            height)
+
+    Yields:
+        (timestamp in milliseconds, dictionary of logged variables)
+    """
+    period = 1000 / rate
+    zrange = int(round(height * 1e3))
+    up = int(round((ceiling - height) * 1e3))
+    yaws = np.degrees(states[2])
+    for t in range(states.shape[1]):
+        data = {"range.zrange": zrange, "range.up": up}
+        for k in (0, 2, 1, 3):  # front, back, left, right
+            data[MULTIRANGER_VARIABLES[k]] = int(raw_ranges[k, t])
+        data["stateEstimate.x"] = float(states[0, t])
+        data["stateEstimate.y"] = float(states[1, t])
+        data["stabilizer.yaw"] = float(yaws[t])
+        yield int(t * period), data
@@ -6,8 +6,13 @@ state estimates while also mapping the environment.
 
 
 import numpy as np
-from crazyslam.mapping import update_grid_map, create_empty_map
-from crazyslam.localization import get_state_estimate
+from crazyslam.mapping import update_grid_map, create_empty_map, \
+    get_map_params, pack_occupancy, update_packed_occupancy
+from crazyslam.localization import get_state_estimate, resize_particles, \
+    get_estimator
+from crazyslam.motion import get_motion_model
+from crazyslam.beams import has_moved
+from crazyslam.rng import get_rng
 
 
 class SLAM():
@@ -19,13 +24,37 @@ class SLAM():
 
     Attributes:
         map: Occupancy grid map
-        params: Grid map parameters dictionary
+        occupancy: Packed bitmask of the occupied cells of the map (see
+            crazyslam.mapping.pack_occupancy). Packed on first access, then
+            updated with the regions modified by each map update
+        packed_scoring: If True, the particles are scored against occupancy
+            instead of the map
+        params: Grid map parameters (MapParams)
         n_particles: Number of particles for the Particle Filter
         system_noise_variance: Variance for noise generation
         correlation_matrix: Matrix for computing the correlation scores
         resampling_threshold: Threshold for resampling
-        current_state: Current state (i.e. particle with the highest score)
+        current_state: Current state (by default the particle with the
+            highest score, see estimator)
         particles: Set of state estimates and their corresponding weight
+        motion_model: Function used to propagate the particles (see
+            crazyslam.motion)
+        motion_noise: Standard deviation of the motion model noise
+        estimator: Function computing current_state from the particles (see
+            crazyslam.localization.ESTIMATORS)
+        rng: Random generator of the filter (see crazyslam.rng)
+        dtype: Floating point type of the particles and of the map
+        min_translation: Minimum translation between two map updates
+        min_rotation: Minimum rotation between two map updates
+        map_state: State at the last map update
+        track_dirty_regions: If True, log the regions modified by the map
+            updates (see pop_dirty_regions)
+        dirty_regions: Log of the (x_min, x_max, y_min, y_max) regions of the
+            map modified since the last call to pop_dirty_regions
+        subscribers: Functions called at the end of each update (see
+            subscribe)
+        scoring_map: Optional map used to score the particles instead of
+            map, e.g. a snapshot of a shared map (see crazyslam.server)
     """
 
     def __init__(
@@ -35,60 +64,212 @@ class SLAM():
         current_state,
         system_noise_variance,
         correlation_matrix,
+        motion_model="global",
+        motion_noise=None,
+        min_translation=0,
+        min_rotation=0,
+        estimator="best",
+        rng=None,
+        dtype=np.float64,
+        track_dirty_regions=False,
+        packed_scoring=False,
     ):
         """
         Initialize a SLAM agent.
 
         Store all arguments and initialize the particles with current_state
-        as a first state estimate.
+        as a first state estimate. motion_model is either the name of one of
+        the models in crazyslam.motion.MOTION_MODELS or a function with the
+        same signature. The map is only updated once the vehicle moved by
+        min_translation meters or min_rotation radians since the last map
+        update (every step by default). estimator is either the name of one
+        of the estimators in crazyslam.localization.ESTIMATORS or a function
+        with the same signature. rng is a numpy Generator or a seed (see
+        crazyslam.rng); the global numpy random state is used if it is None.
+        dtype is the floating point type of the particles, of the beam
+        geometry and of the map: np.float32 halves the memory traffic of
+        the filter for a small loss of accuracy. The modified regions of the
+        map are only logged if track_dirty_regions is True, so that the log
+        doesn't grow when nothing pops it (subscribers get the regions of
+        each update anyway). packed_scoring reads the occupancy of the
+        scored cells from a bitmask of the map (1 bit per cell), which only
+        pays off on maps that don't fit in the CPU caches (see
+        examples/bench_scoring.py).
         """
-        self.map = create_empty_map(params)
-        self.params = params
+        self.dtype = np.dtype(dtype)
+        self.params = get_map_params(params)
+        self.map = create_empty_map(self.params, self.dtype)
         self.n_particles = n_particles
         self.system_noise_variance = system_noise_variance
         self.correlation_matrix = correlation_matrix
         self.resampling_threshold = (n_particles * 10) // 100
-        self.current_state = current_state
-        self.particles = np.zeros((4, n_particles))
+        self.current_state = np.asarray(current_state, dtype=self.dtype)
+        self.particles = np.zeros((4, n_particles), dtype=self.dtype)
         self.particles[:3, :] = current_state.reshape((3, 1)) \
             * np.ones((3, n_particles))
         self.particles[3, :] = (1/500) * np.ones((1, n_particles))
+        self.motion_model = get_motion_model(motion_model)
+        self.motion_noise = motion_noise
+        self.estimator = get_estimator(estimator)
+        self.rng = None if rng is None else get_rng(rng)
+        self.min_translation = min_translation
+        self.min_rotation = min_rotation
+        self.map_state = None
+        self.track_dirty_regions = track_dirty_regions
+        self.dirty_regions = list()
+        self.subscribers = list()
+        self.scoring_map = None
+        self.packed_scoring = packed_scoring
 
-    def update_state(self, ranges, angles, motion_update):
+    def update_state(
+        self,
+        ranges,
+        angles,
+        motion_update,
+        hits=None,
+        update_map=True,
+    ):
         """
         Update state estimate. One iteration of the SLAM algorithm
 
         Args:
             ranges: Set on range inputs from sensor
             angles: Scan angles
-            motion_update: Update to apply to the current state
+            motion_update: Input of the motion model (e.g. (dx, dy, dyaw)
+                in the GLOBAL frame for the default model)
+            hits: Optional boolean mask of the beams that hit an obstacle
+                (see crazyslam.preprocessing). The other beams only update
+                the free space of the map and are not used for scoring
+            update_map: If False, skip the map update for this step
 
         Returns:
             Updated state estimate
 
         """
-        # map update
-        self.map = update_grid_map(
-            self.map,
-            ranges,
-            angles,
+        # map update (skipped if the vehicle barely moved)
+        regions = list()
+        if update_map and has_moved(
             self.current_state,
-            self.params,
-        )
+            self.map_state,
+            self.min_translation,
+            self.min_rotation,
+        ):
+            update_grid_map(
+                self.map,
+                ranges,
+                angles,
+                self.current_state,
+                self.params,
+                regions,
+                hits,
+            )
+            if self.packed_map is not None:
+                update_packed_occupancy(self.packed_map, self.map, regions)
+            self.map_state = np.copy(self.current_state)
+            if self.track_dirty_regions:
+                self.dirty_regions.extend(regions)
 
         # motion model update
-        self.particles[:3, :] += motion_update.reshape((3, 1)) \
-            * np.ones((3, self.n_particles))
+        self.motion_model(
+            self.particles[:3, :],
+            motion_update,
+            self.motion_noise,
+            self.rng,
+        )
+
+        # state update, using the beams that hit an obstacle only. The
+        # bitmask is only maintained for the agent's own map
+        scoring_map, occupancy = self.scoring_map, None
+        if scoring_map is None:
+            scoring_map = self.map
+            if self.packed_scoring:
+                occupancy = self.occupancy
+        if hits is not None:
+            ranges, angles = ranges[hits], angles[hits]
+        if len(ranges) == 0:
+            self.current_state = self.estimator(self.particles)
+        else:
+            self.current_state, self.particles = get_state_estimate(
+                self.particles,
+                self.system_noise_variance,
+                self.correlation_matrix,
+                scoring_map,
+                self.params,
+                ranges,
+                angles,
+                self.resampling_threshold,
+                self.estimator,
+                occupancy,
+                self.rng,
+            )
+        # custom estimators don't necessarily keep the dtype of the particles
+        self.current_state = np.asarray(self.current_state, dtype=self.dtype)
+
+        for callback in self.subscribers:
+            callback(self, regions)
+        return self.current_state
+
+    @property
+    def map(self):
+        """Occupancy grid map"""
+        return self.grid_map
 
-        # state update
-        self.current_state, self.particles = get_state_estimate(
+    @map.setter
+    def map(self, grid_map):
+        # packed lazily, so that a memory-mapped map isn't read at once
+        self.grid_map = grid_map
+        self.packed_map = None
+
+    @property
+    def occupancy(self):
+        """Packed bitmask of the occupied cells of the map"""
+        if self.packed_map is None:
+            self.packed_map = pack_occupancy(self.grid_map)
+        return self.packed_map
+
+    def set_n_particles(self, n_particles):
+        """
+        Change the number of particles of the filter.
+
+        The new set of particles is drawn from the current one given the
+        weights, and the resampling threshold is updated accordingly.
+
+        Args:
+            n_particles: New number of particles
+        """
+        self.particles = resize_particles(
             self.particles,
-            self.system_noise_variance,
-            self.correlation_matrix,
-            self.map,
-            self.params,
-            ranges,
-            angles,
-            self.resampling_threshold
+            n_particles,
+            self.rng,
         )
-        return self.current_state
+        self.n_particles = n_particles
+        self.resampling_threshold = (n_particles * 10) // 100
+
+    def subscribe(self, callback):
+        """
+        Register a function called at the end of each update.
+
+        The function is called with the SLAM agent and the list of the
+        regions of the map modified by the update. It runs in the SLAM loop,
+        so it should return quickly.
+
+        Args:
+            callback: Function callback(slam_agent, regions)
+        """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        """Remove a function registered with subscribe"""
+        self.subscribers.remove(callback)
+
+    def pop_dirty_regions(self):
+        """
+        Return the regions of the map modified since the last call and clear
+        the log. Only logged if track_dirty_regions is True.
+
+        Returns:
+            List of (x_min, x_max, y_min, y_max) regions of INDEX coordinates
+        """
+        regions = self.dirty_regions
+        self.dirty_regions = list()
+        return regions
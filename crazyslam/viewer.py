@@ -0,0 +1,228 @@
+"""Viewer module
+
+This module implements a live viewer of the SLAM algorithm. The viewer
+subscribes to the updates of a SLAM agent and renders the map and the
+trajectory on a separate thread, at a limited frame rate, without any
+window (Agg canvas). The SLAM loop only copies the modified parts of the map,
+so it is never blocked by the rendering.
+"""
+
+
+import threading
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from crazyslam.mapping import get_map_params, discretize
+
+
+class LiveViewer():
+    """
+    Throttled, incremental viewer of a SLAM agent.
+
+    The map is displayed as a grid of image tiles. At each frame, only the
+    tiles that intersect the modified regions of the map and the new
+    segment of the trajectory are drawn again (blitting), instead of the
+    whole figure.
+
+    Attributes:
+        params: Grid map parameters (MapParams)
+        fps: Maximum number of frames per second
+        tile_size: Size of a tile in map cells
+        display: Copy of the map owned by the viewer
+        trajectory: List of the (x, y) INDEX coordinates of the states
+        figure, canvas, axes: Matplotlib objects (Agg canvas)
+        tiles: Image artist of each tile, indexed by (row, column)
+        n_frames: Number of rendered frames
+    """
+
+    def __init__(
+        self,
+        params,
+        fps=5,
+        tile_size=64,
+        figsize=(8, 8),
+        vmin=-5,
+        vmax=5,
+    ):
+        """
+        Initialize the figure. vmin and vmax are the log odds displayed as
+        white (free) and black (occupied).
+        """
+        self.params = get_map_params(params)
+        self.fps = fps
+        self.tile_size = tile_size
+        self.display = np.zeros(self.params.shape, dtype=np.float32)
+        self.trajectory = list()
+        self.n_frames = 0
+
+        # updates received from the SLAM loop, waiting to be rendered
+        self.lock = threading.Lock()
+        self.pending_patches = list()
+        self.pending_states = list()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # figure, with every dynamic artist excluded from the background
+        self.figure = Figure(figsize=figsize)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.set_xlim(-0.5, self.params.shape[1] - 0.5)
+        self.axes.set_ylim(self.params.shape[0] - 0.5, -0.5)
+        self.tiles = dict()
+        for row in range(-(-self.params.shape[0] // tile_size)):
+            for column in range(-(-self.params.shape[1] // tile_size)):
+                x_min, y_min = row * tile_size, column * tile_size
+                block = self.get_tile_block(row, column)
+                self.tiles[row, column] = self.axes.imshow(
+                    -block,
+                    cmap="gray",
+                    vmin=-vmax,
+                    vmax=-vmin,
+                    extent=(
+                        y_min - 0.5,
+                        y_min + block.shape[1] - 0.5,
+                        x_min + block.shape[0] - 0.5,
+                        x_min - 0.5,
+                    ),
+                    interpolation="nearest",
+                    animated=True,
+                )
+        self.trajectory_line, = self.axes.plot(
+            [], [], "-r", linewidth=1, animated=True)
+        self.segment_line, = self.axes.plot(
+            [], [], "-r", linewidth=1, animated=True)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.draw_all()
+
+    def get_tile_block(self, row, column):
+        """View of the displayed map covered by a tile"""
+        return self.display[
+            row*self.tile_size:(row+1)*self.tile_size,
+            column*self.tile_size:(column+1)*self.tile_size,
+        ]
+
+    def on_update(self, slam_agent, regions):
+        """
+        Receive an update of the SLAM agent (see SLAM.subscribe)
+
+        Only copies the modified regions of the map and the current state,
+        the rendering is done by the viewer thread.
+
+        Args:
+            slam_agent: SLAM agent
+            regions: Regions of the map modified by the update
+        """
+        patches = [
+            (region, slam_agent.map[
+                region[0]:region[1],
+                region[2]:region[3],
+            ].copy())
+            for region in regions
+        ]
+        state = np.array(slam_agent.current_state[:2])
+        with self.lock:
+            self.pending_patches.extend(patches)
+            self.pending_states.append(state)
+
+    def render(self):
+        """
+        Render a frame with the pending updates
+
+        Returns:
+            True if something was drawn
+        """
+        with self.lock:
+            patches, self.pending_patches = self.pending_patches, list()
+            states, self.pending_states = self.pending_states, list()
+        if len(patches) == 0 and len(states) == 0:
+            return False
+
+        # apply the patches and find the modified tiles
+        dirty_tiles = set()
+        for (x_min, x_max, y_min, y_max), patch in patches:
+            self.display[x_min:x_max, y_min:y_max] = patch
+            for row in range(
+                x_min // self.tile_size,
+                (x_max - 1) // self.tile_size + 1,
+            ):
+                for column in range(
+                    y_min // self.tile_size,
+                    (y_max - 1) // self.tile_size + 1,
+                ):
+                    dirty_tiles.add((row, column))
+
+        # new segment of the trajectory (starting from the last known point)
+        segment = self.trajectory[-1:]
+        if len(states) > 0:
+            idx = discretize(np.stack(states, axis=1), self.params)
+            segment += [tuple(point) for point in idx.T]
+            self.trajectory += segment[1 if len(self.trajectory) else 0:]
+
+        for row, column in dirty_tiles:
+            tile = self.tiles[row, column]
+            tile.set_data(-self.get_tile_block(row, column))
+            self.axes.draw_artist(tile)
+        if len(dirty_tiles) > 0:
+            # the redrawn tiles may have covered parts of the trajectory
+            self.set_line_data(self.trajectory_line, self.trajectory)
+            self.axes.draw_artist(self.trajectory_line)
+        else:
+            self.set_line_data(self.segment_line, segment)
+            self.axes.draw_artist(self.segment_line)
+        self.canvas.blit(self.axes.bbox)
+        self.n_frames += 1
+        return True
+
+    def draw_all(self):
+        """Draw the whole map and trajectory over the background"""
+        self.canvas.restore_region(self.background)
+        for (row, column), tile in self.tiles.items():
+            tile.set_data(-self.get_tile_block(row, column))
+            self.axes.draw_artist(tile)
+        self.set_line_data(self.trajectory_line, self.trajectory)
+        self.axes.draw_artist(self.trajectory_line)
+        self.canvas.blit(self.axes.bbox)
+
+    @staticmethod
+    def set_line_data(line, points):
+        """Set the (x, y) INDEX coordinates of a line"""
+        points = np.array(points).reshape((-1, 2))
+        line.set_data(points[:, 1], points[:, 0])
+
+    def get_frame(self):
+        """Return a copy of the last rendered frame (RGBA array)"""
+        return np.asarray(self.canvas.buffer_rgba()).copy()
+
+    def run(self):
+        """Render loop, throttled to fps"""
+        while not self.stop_event.wait(1 / self.fps):
+            self.render()
+
+    def start(self, slam_agent=None):
+        """
+        Start the render thread
+
+        Args:
+            slam_agent: If given, subscribe to its updates
+        """
+        if slam_agent is not None:
+            slam_agent.subscribe(self.on_update)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self, slam_agent=None):
+        """
+        Stop the render thread and render the last updates
+
+        Args:
+            slam_agent: If given, unsubscribe from its updates
+        """
+        if slam_agent is not None:
+            slam_agent.unsubscribe(self.on_update)
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.render()
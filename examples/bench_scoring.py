@@ -0,0 +1,73 @@
+import time
+import argparse
+import numpy as np
+from crazyslam.mapping import pack_occupancy
+from crazyslam.localization import get_correlation_score
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--n_particles",
+    default=1000,
+    help="Number of particles",
+)
+parser.add_argument(
+    "--n_beams",
+    default=32,
+    help="Number of beams per scan",
+)
+parser.add_argument(
+    "--sizes",
+    default="256,1024,4096",
+    help="Comma separated sizes of the square maps, in cells",
+)
+parser.add_argument(
+    "--n_repeats",
+    default=20,
+    help="Number of scoring calls per measurement",
+)
+
+
+def measure(function, n_repeats):
+    """Best time of a call, in seconds"""
+    times = list()
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    n_particles = int(args.n_particles)
+    n_beams = int(args.n_beams)
+    n_repeats = int(args.n_repeats)
+    correlation_matrix = np.array([[0, -1], [-1, 10]])
+
+    print("{:>6} {:>10} {:>10} {:>14} {:>14} {:>8}".format(
+        "cells", "map (MB)", "bits (MB)",
+        "float (M/s)", "packed (M/s)", "speedup",
+    ))
+    for n_cells in [int(size) for size in args.sizes.split(",")]:
+        grid = np.random.normal(size=(n_cells, n_cells))
+        occupancy = pack_occupancy(grid)
+        # particles spread over the map: the gathers hit random cache lines
+        target_cells = np.random.randint(
+            n_cells,
+            size=(2, n_beams, n_particles),
+        ).astype(np.int16)  # same dtype as discretize
+
+        float_time = measure(lambda: get_correlation_score(
+            grid, target_cells, correlation_matrix), n_repeats)
+        packed_time = measure(lambda: get_correlation_score(
+            grid, target_cells, correlation_matrix, occupancy), n_repeats)
+        n_lookups = n_beams * n_particles / 1e6
+        print("{:>6} {:>10.1f} {:>10.2f} {:>14.1f} {:>14.1f} {:>8.2f}".format(
+            n_cells,
+            grid.nbytes / 2**20,
+            occupancy.nbytes / 2**20,
+            n_lookups / float_time,
+            n_lookups / packed_time,
+            float_time / packed_time,
+        ))
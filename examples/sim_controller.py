@@ -1,32 +1,21 @@
-from crazyslam.control import *
-
-
-listener = keyboard.Listener(
-    on_release=on_release
-)
-listener.start()
-keyCapture = None
+import os
+from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
+from cflib.positioning.motion_commander import MotionCommander
+from crazyslam.control import KeyController
+from crazyslam.utils import get_address
 
 
 if __name__ == '__main__':
-    os.environ["VELOCITY"] = str(0.1)      # meters/second
-    os.environ["RATE"] = str(360.0 / 5)    # degrees/second
-    os.environ["YAW_DEG"] = str(10)        # degrees
+    os.environ.setdefault("VELOCITY", str(0.1))      # meters/second
+    os.environ.setdefault("RATE", str(360.0 / 5))    # degrees/second
+    os.environ.setdefault("YAW_DEG", str(10))        # degrees
     cf = Crazyflie(rw_cache="cache")
-    abort = False
-    land = False
-    velocity_x = 0.0
-    velocity_y = 0.0
     with SyncCrazyflie(get_address(), cf=cf) as scf:
         with MotionCommander(scf, default_height=0.1) as mc:
-            while not abort and not land:
-                if get_key_capture() is not None:
-                    abort, land, velocity_x, velocity_y = key_controller(
-                        mc,
-                        velocity_x,
-                        velocity_y
-                    )
-                print(velocity_x, velocity_y)
-                time.sleep(0.1)
-            if abort:
+            controller = KeyController.from_env(mc)
+            controller.start()
+            aborted = controller.wait()
+            controller.stop()
+            if aborted:
                 cf.commander.send_stop_setpoint()
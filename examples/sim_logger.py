@@ -1,8 +1,9 @@
+import os
 import sys
 import time
-import logging
-from crazyslam.logging import *
+from crazyslam.logger import init_log_conf, write_to_disk
 from cflib.crazyflie import Crazyflie
+from cflib.crazyflie.syncCrazyflie import SyncCrazyflie
 from crazyslam.utils import get_address
 
 
@@ -4,6 +4,7 @@ from scipy.io import loadmat
 import matplotlib.pyplot as plt
 import matplotlib
 from crazyslam.mapping import *
+from crazyslam.beams import select_uniform_beams
 
 
 parser = argparse.ArgumentParser()
@@ -23,25 +24,21 @@ if __name__ == '__main__':
     angles = np.array(data["scanAngles"])
     timestamp = np.array(data["t"])
 
-    selected_idx = np.linspace(
-        0,
-        len(angles)-1,
-        int(args.n_data_points),
-        dtype="int32"
-    )
+    selected_idx = select_uniform_beams(len(angles), int(args.n_data_points))
     angles = angles[selected_idx, :]
     ranges = ranges[selected_idx, :]
 
     params = init_params_dict(70, 10)
     occupancy_grid = create_empty_map(params)
 
-    # for each timestamp
-    for i in tqdm(range(states.shape[1])):
-        occupancy_grid = update_grid_map(
+    # poses are known: integrate the scans by batches
+    batch_size = 500
+    for i in tqdm(range(0, states.shape[1], batch_size)):
+        occupancy_grid = update_grid_map_batch(
             occupancy_grid,
-            ranges[:, i],
+            ranges[:, i:i+batch_size],
             angles,
-            states[:, i],
+            states[:, i:i+batch_size],
             params
         )
 
@@ -6,6 +6,9 @@ import matplotlib.pyplot as plt
 import matplotlib
 from crazyslam.slam import SLAM
 from crazyslam.mapping import init_params_dict, discretize
+from crazyslam.persistence import save_session
+from crazyslam.beams import select_uniform_beams
+from crazyslam.posegraph import smooth_trajectory, render_map
 
 
 parser = argparse.ArgumentParser()
@@ -19,6 +22,21 @@ parser.add_argument(
     default=100,
     help="Number of particles in the particle filter",
 )
+parser.add_argument(
+    "--min_translation",
+    default=0,
+    help="Minimum translation (meters) between two map updates",
+)
+parser.add_argument(
+    "--smooth",
+    action="store_true",
+    help="Smooth the trajectory with the odometry and render the map again",
+)
+parser.add_argument(
+    "--session_dir",
+    default=None,
+    help="If set, save the SLAM session to this directory at the end",
+)
 
 
 if __name__ == '__main__':
@@ -29,12 +47,7 @@ if __name__ == '__main__':
     ranges = data["ranges"]
     angles = data["scanAngles"]
     states = np.array(data["pose"])
-    selected_idx = np.linspace(
-        0,
-        len(angles)-1,
-        int(args.n_data_points),
-        dtype="int32"
-    )
+    selected_idx = select_uniform_beams(len(angles), int(args.n_data_points))
     angles = angles[selected_idx, :]
     ranges = ranges[selected_idx, :]
 
@@ -70,6 +83,7 @@ if __name__ == '__main__':
         current_state=states_noise[:, 0],
         system_noise_variance=system_noise_variance,
         correlation_matrix=correlation_matrix,
+        min_translation=float(args.min_translation),
     )
 
     # Main loop
@@ -80,7 +94,13 @@ if __name__ == '__main__':
             motion_updates[:, t],
         )
 
+    if args.session_dir is not None:
+        save_session(slam_agent, args.session_dir)
+
     slam_map = slam_agent.map
+    if args.smooth:
+        slam_states = smooth_trajectory(states_noise, slam_states)
+        slam_map = render_map(slam_states, ranges, angles, slam_agent.params)
     idx_slam = discretize(slam_states[:2, :], slam_agent.params)
     idx_noise = discretize(states_noise[:2, :], slam_agent.params)
 
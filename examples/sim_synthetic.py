@@ -0,0 +1,100 @@
+import time
+import argparse
+from tqdm import tqdm
+import numpy as np
+import matplotlib.pyplot as plt
+from crazyslam.slam import SLAM
+from crazyslam.mapping import init_params_dict, discretize
+from crazyslam.preprocessing import MULTIRANGER_ANGLES, \
+    get_multiranger_ranges, preprocess_ranges
+from crazyslam.simulation import create_synthetic_map, waypoint_trajectory, \
+    simulate_flight, to_raw_ranges, generate_log_stream
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument(
+    "--n_laps",
+    default=10,
+    help="Number of laps around the room",
+)
+parser.add_argument(
+    "--n_particles",
+    default=100,
+    help="Number of particles in the particle filter",
+)
+parser.add_argument(
+    "--rate",
+    default=10,
+    help="Logging rate (data points per second)",
+)
+parser.add_argument(
+    "--float32",
+    action="store_true",
+    help="Run the filter and the map in single precision",
+)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    rate = float(args.rate)
+
+    # Synthetic flight
+    params = init_params_dict(size=10, resolution=10)
+    occupancy = create_synthetic_map(params, n_obstacles=8)
+    states, _ = waypoint_trajectory(
+        [[-3, 3, 3, -3], [-3, -3, 3, 3]],
+        speed=0.5,
+        rate=rate,
+        n_laps=int(args.n_laps),
+    )
+    start = time.perf_counter()
+    ranges, hits, motion_updates = simulate_flight(
+        occupancy,
+        params,
+        states,
+        MULTIRANGER_ANGLES,
+        range_std=0.01,
+        dropout=0.01,
+        motion_std=(0.02, 0.02, 0.02),
+    )
+    stream = generate_log_stream(states, to_raw_ranges(ranges, hits), rate)
+    print("Simulated {:.0f} s of flight in {:.2f} s".format(
+        states.shape[1] / rate,
+        time.perf_counter() - start,
+    ))
+
+    slam_agent = SLAM(
+        params=params,
+        n_particles=int(args.n_particles),
+        current_state=states[:, 0],
+        system_noise_variance=np.diag([0.02, 0.02, 0.02]),
+        correlation_matrix=np.array([[0, -1], [-1, 10]]),
+        dtype=np.float32 if args.float32 else np.float64,
+    )
+    slam_states = np.zeros_like(states)
+    motion_updates[:, 0] = 0
+
+    # Main loop, fed by the log stream like a live flight
+    start = time.perf_counter()
+    for t, (_, data) in enumerate(tqdm(stream, total=states.shape[1])):
+        scan_ranges, scan_angles, scan_hits = preprocess_ranges(
+            get_multiranger_ranges(data),
+            MULTIRANGER_ANGLES,
+        )
+        slam_states[:, t] = slam_agent.update_state(
+            scan_ranges,
+            scan_angles,
+            motion_updates[:, t],
+            scan_hits,
+        )
+    elapsed = time.perf_counter() - start
+    print("{:.0f} steps per second".format(states.shape[1] / elapsed))
+
+    idx_slam = discretize(slam_states[:2, :], params)
+    idx_true = discretize(states[:2, :], params)
+    plt.figure(figsize=(11, 11))
+    plt.imshow(slam_agent.map, cmap="gray")
+    plt.plot(idx_slam[1, :], idx_slam[0, :], "-r", label="slam")
+    plt.plot(idx_true[1, :], idx_true[0, :], "-g", label="ground truth")
+    plt.legend()
+    plt.show()
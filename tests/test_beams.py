@@ -0,0 +1,51 @@
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict, create_empty_map
+from crazyslam.beams import *
+
+
+def test_select_uniform_beams():
+    assert (select_uniform_beams(1081, 4) == [0, 360, 720, 1080]).all()
+    assert (select_uniform_beams(3, 10) == [0, 1, 2]).all()
+
+def test_get_occupancy_entropy():
+    entropy = get_occupancy_entropy(np.array([0, 1, -1, 100, -50]))
+    assert np.isclose(entropy[0], np.log(2))
+    assert np.isclose(entropy[1], entropy[2])
+    assert entropy[0] > entropy[1] > entropy[3]
+    assert np.isclose(entropy[3], 0) and np.isclose(entropy[4], 0)
+
+def test_select_informative_beams():
+    params = init_params_dict(size=21, resolution=1)
+    grid_map = create_empty_map(params)
+    state = np.array([0, 0, 0])
+    angles = np.linspace(0, 2*np.pi, 8, endpoint=False)
+    ranges = 5 * np.ones(8)
+    # every beam but 1 and 6 ends in a known cell
+    grid_map[:] = 50
+    grid_map[13, 7] = 0
+    grid_map[10, 15] = 0
+    selected = select_informative_beams(
+        grid_map, params, state, ranges, angles, 2)
+    assert (selected == [1, 6]).all()
+    assert len(select_informative_beams(
+        grid_map, params, state, ranges, angles, 10)) == 8
+
+def test_beam_budget():
+    budget = BeamBudget(target_latency=0.1, min_beams=4, max_beams=100)
+    assert budget.n_beams == 100
+    assert budget.update(0.4, 100) == 25
+    assert budget.update(0.1, 25) == 25
+    for _ in range(100):
+        budget.update(1, 4)
+    assert budget.n_beams == 4
+
+def test_has_moved():
+    state = np.array([1, 1, np.pi - 0.05])
+    assert has_moved(state, None, 1, 1)
+    assert not has_moved(state, np.array([1.1, 1, np.pi - 0.05]), 0.2, 0.2)
+    assert has_moved(state, np.array([1.3, 1, np.pi - 0.05]), 0.2, 0.2)
+    # rotation wraps around pi
+    assert not has_moved(state, np.array([1, 1, -np.pi + 0.05]), 0.2, 0.2)
+    assert has_moved(state, np.array([1, 1, 0]), 0.2, 0.2)
+    assert has_moved(state, state, 0, 0)
@@ -0,0 +1,103 @@
+import pytest
+from crazyslam.control import *
+
+
+class MockMotionCommander():
+    def __init__(self):
+        self.calls = list()
+
+    def start_linear_motion(self, vx, vy, vz, rate_yaw=0.0):
+        self.calls.append(("start_linear_motion", vx, vy, vz, rate_yaw))
+
+    def stop(self):
+        self.calls.append(("stop",))
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class Key():
+    def __init__(self, char=None, name=None):
+        self.char = char
+        self.name = name
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+@pytest.fixture
+def controller(clock):
+    return KeyController(
+        MockMotionCommander(),
+        velocity=0.1,
+        yaw_deg=10,
+        yaw_rate=20,
+        clock=clock,
+    )
+
+def test_from_env():
+    environ = {"VELOCITY": "0.2", "YAW_DEG": "15", "RATE": "30"}
+    controller = KeyController.from_env(MockMotionCommander(), environ)
+    assert (controller.velocity, controller.yaw_deg, controller.yaw_rate) \
+        == (0.2, 15, 30)
+
+def test_on_release(controller):
+    controller.on_release(Key(char="z"))
+    controller.on_release(Key(name="down"))
+    assert controller.on_release(Key(name="esc")) is False
+    assert controller.events.get_nowait() == "z"
+    assert controller.events.get_nowait() == "down"
+    assert controller.events.empty()
+
+def test_translation(controller):
+    for name in ("z", "z", "q", "x"):
+        controller.events.put(name)
+    controller.step()
+    # a single setpoint for all the queued events
+    assert controller.mc.calls == [("start_linear_motion", 0.2, 0.1, 0, 0)]
+    controller.step()
+    assert len(controller.mc.calls) == 1
+
+def test_non_blocking_yaw(controller, clock):
+    controller.events.put("a")
+    controller.step()
+    assert controller.mc.calls[-1] == ("start_linear_motion", 0, 0, 0, -20)
+    # a second press extends the turn, 10 degrees at 20 degrees/second each
+    clock.now = 0.2
+    controller.events.put("a")
+    controller.events.put("z")
+    controller.step()
+    assert controller.mc.calls[-1] == ("start_linear_motion", 0.1, 0, 0, -20)
+    assert controller.yaw_deadline == pytest.approx(1.)
+    clock.now = 0.9
+    controller.step()
+    assert controller.mc.calls[-1][-1] == -20
+    clock.now = 1.
+    controller.step()
+    assert controller.mc.calls[-1] == ("start_linear_motion", 0.1, 0, 0, 0)
+
+def test_land_and_abort(controller):
+    controller.events.put("z")
+    controller.events.put("down")
+    controller.step()
+    assert controller.landed.is_set() and controller.done
+    assert controller.mc.calls == [("stop",)]
+    controller = KeyController(MockMotionCommander())
+    controller.events.put("enter")
+    controller.step()
+    assert controller.aborted.is_set()
+
+def test_thread(controller):
+    controller.start(listen=False)
+    controller.events.put("d")
+    controller.events.put("down")
+    assert controller.wait(timeout=5) is False
+    controller.stop()
+    assert controller.landed.is_set()
+    assert controller.thread is None
@@ -0,0 +1,76 @@
+import os
+import zlib
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict, create_empty_map
+from crazyslam.export import *
+
+
+def read_png(path):
+    with open(path, "rb") as file:
+        data = file.read()
+    width, height = np.frombuffer(data[16:24], dtype=">u4")
+    idat = data.index(b"IDAT")
+    length = int(np.frombuffer(data[idat-4:idat], dtype=">u4")[0])
+    rows = np.frombuffer(
+        zlib.decompress(data[idat+4:idat+4+length]),
+        dtype=np.uint8,
+    ).reshape((height, width + 1))
+    return rows[:, 1:]
+
+def test_to_ternary():
+    log_odds = np.array([-50, -0.5, 0, 0.5, 100])
+    assert np.isclose(log_odds_to_probability(0), 0.5)
+    assert np.isclose(probability_to_log_odds(log_odds_to_probability(3)), 3)
+    assert (to_ternary(log_odds) == [
+        FREE_PIXEL, UNKNOWN_PIXEL, UNKNOWN_PIXEL, UNKNOWN_PIXEL, OCCUPIED_PIXEL,
+    ]).all()
+
+def test_downsample():
+    log_odds = np.arange(15, dtype=float).reshape((3, 5))
+    assert (downsample(log_odds, 2) == [[6, 8, 9], [11, 13, 14]]).all()
+    assert downsample(log_odds, 1) is log_odds
+
+def test_write_png(tmp_path):
+    image = np.random.randint(0, 255, size=(7, 13), dtype=np.uint8)
+    write_png(str(tmp_path / "image.png"), image)
+    assert (read_png(str(tmp_path / "image.png")) == image).all()
+
+def test_export_ros_map(tmp_path):
+    params = init_params_dict(size=(3, 2), resolution=10)
+    grid = create_empty_map(params)
+    grid[0, :] = 10
+    export_ros_map(grid, params, str(tmp_path / "map"))
+    with open(str(tmp_path / "map.pgm"), "rb") as file:
+        data = file.read()
+    header = b"P5\n20 30\n255\n"
+    assert data.startswith(header)
+    image = np.frombuffer(data[len(header):], dtype=np.uint8).reshape((30, 20))
+    assert (image[0, :] == OCCUPIED_PIXEL).all()
+    assert (image[1:, :] == UNKNOWN_PIXEL).all()
+    with open(str(tmp_path / "map.yaml")) as file:
+        yaml = file.read()
+    assert "image: map.pgm\n" in yaml
+    assert "resolution: 0.1\n" in yaml
+    assert "origin: [-1.0, -1.5, 0.0]\n" in yaml
+
+def test_tile_exporter(tmp_path):
+    grid = np.zeros((100, 60))
+    exporter = TileExporter(str(tmp_path), tile_size=16, n_levels=3)
+    paths = exporter.export(grid)
+    assert len(paths) == 7*4 + 4*2 + 2*1
+    assert exporter.export(grid, []) == []
+    grid[40:42, 20:22] = 10
+    paths = exporter.export(grid, [(40, 42, 20, 22)])
+    assert sorted(paths) == sorted([
+        exporter.get_tile_path(0, 2, 1),
+        exporter.get_tile_path(1, 1, 0),
+        exporter.get_tile_path(2, 0, 0),
+    ])
+    tile = read_png(exporter.get_tile_path(1, 1, 0))
+    assert tile.shape == (16, 16)
+    assert (tile[4, 10] == OCCUPIED_PIXEL)
+    assert (tile == OCCUPIED_PIXEL).sum() == 1
+    # padding of the tiles on the border of the map
+    tile = read_png(exporter.get_tile_path(0, 6, 3))
+    assert (tile[:4, :12] == UNKNOWN_PIXEL).all()
@@ -0,0 +1,17 @@
+import sys
+import subprocess
+
+
+def test_lazy_imports():
+    # run in a new interpreter, the test session already imported everything
+    code = (
+        "import sys\n"
+        "import crazyslam\n"
+        "from crazyslam.slam import SLAM\n"
+        "import crazyslam.control, crazyslam.logger, crazyslam.utils\n"
+        "assert crazyslam.SLAM is SLAM\n"
+        "heavy = ('skimage', 'scipy', 'matplotlib', 'cflib', 'pynput')\n"
+        "print([m for m in heavy if m in sys.modules])\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == "[]"
@@ -1,3 +1,4 @@
+import pickle
 import pytest
 from crazyslam.localization import *
 from crazyslam.mapping import *
@@ -52,6 +53,32 @@ def test_update_particle_weights():
     )
     assert test_particles[-1, 0] > test_particles[-1, 1]
 
+def test_update_particle_weights_single_beam():
+    params = init_params_dict(11, 1)
+    map = create_empty_map(params)
+    map[8, 5] = 10
+    correlation_matrix = np.array([
+        [0, -1],
+        [0,  1],
+    ])
+    particles = np.array([
+        [  1,   2,   0],
+        [  0,   0,   0],
+        [  0,   0,   0],
+        [1/3, 1/3, 1/3],
+    ])
+    test_particles = update_particle_weights(
+        particles,
+        correlation_matrix,
+        map,
+        params,
+        np.array([2]),
+        np.array([0]),
+    )
+    assert test_particles[-1, 0] > 0.5
+    assert test_particles[-1, 1] == test_particles[-1, 2]
+    assert test_particles[-1, 1] < test_particles[-1, 0]
+
 def test_get_best_particle():
     particles = np.array([
         [1, 7, 2, 7],
@@ -94,3 +121,110 @@ def test_get_state_estimate():
         np.abs(state_estimate - particles[:3, 0]) <
         np.abs(state_estimate - particles[:3, 1])
     )
+
+def test_init_uniform_particles():
+    params = init_params_dict(11, 2)
+    map = create_empty_map(params)
+    map[3:9, 12:20] = -1
+    map[5, 15] = 10
+    free_cells = index_free_space(map)
+    assert len(free_cells) == 6*8 - 1
+    particles = init_uniform_particles(1000, free_cells, map.shape, params)
+    assert particles.shape == (4, 1000)
+    assert np.isclose(particles[3, :].sum(), 1)
+    assert (np.abs(particles[2, :]) <= np.pi).all()
+    cells = discretize(particles[:2, :], params)
+    assert (map[cells[0], cells[1]] < 0).all()
+
+def test_get_average_log_likelihood():
+    scores = np.array([1000, 1000 + np.log(3)])
+    assert np.isclose(get_average_log_likelihood(scores), 1000 + np.log(2))
+
+def test_get_injection_probability():
+    averages = None
+    averages = update_likelihood_averages(averages, 10, 0.1, 0.5)
+    assert get_injection_probability(averages) == 0
+    averages = update_likelihood_averages(averages, 0, 0.1, 0.5)
+    assert averages == (9, 5)
+    assert np.isclose(get_injection_probability(averages), 1 - np.exp(-4))
+
+def test_inject_random_particles():
+    params = init_params_dict(11, 1)
+    map = -np.ones((11, 11))
+    particles = np.zeros((4, 100))
+    free_cells = index_free_space(map)
+    particles = inject_random_particles(
+        particles, 0, free_cells, map.shape, params)
+    assert (particles == 0).all()
+    particles = inject_random_particles(
+        particles, 1, free_cells, map.shape, params)
+    assert (particles[2, :] != 0).all()
+    assert np.isclose(particles[3, :].sum(), 1)
+
+def test_get_weighted_moments():
+    rng = np.random.default_rng(0)
+    n = 100000
+    particles = np.empty((4, n))
+    particles[0, :] = rng.normal(100, 0.1, n)
+    particles[1, :] = rng.normal(-2, 0.2, n)
+    # yaws around pi, on both sides of the discontinuity
+    particles[2, :] = np.angle(np.exp(1j * rng.normal(np.pi, 0.05, n)))
+    particles[3, :] = 1
+    mean, covariance = get_weighted_moments(particles)
+    assert np.allclose(mean[:2], [100, -2], atol=0.01)
+    assert np.isclose(np.abs(mean[2]), np.pi, atol=0.01)
+    assert np.allclose(
+        covariance,
+        np.diag([0.1**2, 0.2**2, 0.05**2]),
+        rtol=0.05,
+        atol=1e-4,
+    )
+    assert np.allclose(get_weighted_mean(particles), mean)
+
+def test_get_top_modes():
+    particles = np.array([
+        [0, 0.01, 2, 2.01, 5],
+        [0, 0.01, 2, 2.01, 5],
+        [0, 0, 1, 1, 3],
+        [0.2, 0.2, 0.25, 0.25, 0.1],
+    ])
+    modes = get_top_modes(particles, k=2)
+    assert modes.shape == (4, 2)
+    assert np.allclose(modes[:, 0], [2.005, 2.005, 1, 0.5])
+    assert np.allclose(modes[:, 1], [0.005, 0.005, 0, 0.4])
+    assert np.allclose(get_best_mode(particles), modes[:3, 0])
+    # a single bin holds all the particles
+    mode = get_top_modes(particles, k=3, cell_size=10, n_yaw_bins=1)
+    assert mode.shape == (4, 1)
+    assert np.isclose(mode[3, 0], 1)
+    assert np.allclose(mode[:2, 0], np.average(
+        particles[:2], axis=1, weights=particles[3]))
+
+def test_get_estimator():
+    particles = np.array([
+        [0, 1],
+        [0, 1],
+        [0, 0],
+        [0.4, 0.6],
+    ], dtype=float)
+    assert np.allclose(get_estimator("best")(particles), [1, 1, 0])
+    assert np.allclose(get_estimator("mean")(particles), [0.6, 0.6, 0])
+    assert get_estimator(get_weighted_mean) is get_weighted_mean
+    # estimators are saved with the agents
+    for name, estimator in ESTIMATORS.items():
+        assert pickle.loads(pickle.dumps(estimator)) is estimator
+
+def test_get_correlation_score_packed():
+    rng = np.random.default_rng(0)
+    params = init_params_dict(10, 10)
+    grid = rng.normal(size=(100, 100))
+    target_cells = rng.integers(100, size=(2, 8, 50))
+    correlation_matrix = np.array([[0, -1], [-1, 10]])
+    scores = get_correlation_score(grid, target_cells, correlation_matrix)
+    assert scores.shape == (50,)
+    assert scores[3] == get_correlation_score(
+        grid, target_cells[:, :, 3], correlation_matrix)
+    assert (scores == get_correlation_score(
+        grid, target_cells, correlation_matrix,
+        occupancy=pack_occupancy(grid),
+    )).all()
@@ -0,0 +1,196 @@
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict, create_empty_map, \
+    discretize, target_cell
+from crazyslam.simulation import create_synthetic_map, waypoint_trajectory, \
+    simulate_flight
+from crazyslam.localizer import *
+
+
+@pytest.fixture
+def params():
+    return init_params_dict(size=11, resolution=1)
+
+@pytest.fixture
+def grid_map(params):
+    grid_map = create_empty_map(params)
+    grid_map[[2, 6, 8], [1, 1, 5]] = 10
+    grid_map[[1, 7, 8], [1, 2, 3]] = -5
+    return grid_map
+
+@pytest.fixture
+def correlation_matrix():
+    return np.array([
+        [0, -1],
+        [0,  1],
+    ])
+
+@pytest.mark.parametrize("likelihood_sigma", [None, 0.5])
+def test_update_state(params, grid_map, correlation_matrix, likelihood_sigma):
+    particles = np.array([
+        [  1,   2],
+        [  0,   0],
+        [  0,   1],
+        [0.5, 0.5],
+    ], dtype=float)
+    localizer = Localizer(
+        grid_map,
+        params,
+        np.array([0, np.pi / 2]),
+        particles,
+        np.zeros((3, 3)),
+        correlation_matrix,
+        likelihood_sigma=likelihood_sigma,
+    )
+    localizer.resampling_threshold = 0
+    state = localizer.update_state(np.array([2, 4]), np.zeros(3))
+    assert localizer.particles[-1, 0] > localizer.particles[-1, 1]
+    assert np.allclose(state, [1, 0, 0])
+
+def test_step(params, grid_map, correlation_matrix):
+    particles = np.zeros((4, 20))
+    particles[3, :] = 1 / 20
+    localizer = Localizer(
+        grid_map,
+        params,
+        np.array([0, np.pi / 2]),
+        particles,
+        np.diag([1e-10, 1e-10, 1e-10]),
+        correlation_matrix,
+    )
+    motion_batch = np.array([
+        [0.5, 0.5, 0],
+        [0, 0, 0],
+        [0, 0, 0],
+    ])
+    states = localizer.step(np.array([[2, 2, 2], [4, 4, 4]]), motion_batch)
+    assert states.shape == (3, 3)
+    assert np.allclose(states[0, :], [0.5, 1, 1], atol=1e-3)
+
+def test_relocalize(params, correlation_matrix):
+    # corridor along the x axis, closed at x = 9
+    grid_map = -np.ones((11, 11))
+    grid_map[:, [4, 6]] = 10
+    grid_map[9, :] = 10
+    angles = np.array([0, np.pi / 2, -np.pi / 2])
+    localizer = Localizer(
+        grid_map,
+        params,
+        angles,
+        np.zeros((4, 2000)),
+        np.diag([1e-4, 1e-4, 1e-4]),
+        correlation_matrix,
+        alpha_slow=0.1,
+        alpha_fast=0.5,
+    )
+    localizer.relocalize()
+    cells = discretize(localizer.particles[:2, :], params)
+    assert (grid_map[cells[0], cells[1]] < 0).all()
+    # vehicle at (2, 0) facing the end of the corridor: the estimate must
+    # explain all the observations
+    ranges = np.array([2, 1, 1])
+    state = localizer.update_state(ranges, np.zeros(3))
+    targets = discretize(target_cell(state, ranges, angles), params)
+    assert (grid_map[targets[0], targets[1]] > 0).all()
+
+def test_relocalize_coarse(params, correlation_matrix):
+    grid_map = -np.ones((11, 11))
+    grid_map[:, [4, 6]] = 10
+    grid_map[9, :] = 10
+    angles = np.array([0, np.pi / 2, -np.pi / 2])
+    localizer = Localizer(
+        grid_map,
+        params,
+        angles,
+        np.zeros((4, 200)),
+        np.diag([1e-4, 1e-4, 1e-4]),
+        correlation_matrix,
+        n_levels=2,
+        rng=0,
+    )
+    ranges = np.array([2, 1, 1])
+    localizer.relocalize()
+    uniform = localizer.score_coarse(localizer.particles[:3], ranges, angles)
+    localizer.relocalize(ranges)
+    assert localizer.particles.shape == (4, 200)
+    assert np.isclose(localizer.particles[3, :].sum(), 1)
+    cells = discretize(localizer.particles[:2, :], params)
+    assert (grid_map[cells[0], cells[1]] < 0).all()
+    coarse = localizer.score_coarse(localizer.particles[:3], ranges, angles)
+    assert coarse.min() >= uniform.mean()
+    assert coarse.mean() > uniform.mean()
+
+def test_kidnapped(params, correlation_matrix):
+    grid_map = -np.ones((11, 11))
+    grid_map[:, [4, 6]] = 10
+    grid_map[9, :] = 10
+    angles = np.array([0, np.pi / 2, -np.pi / 2])
+    particles = np.zeros((4, 500))
+    particles[0, :] = 2
+    particles[3, :] = 1 / 500
+    localizer = Localizer(
+        grid_map,
+        params,
+        angles,
+        particles,
+        np.diag([1e-4, 1e-4, 1e-4]),
+        correlation_matrix,
+        alpha_slow=0.1,
+        alpha_fast=0.5,
+        rng=0,
+    )
+    for _ in range(5):
+        localizer.update_state(np.array([2, 1, 1]), np.zeros(3))
+    assert (np.abs(localizer.particles[0, :] - 2) < 0.5).all()
+    # the vehicle is moved away: none of the beams hits a wall anymore
+    for _ in range(3):
+        localizer.update_state(np.array([0.5, 0.5, 0.5]), np.zeros(3))
+    assert (np.abs(localizer.particles[0, :] - 2) > 0.5).any()
+
+def test_tracking_with_injection():
+    params = init_params_dict(size=10, resolution=10)
+    occupancy = create_synthetic_map(params, n_obstacles=8, rng=1)
+    states, _ = waypoint_trajectory(
+        [[-3, 3, 3, -3], [-3, -3, 3, 3]], speed=0.5, rate=10
+    )
+    angles = np.linspace(0, 2 * np.pi, 36, endpoint=False)
+    ranges, hits, motion_updates = simulate_flight(
+        occupancy, params, states, angles, range_std=0.01, dropout=0.05,
+        motion_std=(0.01, 0.01, 0.01), rng=2,
+    )
+    motion_updates[:, 0] = 0
+    errors = []
+    for alphas in [(None, None), (0.001, 0.1), (0.1, 0.5)]:
+        particles = np.zeros((4, 100))
+        particles[:3, :] = states[:, :1]
+        particles[3, :] = 1 / 100
+        localizer = Localizer(
+            np.where(occupancy, 10., -10.),
+            params,
+            angles,
+            particles,
+            np.diag([1e-4, 1e-4, 1e-4]),
+            np.array([[0, -1], [-1, 10]]),
+            alpha_slow=alphas[0],
+            alpha_fast=alphas[1],
+            rng=3,
+        )
+        estimates = localizer.step(ranges, motion_updates, hits)
+        errors.append(np.hypot(*(estimates[:2] - states[:2])).mean())
+    # a localizer that tracks the vehicle must not inject random particles
+    assert errors[0] < 0.1
+    assert max(errors[1:]) < 2 * errors[0]
+
+def test_current_state_copy(params, grid_map, correlation_matrix):
+    particles = np.zeros((4, 2))
+    particles[3, :] = 0.5
+    localizer = Localizer(
+        grid_map,
+        params,
+        np.array([0, np.pi / 2]),
+        particles,
+        np.zeros((3, 3)),
+        correlation_matrix,
+    )
+    localizer.particles[:3, :] += 1
+    assert (localizer.current_state == 0).all()
@@ -1,3 +1,5 @@
+import copy
+import pickle
 import pytest
 from crazyslam.mapping import *
 
@@ -40,6 +42,29 @@ def test_discretize(params):
     ]).T
     assert (discretize(pos, params) == ref).all()
 
+def test_is_outside(params):
+    pos = np.array([
+        [0, 0],
+        [-15.05, 0],
+        [-15.15, 0],
+        [14.95, 0],
+        [15, 0],
+        [-130, 140]
+    ]).T
+    ref = np.array([False, False, True, False, True, True])
+    assert (is_outside(pos, params) == ref).all()
+    assert is_outside(pos.reshape((2, 3, 2)), params).shape == (3, 2)
+
+def test_cell_to_position(params):
+    cells = np.array([[150, 150], [149, 151], [0, 299]]).T
+    ref = np.array([[0, 0], [-0.15, 0.15], [-15.05, 14.95]]).T
+    assert np.allclose(cell_to_position(cells, params), ref)
+    fractions = np.random.default_rng(0).uniform(size=(2, 3, 1000))
+    positions = cell_to_position(cells[:, :, None], params, fractions)
+    assert (discretize(positions, params) == cells[:, :, None]).all()
+    # the origin cell is twice as large as the others
+    assert np.ptp(positions[:, 0], axis=1).min() > 0.19
+
 def test_target_cell():
     state = np.array([10, 10, 0])
     sensor_range = np.array([1, 2, 5, 10])
@@ -55,6 +80,22 @@ def test_target_cell():
         targets,
     ).all()
 
+def test_target_cell_float32():
+    states = np.array([[10, 10, 0], [1, 2, 3]], dtype=np.float32).T
+    sensor_range = np.array([1, 2, 5, 10])
+    sensor_bearing = np.array([0, np.pi / 4, np.pi / 2, np.pi])
+    targets = target_cell(states, sensor_range, sensor_bearing)
+    assert targets.dtype == np.float32
+    assert np.allclose(
+        targets,
+        target_cell(states.astype(np.float64), sensor_range, sensor_bearing),
+        atol=1e-5,
+    )
+
+def test_create_empty_map_dtype(params):
+    assert create_empty_map(params).dtype == np.float64
+    assert create_empty_map(params, np.float32).dtype == np.float32
+
 def test_target_cell_multi():
     states = np.array([
         [10, 10, 10],
@@ -101,3 +142,173 @@ def test_update_grid_map():
     assert map[11, 9]  > 0 and (map[11, 10:12] < 0).all() # second target + path
     assert map[8, 11]  > 0 and (map[9:12, 11] < 0).all() # third target + path
     assert map[11, 16] > 0 and (map[11, 12:16] < 0).all() # third target + path
+
+def test_update_grid_map_dirty_regions():
+    params = init_params_dict(size=23, resolution=1)
+    map = create_empty_map(params)
+    state = np.array([0, 0, 0])
+    ranges = np.array([1, 2, 3, 5])
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    dirty_regions = list()
+    map = update_grid_map(map, ranges, angles, state, params, dirty_regions)
+    assert dirty_regions == [(8, 13, 9, 17)]
+    x_min, x_max, y_min, y_max = dirty_regions[0]
+    outside = np.ones_like(map, dtype=bool)
+    outside[x_min:x_max, y_min:y_max] = False
+    assert (map[outside] == 0).all()
+
+def test_merge_dirty_regions():
+    assert merge_dirty_regions([]) is None
+    assert merge_dirty_regions([(8, 13, 9, 17), (2, 10, 12, 20)]) \
+        == (2, 13, 9, 20)
+
+def test_get_packed_occupancy():
+    grid = np.zeros((5, 19))
+    grid[[0, 2, 4, 4], [0, 9, 17, 18]] = 1
+    grid[1, 3] = -1
+    cells = np.array([
+        [0, 2, 4, 4, 1, 3],
+        [0, 9, 17, 18, 3, 7],
+    ])
+    assert (get_packed_occupancy(pack_occupancy(grid), cells)
+            == (grid[cells[0], cells[1]] > 0)).all()
+
+def test_build_map_pyramid():
+    occupancy = np.zeros((5, 8), dtype=bool)
+    occupancy[4, 7] = True
+    pyramid = build_map_pyramid(occupancy, 3)
+    assert [level.shape for level in pyramid] == [(5, 8), (3, 4), (2, 2)]
+    assert pyramid[1][2, 3] and pyramid[1].sum() == 1
+    assert pyramid[2][1, 1] and pyramid[2].sum() == 1
+
+def test_compute_likelihood_field():
+    params = init_params_dict(size=11, resolution=1)
+    grid = create_empty_map(params)
+    grid[5, 5] = 10
+    field = compute_likelihood_field(grid, params, sigma=1)
+    assert field[5, 5] == field.max()
+    assert field[5, 6] > field[5, 7] > field[5, 9]
+
+def test_map_params(params):
+    map_params = MapParams(30, 10)
+    assert map_params == params
+    assert map_params["origin"] == params["origin"]
+    assert map_params.shape == (300, 300)
+    assert map_params.bounds == ((-15, 15), (-15, 15))
+    assert get_map_params(map_params) is map_params
+    assert get_map_params(params) == map_params
+    with pytest.raises(AttributeError):
+        map_params.resolution = 20
+    with pytest.raises(KeyError):
+        map_params["shape"]
+
+def test_map_params_invalid():
+    for size, resolution, origin in [
+        (0, 10, None),
+        (-1, 10, None),
+        ((2, 0), 10, None),
+        (10, 0, None),
+        (10, -1, None),
+        (10, 10, (-1, 50)),
+        (10, 10, (50, 100)),
+        ((2, 4), 10, (30, 5)),
+    ]:
+        with pytest.raises(ValueError):
+            MapParams(size, resolution, origin)
+    # last cell of the map
+    assert MapParams((2, 4), 10, (19, 39)).origin == (19, 39)
+
+def test_map_params_pickle():
+    map_params = MapParams((2.5, 4), 10, origin=(3, 5))
+    for copied in (
+        pickle.loads(pickle.dumps(map_params)),
+        copy.deepcopy(map_params),
+        copy.copy(map_params),
+    ):
+        assert copied == map_params
+        assert copied.shape == map_params.shape
+        assert (copied.origin_offset == map_params.origin_offset).all()
+
+def test_map_params_rectangular():
+    map_params = MapParams((2.5, 4), 10)
+    assert map_params.shape == (25, 40)
+    assert map_params.origin == (12, 20)
+    assert create_empty_map(map_params).shape == (25, 40)
+    pos = np.array([
+        [0, 0],
+        [10, 10],
+        [-0.45, 1.99],
+        [-10, -10],
+    ]).T
+    ref = np.array([
+        [12, 20],
+        [24, 39],
+        [8, 39],
+        [0, 0],
+    ]).T
+    assert (discretize(pos, map_params) == ref).all()
+
+def test_discretize_multi(params):
+    pos = np.random.uniform(-20, 20, size=(2, 4, 5))
+    idx = discretize(pos, MapParams(30, 10))
+    assert idx.shape == (2, 4, 5) and idx.dtype == np.int16
+    for i in range(5):
+        assert (idx[:, :, i] == discretize(pos[:, :, i], params)).all()
+
+def test_bresenham_lines():
+    start = np.array([20, 20])
+    ends = np.random.randint(0, 40, size=(2, 50))
+    cells, line_idx = bresenham_lines(np.repeat(start.reshape((2, 1)), 50, 1), ends)
+    ref = bresenham_line(start, ends)
+    assert [tuple(c) for c in cells.T] == ref
+    assert (np.diff(line_idx) >= 0).all()
+
+def test_update_grid_map_batch(params):
+    n_scans = 20
+    states = np.stack((
+        np.random.uniform(-5, 5, n_scans),
+        np.random.uniform(-5, 5, n_scans),
+        np.random.uniform(-np.pi, np.pi, n_scans),
+    ))
+    angles = np.linspace(-np.pi, np.pi, 30, endpoint=False)
+    ranges = np.random.uniform(0, 8, (30, n_scans))
+    sequential = create_empty_map(params)
+    for i in range(n_scans):
+        sequential = update_grid_map(
+            sequential, ranges[:, i], angles, states[:, i], params)
+    dirty_regions = list()
+    batch = update_grid_map_batch(
+        create_empty_map(params), ranges, angles, states, params,
+        dirty_regions,
+    )
+    assert np.allclose(batch, sequential)
+    assert len(dirty_regions) == 1
+    x_min, x_max, y_min, y_max = dirty_regions[0]
+    assert np.isclose(
+        np.abs(batch).sum(),
+        np.abs(batch[x_min:x_max, y_min:y_max]).sum(),
+    )
+
+def test_update_grid_map_hits():
+    params = init_params_dict(size=23, resolution=1)
+    map = create_empty_map(params)
+    state = np.array([0, 0, 0])
+    ranges = np.array([1, 2, 3, 5])
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    hits = np.array([True, False, True, False])
+    map = update_grid_map(map, ranges, angles, state, params, hits=hits)
+    assert map[12, 11] > 0 # first target
+    assert map[8, 11]  > 0 and (map[9:12, 11] < 0).all() # third target
+    assert (map[11, 9:12] < 0).all() # no hit, free until the end
+    assert (map[11, 12:17] < 0).all() # no hit, free until the end
+    assert (map > 0).sum() == 2
+
+def test_update_packed_occupancy():
+    np.random.seed(0)
+    grid = np.random.normal(size=(20, 30))
+    packed = pack_occupancy(grid)
+    regions = [(3, 7, 5, 11), (0, 20, 27, 30), (10, 11, 0, 1)]
+    for x_min, x_max, y_min, y_max in regions:
+        grid[x_min:x_max, y_min:y_max] *= -1
+    update_packed_occupancy(packed, grid, regions)
+    assert (packed == pack_occupancy(grid)).all()
@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+from crazyslam.mapping import target_cell
+from crazyslam.motion import *
+
+
+@pytest.fixture
+def states():
+    return np.array([
+        [0, 1, -2],
+        [0, 2, 3],
+        [0, np.pi / 2, -np.pi / 3],
+    ], dtype=float)
+
+def test_global_delta_model(states):
+    ref = states + np.array([[1], [-1], [0.1]])
+    assert np.allclose(global_delta_model(states, np.array([1, -1, 0.1])), ref)
+
+def test_body_to_global(states):
+    # a displacement along a scan angle ends on the observed target
+    body_delta = np.array([[2, 0, -1], [0, 3, 1]], dtype=float)
+    ranges = np.linalg.norm(body_delta, axis=0)
+    bearings = np.arctan2(body_delta[1], body_delta[0])
+    for i in range(states.shape[1]):
+        target = target_cell(states[:, i], ranges[i:i+1], bearings[i:i+1])
+        assert np.allclose(
+            states[:2, i] + body_to_global(states, body_delta)[:, i],
+            target,
+        )
+
+def test_odometry_model(states):
+    ref = states.copy()
+    ref[:2, :] += body_to_global(states, np.array([[1], [0]]))
+    ref[2, :] += 0.5
+    odometry_model(states, np.array([1, 0, 0.5]))
+    assert np.allclose(states, ref)
+
+def test_odometry_model_noise():
+    states = np.zeros((3, 10000))
+    states[2, :] = np.pi / 2
+    odometry_model(states, np.zeros(3), np.array([0.1, 0, 0]))
+    # noise on the body x axis only moves along the heading direction
+    assert np.allclose(states[0, :], 0)
+    assert np.isclose(states[1, :].std(), 0.1, rtol=0.1)
+
+def test_velocity_model(states):
+    straight = states.copy()
+    odometry_model(straight, np.array([2, 0, 0]))
+    velocity_model(states, (1, 0, 2))
+    assert np.allclose(states, straight)
+
+def test_velocity_model_arc():
+    states = np.zeros((3, 1))
+    velocity_model(states, (1, np.pi / 2, 1))
+    assert np.allclose(states[:, 0], [2 / np.pi, -2 / np.pi, np.pi / 2])
+
+def test_get_motion_model():
+    assert get_motion_model("odometry") is odometry_model
+    assert get_motion_model(velocity_model) is velocity_model
+    with pytest.raises(AssertionError):
+        get_motion_model("teleport")
+
+def test_frame_to_frame():
+    state = np.array([1., 0., 0.])
+    assert np.allclose(frame_to_frame(state, (0, 0, 0))[:, 0], state)
+    # same convention as mapping.target_cell: a yaw of pi/2 points to -y
+    assert np.allclose(
+        frame_to_frame(state, (2, 1, np.pi / 2))[:, 0],
+        [2, 0, np.pi / 2],
+    )
+
+def test_get_relative_pose(states):
+    reference = states[:, ::-1]
+    relative = get_relative_pose(states, reference)
+    for k in range(3):
+        back = frame_to_frame(relative[:, k], reference[:, k])[:, 0]
+        assert np.allclose(back[:2], states[:2, k])
+        assert np.isclose(wrap_angles(back[2] - states[2, k]), 0)
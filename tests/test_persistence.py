@@ -0,0 +1,105 @@
+import pytest
+import numpy as np
+from crazyslam.slam import SLAM
+from crazyslam.mapping import init_params_dict
+from crazyslam.persistence import *
+
+
+@pytest.fixture
+def slam_agent():
+    slam_agent = SLAM(
+        params=init_params_dict(size=10, resolution=10),
+        n_particles=50,
+        current_state=np.array([0.5, -0.2, 0.1]),
+        system_noise_variance=np.diag([1e-3, 1e-3, 1e-4]),
+        correlation_matrix=np.array([[0, -1], [-1, 10]]),
+        estimator="mode",
+    )
+    slam_agent.update_state(
+        np.array([1, 2, 1.5, 3]),
+        np.array([0, np.pi / 2, np.pi, 3*np.pi / 2]),
+        np.array([0.1, 0, 0]),
+    )
+    return slam_agent
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_save_load_session(slam_agent, tmp_path, lazy):
+    save_session(slam_agent, str(tmp_path / "session"))
+    loaded = load_session(str(tmp_path / "session"), lazy=lazy)
+    # the map is not read to pack it at load
+    assert loaded.packed_map is None
+    assert loaded.params == slam_agent.params
+    assert (loaded.map == slam_agent.map).all()
+    assert (loaded.particles == slam_agent.particles).all()
+    assert (loaded.current_state == slam_agent.current_state).all()
+    assert loaded.resampling_threshold == slam_agent.resampling_threshold
+    assert loaded.estimator is slam_agent.estimator
+    assert loaded.dtype == slam_agent.dtype
+
+def test_save_load_float32(tmp_path):
+    slam_agent = SLAM(
+        params=init_params_dict(size=10, resolution=10),
+        n_particles=50,
+        current_state=np.zeros(3),
+        system_noise_variance=np.diag([1e-3, 1e-3, 1e-4]),
+        correlation_matrix=np.array([[0, -1], [-1, 10]]),
+        dtype=np.float32,
+    )
+    save_session(slam_agent, str(tmp_path / "session"))
+    loaded = load_session(str(tmp_path / "session"))
+    assert loaded.dtype == np.float32
+    assert loaded.map.dtype == np.float32
+    assert loaded.particles.dtype == np.float32
+
+def test_resume_session(slam_agent, tmp_path):
+    ranges = np.array([1.2, 2, 1.5, 2.5])
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    motion_update = np.array([0, 0.1, 0])
+    save_session(slam_agent, str(tmp_path / "session"))
+    state = slam_agent.update_state(ranges, angles, motion_update)
+    loaded = load_session(str(tmp_path / "session"), restore_rng=True)
+    loaded_state = loaded.update_state(ranges, angles, motion_update)
+    assert (state == loaded_state).all()
+    assert (slam_agent.map == loaded.map).all()
+    # copy-on-write: the saved map is left untouched
+    assert not (load_session(str(tmp_path / "session")).map
+                == loaded.map).all()
+
+def test_resume_session_generator(slam_agent, tmp_path):
+    ranges = np.array([1.2, 2, 1.5, 2.5])
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    motion_update = np.array([0, 0.1, 0])
+    slam_agent.rng = np.random.default_rng(3)
+    save_session(slam_agent, str(tmp_path / "session"))
+    state = slam_agent.update_state(ranges, angles, motion_update)
+    np.random.seed(0)  # the global state is not used
+    loaded = load_session(str(tmp_path / "session"), restore_rng=True)
+    assert isinstance(loaded.rng, np.random.Generator)
+    loaded_state = loaded.update_state(ranges, angles, motion_update)
+    assert (state == loaded_state).all()
+
+def test_load_custom_functions(slam_agent, tmp_path):
+    slam_agent.estimator = lambda particles: particles[:3, 0]
+    save_session(slam_agent, str(tmp_path / "session"))
+    with pytest.raises(ValueError):
+        load_session(str(tmp_path / "session"))
+    estimator = lambda particles: particles[:3, 1]
+    loaded = load_session(str(tmp_path / "session"), estimator=estimator)
+    assert loaded.estimator is estimator
+    slam_agent.motion_model = lambda states, *args: states
+    save_session(slam_agent, str(tmp_path / "session"))
+    with pytest.raises(ValueError):
+        load_session(str(tmp_path / "session"), estimator=estimator)
+
+def test_restore_rng(slam_agent, tmp_path):
+    np.random.seed(1)
+    save_session(slam_agent, str(tmp_path / "session"))
+    saved = np.random.uniform()
+    np.random.seed(2)
+    expected = np.random.uniform()
+    # the global state is left untouched by default
+    np.random.seed(2)
+    load_session(str(tmp_path / "session"))
+    assert np.random.uniform() == expected
+    load_session(str(tmp_path / "session"), restore_rng=True)
+    assert np.random.uniform() == saved
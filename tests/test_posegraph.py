@@ -0,0 +1,85 @@
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict, create_empty_map, \
+    update_grid_map
+from crazyslam.motion import get_relative_pose
+from crazyslam.posegraph import *
+
+
+@pytest.fixture
+def trajectory():
+    t = np.linspace(0, 2*np.pi, 200)
+    return np.stack((np.cos(t), np.sin(t), t))
+
+def test_consistent_graph(trajectory):
+    # states that satisfy all the constraints don't move
+    graph = PoseGraph(trajectory)
+    graph.add_odometry(trajectory, 0.01)
+    graph.add_prior(0, trajectory[:, 0], 0.1)
+    assert np.isclose(graph.optimize(), 0)
+    assert np.allclose(graph.states, trajectory)
+
+def test_odometry_only(trajectory):
+    # without priors, the first state is fixed and the others follow the
+    # odometry
+    graph = PoseGraph(np.zeros((3, trajectory.shape[1])))
+    graph.states[:, 0] = trajectory[:, 0]
+    graph.add_odometry(trajectory, 0.01)
+    graph.optimize(n_iterations=20, tolerance=1e-10)
+    assert np.allclose(graph.states[:2], trajectory[:2], atol=1e-6)
+
+def test_loop_closure(trajectory):
+    drifted = trajectory + np.linspace(0, 0.2, trajectory.shape[1])
+    graph = PoseGraph(drifted)
+    graph.add_odometry(trajectory, 0.01)
+    graph.add_prior(0, trajectory[:, 0], 0.01)
+    graph.add_relative(
+        0,
+        graph.n_nodes - 1,
+        get_relative_pose(trajectory[:, -1], trajectory[:, 0]),
+        0.01,
+    )
+    graph.optimize()
+    assert np.abs(graph.states - trajectory).max() < 1e-3
+
+def test_window(trajectory):
+    np.random.seed(0)
+    noisy = trajectory + np.random.normal(0, 0.05, trajectory.shape)
+    graph = PoseGraph(noisy)
+    graph.add_odometry(trajectory, 0.01)
+    graph.add_prior(np.arange(graph.n_nodes), noisy, 0.1)
+    graph.optimize(window=50)
+    assert (graph.states[:, :150] == noisy[:, :150]).all()
+    error = np.abs(graph.states[:, 150:] - trajectory[:, 150:]).mean()
+    assert error < np.abs(noisy[:, 150:] - trajectory[:, 150:]).mean()
+
+def test_unconstrained(trajectory):
+    graph = PoseGraph(trajectory)
+    assert graph.optimize() == 0
+    # the last states are added after the last constraint
+    graph.add_odometry(trajectory[:, :100], 0.01)
+    assert graph.optimize(window=50) == 0
+    assert (graph.states == trajectory).all()
+
+def test_smooth_trajectory(trajectory):
+    np.random.seed(0)
+    odometry = trajectory + np.cumsum(
+        np.random.normal(0, 0.005, trajectory.shape), axis=1)
+    slam_states = trajectory + np.random.normal(0, 0.05, trajectory.shape)
+    smoothed = smooth_trajectory(
+        odometry, slam_states,
+        odometry_std=0.005, slam_std=0.05,
+    )
+    assert np.abs(smoothed - trajectory).mean() \
+        < np.abs(slam_states - trajectory).mean() / 2
+
+def test_render_map(trajectory):
+    params = init_params_dict(size=10, resolution=10)
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    ranges = np.full((4, trajectory.shape[1]), 2.)
+    grid = render_map(trajectory, ranges, angles, params, batch_size=64)
+    expected = create_empty_map(params)
+    for t in range(trajectory.shape[1]):
+        update_grid_map(expected, ranges[:, t], angles, trajectory[:, t],
+                        params)
+    assert np.allclose(grid, expected)
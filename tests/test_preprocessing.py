@@ -0,0 +1,22 @@
+import pytest
+import numpy as np
+from crazyslam.preprocessing import *
+
+
+def test_get_multiranger_ranges():
+    data = {
+        "range.zrange": 300,
+        "range.up": 8000,
+        "range.front": 1200,
+        "range.back": 65535,
+        "range.left": 0,
+        "range.right": 2500,
+    }
+    assert (get_multiranger_ranges(data) == [1200, 0, 65535, 2500]).all()
+
+def test_preprocess_ranges():
+    raw_ranges = np.array([1200, 0, 65535, 2500], dtype=np.uint16)
+    ranges, angles, hits = preprocess_ranges(raw_ranges, MULTIRANGER_ANGLES)
+    assert np.allclose(ranges, [1.2, 4, 2.5])
+    assert np.allclose(angles, MULTIRANGER_ANGLES[[0, 2, 3]])
+    assert (hits == [True, False, True]).all()
@@ -0,0 +1,37 @@
+import json
+import numpy as np
+from crazyslam.rng import *
+
+
+def test_get_rng():
+    assert get_rng() is np.random
+    assert get_rng(np.random) is np.random
+    rng = np.random.default_rng(0)
+    assert get_rng(rng) is rng
+    assert get_rng(3).uniform() == get_rng(3).uniform()
+    assert get_rng(3).uniform() != get_rng(4).uniform()
+
+def test_spawn_rngs():
+    rngs = spawn_rngs(42, 3)
+    assert len(rngs) == 3
+    draws = [rng.uniform(size=5) for rng in rngs]
+    assert not np.allclose(draws[0], draws[1])
+    assert not np.allclose(draws[1], draws[2])
+    # reproducible
+    again = [rng.uniform(size=5) for rng in spawn_rngs(42, 3)]
+    assert all((a == b).all() for a, b in zip(draws, again))
+    # spawned from a generator
+    assert len(spawn_rngs(np.random.default_rng(0), 2)) == 2
+
+def test_rng_state():
+    rng = np.random.default_rng(5)
+    state = json.loads(json.dumps(get_rng_state(rng)))
+    expected = rng.normal(size=4)
+    restored = set_rng_state(state)
+    assert (restored.normal(size=4) == expected).all()
+
+    np.random.seed(5)
+    state = json.loads(json.dumps(get_rng_state()))
+    expected = np.random.normal(size=4)
+    assert set_rng_state(state) is None
+    assert (np.random.normal(size=4) == expected).all()
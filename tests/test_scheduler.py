@@ -0,0 +1,77 @@
+import pytest
+import numpy as np
+from crazyslam.slam import SLAM
+from crazyslam.mapping import init_params_dict
+from crazyslam.scheduler import *
+
+
+@pytest.fixture
+def scheduler():
+    slam_agent = SLAM(
+        params=init_params_dict(size=10, resolution=10),
+        n_particles=200,
+        current_state=np.zeros(3),
+        system_noise_variance=np.diag([1e-3, 1e-3, 1e-4]),
+        correlation_matrix=np.array([[0, -1], [-1, 10]]),
+    )
+    return LatencyScheduler(
+        slam_agent,
+        deadline=0.1,
+        min_beams=4,
+        max_beams=16,
+        max_map_period=2,
+        min_particles=50,
+    )
+
+def test_step(scheduler):
+    angles = np.linspace(-np.pi, np.pi, 100, endpoint=False)
+    state = scheduler.step(2 * np.ones(100), angles, np.zeros(3))
+    assert state.shape == (3,)
+    assert scheduler.n_steps == 1
+    assert scheduler.slam_agent.map.any()
+
+def test_degrade_restore(scheduler):
+    # beams first, then map updates, then particles
+    scheduler.record(0.16)
+    assert scheduler.n_beams == 8
+    while scheduler.n_beams > 4:
+        assert scheduler.map_period == 1
+        scheduler.record(0.16)
+    scheduler.record(0.16)
+    assert scheduler.map_period == 2
+    scheduler.record(0.16)
+    assert scheduler.slam_agent.n_particles == 100
+    assert scheduler.slam_agent.particles.shape == (4, 100)
+    for _ in range(10):
+        scheduler.record(1)
+    assert scheduler.slam_agent.n_particles == 50
+    # restored in the reverse order
+    scheduler.record(0.01)
+    assert scheduler.slam_agent.n_particles == 55
+    assert scheduler.map_period == 2 and scheduler.n_beams == 4
+    for _ in range(100):
+        scheduler.record(0.01)
+    assert scheduler.slam_agent.n_particles == 200
+    assert scheduler.map_period == 1 and scheduler.n_beams == 16
+
+def test_small_scan(scheduler):
+    # the 4 beams of the Multi-ranger: only the map updates and the
+    # particles can be reduced
+    angles = np.array([0, np.pi / 2, np.pi, 3*np.pi / 2])
+    scheduler.step(np.array([1, 2, 1.5, 3]), angles, np.zeros(3))
+    assert scheduler.n_beams == 4
+    for _ in range(5):
+        scheduler.record(0.16)
+    assert scheduler.map_period == 2
+    assert scheduler.slam_agent.n_particles < 200
+    assert scheduler.n_beams == 4
+
+def test_get_metrics(scheduler):
+    for latency in [0.05, 0.2, 0.05, 0.3]:
+        scheduler.record(latency)
+    metrics = scheduler.get_metrics()
+    assert metrics["n_steps"] == 4
+    assert metrics["n_misses"] == 2
+    assert metrics["miss_rate"] == 0.5
+    assert np.isclose(metrics["mean_latency"], 0.15)
+    assert metrics["max_latency"] == 0.3
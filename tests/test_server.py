@@ -0,0 +1,93 @@
+import threading
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict, create_empty_map, \
+    update_grid_map, discretize
+from crazyslam.motion import frame_to_frame
+from crazyslam.server import *
+
+
+@pytest.fixture
+def params():
+    return init_params_dict(size=10, resolution=10)
+
+@pytest.fixture
+def scan():
+    return (
+        np.array([1, 2, 1.5, 3]),
+        np.array([0, np.pi / 2, np.pi, 3*np.pi / 2]),
+    )
+
+def test_get_cell_positions(params):
+    positions = get_cell_positions(params)
+    idx = discretize(positions.reshape((2, -1)), params)
+    assert (idx == np.indices((100, 100)).reshape((2, -1))).all()
+
+def test_merge_single_agent(params, scan):
+    server = MapServer(params)
+    server.register("cf1")
+    state = np.array([0.5, -0.3, 0.2])
+    server.submit("cf1", *scan, state)
+    assert server.merge() == 1
+    expected = update_grid_map(create_empty_map(params), *scan, state, params)
+    assert (server.get_snapshot() == expected).all()
+    assert (server.get_snapshot("cf1") == expected).all()
+    assert not server.get_snapshot().flags.writeable
+    assert server.merge() == 0
+
+def test_pop_dirty_regions(params, scan):
+    server = MapServer(params)
+    server.register("cf1")
+    server.submit("cf1", *scan, np.zeros(3))
+    server.merge()
+    assert server.pop_dirty_regions() == []
+    server.track_dirty_regions = True
+    server.submit("cf1", *scan, np.zeros(3))
+    server.merge()
+    assert len(server.pop_dirty_regions()) == 1
+    assert server.pop_dirty_regions() == []
+
+def test_merge_with_offset(params, scan):
+    server = MapServer(params)
+    offset = (1, -0.5, np.pi / 2)
+    server.register("cf1")
+    server.register("cf2", offset)
+    state = np.array([0.3, 0.1, 0.])
+    server.submit("cf2", *scan, state)
+    server.merge()
+    expected = update_grid_map(
+        create_empty_map(params),
+        *scan,
+        frame_to_frame(state, offset)[:, 0],
+        params,
+    )
+    assert (server.get_snapshot() == expected).all()
+    # seen from cf2, the obstacles are around its own state estimate
+    agent_map = server.get_snapshot("cf2")
+    own = update_grid_map(create_empty_map(params), *scan, state, params)
+    assert np.mean(np.sign(agent_map) == np.sign(own)) > 0.95
+    assert server.get_snapshot("cf2") is agent_map
+
+def test_concurrent_writers(params, scan):
+    server = MapServer(params)
+    agents = ["cf{}".format(i) for i in range(4)]
+    for agent_id in agents:
+        server.register(agent_id)
+    n_scans = 50
+
+    def fly(agent_id):
+        for _ in range(n_scans):
+            server.submit(agent_id, *scan, np.zeros(3))
+            server.merge()
+
+    threads = [threading.Thread(target=fly, args=(a,)) for a in agents]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.merge(blocking=True)
+    assert all(len(queue) == 0 for queue in server.queues.values())
+    expected = create_empty_map(params)
+    for _ in range(len(agents) * n_scans):
+        update_grid_map(expected, *scan, np.zeros(3), params)
+    assert np.allclose(server.get_snapshot(), expected)
@@ -0,0 +1,84 @@
+import pytest
+import numpy as np
+from crazyslam.mapping import init_params_dict
+from crazyslam.preprocessing import MULTIRANGER_ANGLES, \
+    get_multiranger_ranges, preprocess_ranges
+from crazyslam.simulation import *
+
+
+@pytest.fixture
+def params():
+    return init_params_dict(size=10, resolution=10)
+
+@pytest.fixture
+def room(params):
+    # empty room, walls at the borders of the map
+    return create_synthetic_map(params, n_obstacles=0)
+
+def test_create_synthetic_map(params):
+    np.random.seed(0)
+    occupancy = create_synthetic_map(params, n_obstacles=5)
+    assert occupancy.shape == (100, 100)
+    assert occupancy[0].all() and occupancy[:, -1].all()
+    assert occupancy[1:-1, 1:-1].any()
+
+def test_waypoint_trajectory():
+    states, timestamps = waypoint_trajectory(
+        [[0, 1, 1], [0, 0, -1]], speed=0.5, rate=10)
+    assert states.shape == (3, 40)
+    assert np.allclose(np.diff(timestamps), 0.1)
+    # moving along x, then along -y (yaw of pi/2)
+    assert np.allclose(states[2, :20], 0)
+    assert np.allclose(states[2, 20:], np.pi / 2)
+    assert np.allclose(np.hypot(*np.diff(states[:2], axis=1)), 0.05)
+
+def test_cast_rays(params, room):
+    states = np.array([[0, 2], [0, -1], [0, np.pi / 2]], dtype=float)
+    ranges, hits = cast_rays(room, params, states, MULTIRANGER_ANGLES, 5.5)
+    # the walls are the first and last cells of the map
+    assert hits[:, 0].all()
+    assert np.allclose(ranges[:, 0], 4.95, atol=0.051)
+    # facing -y from (2, -1): the walls on the left and behind the vehicle
+    # are out of range
+    assert np.allclose(ranges[:, 1], [4, 5.5, 5.5, 2.9], atol=0.051)
+    assert (hits[:, 1] == [True, False, False, True]).all()
+
+def test_cast_rays_batches(params, room):
+    states, _ = waypoint_trajectory([[-1, 1], [0, 0]], speed=1, rate=10)
+    ranges, hits = cast_rays(room, params, states, MULTIRANGER_ANGLES, 4.0)
+    # a budget smaller than a single state still casts one state at a time
+    for max_samples in (1, 1000):
+        ranges_1, hits_1 = cast_rays(
+            room, params, states, MULTIRANGER_ANGLES, 4.0,
+            max_samples=max_samples,
+        )
+        assert (ranges_1 == ranges).all()
+        assert (hits_1 == hits).all()
+
+def test_simulate_flight(params, room):
+    np.random.seed(0)
+    states, _ = waypoint_trajectory([[-1, 1], [0, 0]], speed=1, rate=10)
+    ranges, hits, motion_updates = simulate_flight(
+        room, params, states, MULTIRANGER_ANGLES,
+        max_range=6.0, range_std=0.01, dropout=0.5, motion_std=(0.01,)*3,
+    )
+    assert ranges.shape == hits.shape == (4, states.shape[1])
+    assert 0.3 < hits.mean() < 0.7
+    assert np.allclose(np.cumsum(motion_updates, axis=1), states, atol=0.1)
+
+def test_log_stream(params, room):
+    states, _ = waypoint_trajectory([[-1, 1], [0, 0]], speed=1, rate=10)
+    ranges, hits = cast_rays(room, params, states, MULTIRANGER_ANGLES, 4.0)
+    raw = to_raw_ranges(ranges, hits)
+    assert raw.dtype == np.uint16
+    assert (raw[~hits] == OUT_OF_RANGE).all()
+    stream = list(generate_log_stream(states, raw, rate=10))
+    assert len(stream) == states.shape[1]
+    timestamp, data = stream[1]
+    assert timestamp == 100
+    assert np.isclose(data["stateEstimate.x"], states[0, 1])
+    # round trip through the preprocessing of the logged data
+    ranges_1, _, hits_1 = preprocess_ranges(
+        get_multiranger_ranges(data), MULTIRANGER_ANGLES)
+    assert (hits_1 == hits[:, 1]).all()
+    assert np.allclose(ranges_1[hits_1], ranges[hits[:, 1], 1], atol=1e-3)
@@ -0,0 +1,56 @@
+import time
+import pytest
+import numpy as np
+from crazyslam.slam import SLAM
+from crazyslam.mapping import init_params_dict
+from crazyslam.viewer import *
+
+
+@pytest.fixture
+def slam_agent():
+    return SLAM(
+        params=init_params_dict(size=10, resolution=10),
+        n_particles=50,
+        current_state=np.zeros(3),
+        system_noise_variance=np.diag([1e-3, 1e-3, 1e-4]),
+        correlation_matrix=np.array([[0, -1], [-1, 10]]),
+    )
+
+def update(slam_agent):
+    slam_agent.update_state(
+        np.array([1, 2, 1.5, 3]),
+        np.array([0, np.pi / 2, np.pi, 3*np.pi / 2]),
+        np.array([0.1, 0, 0]),
+    )
+
+def test_render(slam_agent):
+    viewer = LiveViewer(slam_agent.params, tile_size=32, figsize=(2, 2))
+    slam_agent.subscribe(viewer.on_update)
+    slam_agent.track_dirty_regions = True
+    assert not viewer.render()
+    empty_frame = viewer.get_frame()
+    update(slam_agent)
+    update(slam_agent)
+    assert viewer.render()
+    assert not (viewer.get_frame() == empty_frame).all()
+    assert len(viewer.trajectory) == 2
+    x_min, x_max, y_min, y_max = slam_agent.pop_dirty_regions()[0]
+    assert np.allclose(
+        viewer.display[x_min:x_max, y_min:y_max],
+        slam_agent.map[x_min:x_max, y_min:y_max],
+    )
+    # the incremental rendering gives the same frame as a full redraw
+    frame = viewer.get_frame()
+    viewer.draw_all()
+    assert (viewer.get_frame() == frame).all()
+
+def test_thread(slam_agent):
+    viewer = LiveViewer(slam_agent.params, fps=50, figsize=(2, 2))
+    viewer.start(slam_agent)
+    for _ in range(5):
+        update(slam_agent)
+    time.sleep(0.1)
+    viewer.stop(slam_agent)
+    assert len(slam_agent.subscribers) == 0
+    assert viewer.n_frames >= 1
+    assert len(viewer.trajectory) == 5